@@ -0,0 +1,192 @@
+"""
+Prueba de carga: requests/segundo sostenidos de un solo worker de uvicorn
+con una mezcla de GET /packages (paginado y filtrado), POST /register y
+POST /withdraw, usando N clientes concurrentes durante T segundos.
+
+Para comparar con la versión sync, prepare una copia del código anterior y
+páselas ambas (cada una corre con su propia base SQLite temporal):
+
+    git worktree add /tmp/paquetes-sync <commit-anterior>
+    python benchmarks/bench_async_endpoints.py \\
+        --app-dir /tmp/paquetes-sync/backend --app-dir .
+
+Uso (desde backend/):
+    python benchmarks/bench_async_endpoints.py [--app-dir DIR ...] [--concurrency 100]
+        [--seconds 15] [--seed 2000] [--database-url URL]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _package(codigo: str) -> dict:
+    return {
+        "sucursal": random.choice(["Santiago", "Concepción", "Valparaíso"]),
+        "recepcionista": "Bench",
+        "proveedor": "Chilexpress",
+        "tipoDocumento": random.choice(["Paquete", "Carta", "Factura"]),
+        "numeroDocumento": codigo,
+        "destinatarioNombre": "Usuario Bench",
+        "destinatarioEmail": "bench@example.com",
+        "medioNotificacion": "Correo",
+        "codigoRetiro": codigo,
+    }
+
+class Servidor:
+    """Levanta `uvicorn main:app` (1 worker) sobre una copia del backend."""
+
+    def __init__(self, app_dir: Path, database_url: str):
+        self.tmp = Path(tempfile.mkdtemp(prefix="bench-async-"))
+        shutil.copytree(app_dir, self.tmp / "app", ignore=shutil.ignore_patterns("*.db", "*.db-*", "__pycache__"))
+        self.port = _free_port()
+        env = {**os.environ, "OUTBOX_POLL_SECONDS": "3600", "TENANT_ID": "", "CLIENT_ID": "", "CLIENT_SECRET": ""}
+        env.pop("DATABASE_URL", None)
+        if database_url:
+            env["DATABASE_URL"] = database_url
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port),
+             "--workers", "1", "--log-level", "warning", "--no-access-log"],
+            cwd=self.tmp / "app", env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def esperar(self, timeout: float = 30):
+        limite = time.time() + timeout
+        while time.time() < limite:
+            try:
+                if httpx.get(f"{self.url}/health", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        raise RuntimeError(f"El servidor en {self.url} no respondió")
+
+    def cerrar(self):
+        self.proc.terminate()
+        self.proc.wait(timeout=10)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+class Conexion:
+    """
+    Cliente HTTP/1.1 keep-alive mínimo sobre asyncio streams. Es bastante más
+    liviano que httpx, así que en máquinas con pocos núcleos el generador de
+    carga no compite tanto por CPU con el servidor que se está midiendo.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: dict = None) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        datos = json.dumps(body).encode() if body is not None else b""
+        cabecera = (
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(datos)}\r\n\r\n"
+        )
+        self.writer.write(cabecera.encode() + datos)
+        status = int((await self.reader.readline()).split()[1])
+        largo = 0
+        while (linea := await self.reader.readline()) not in (b"\r\n", b""):
+            nombre, _, valor = linea.decode().partition(":")
+            if nombre.lower() == "content-length":
+                largo = int(valor)
+        await self.reader.readexactly(largo)
+        return status
+
+    def cerrar(self):
+        if self.writer:
+            self.writer.close()
+
+async def _seed(url: str, run: str, n: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        async def uno(i):
+            async with sem:
+                await client.post("/register", json=_package(f"SEED{run}-{i:06d}"))
+        await asyncio.gather(*(uno(i) for i in range(n)))
+
+async def _carga(port: int, run: str, seed: int, concurrency: int, seconds: float) -> dict:
+    contador = itertools.count()
+    latencias, errores = [], 0
+    fin = time.perf_counter() + seconds
+
+    async def cliente(idx: int):
+        nonlocal errores
+        rnd = random.Random(idx)
+        conexion = Conexion("127.0.0.1", port)
+        try:
+            while time.perf_counter() < fin:
+                i = next(contador)
+                op = rnd.random()
+                inicio = time.perf_counter()
+                if op < 0.5:
+                    status = await conexion.request("GET", f"/packages?limit=50&cursor={rnd.randint(0, seed)}&campos=Id,CodigoRetiro,Estado,FechaRecepcion")
+                elif op < 0.7:
+                    status = await conexion.request("GET", "/packages?estado=Pendiente&sucursal=Santiago&limit=25")
+                elif op < 0.9:
+                    status = await conexion.request("POST", "/register", _package(f"LOAD{run}-{idx:03d}-{i:07d}"))
+                else:
+                    status = await conexion.request("POST", "/withdraw", {"codigo_retiro": f"SEED{run}-{rnd.randrange(seed):06d}", "entregado_a": "Bench"})
+                latencias.append(time.perf_counter() - inicio)
+                if status >= 500:
+                    errores += 1
+        finally:
+            conexion.cerrar()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente(i) for i in range(concurrency)))
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "requests": len(latencias),
+        "rps": len(latencias) / duracion,
+        "p50_ms": latencias[len(latencias) // 2] * 1000,
+        "p95_ms": latencias[int(len(latencias) * 0.95)] * 1000,
+        "errores_5xx": errores,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-dir", action="append", type=Path, help="Directorio backend/ a medir (repetible)")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--seed", type=int, default=2000, help="Paquetes precargados antes de medir")
+    parser.add_argument("--database-url", default="", help="PostgreSQL a usar (por defecto SQLite temporal)")
+    args = parser.parse_args()
+
+    for app_dir in args.app_dir or [BACKEND_DIR]:
+        servidor = Servidor(app_dir.resolve(), args.database_url)
+        # Prefijo por corrida para no chocar con códigos existentes si se usa
+        # una base PostgreSQL persistente
+        run = f"{int(time.time() * 1000) % 10**8:08d}"
+        try:
+            servidor.esperar()
+            asyncio.run(_seed(servidor.url, run, args.seed, 20))
+            r = asyncio.run(_carga(servidor.port, run, args.seed, args.concurrency, args.seconds))
+        finally:
+            servidor.cerrar()
+        print(f"{str(app_dir):40s} {r['rps']:8.1f} req/s  p50 {r['p50_ms']:7.1f} ms  "
+              f"p95 {r['p95_ms']:7.1f} ms  ({r['requests']} requests, {r['errores_5xx']} errores 5xx)")
+
+if __name__ == "__main__":
+    main()
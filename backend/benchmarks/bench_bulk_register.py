@@ -0,0 +1,70 @@
+"""
+Benchmark: registrar N paquetes (por defecto 1.000) con N llamadas a
+POST /register (lo que hacía el formulario) versus una sola llamada a
+POST /register/bulk, contra un uvicorn local con base SQLite temporal.
+
+Reporta el tiempo total, paquetes/segundo y cuántas notificaciones quedaron
+en el outbox (bulk agrupa por destinatario).
+
+Uso (desde backend/):
+    python benchmarks/bench_bulk_register.py [--rows 1000] [--destinatarios 50]
+        [--database-url URL]
+"""
+import argparse
+import random
+import time
+from pathlib import Path
+
+import httpx
+
+from bench_async_endpoints import BACKEND_DIR, Servidor
+
+def _filas(n: int, destinatarios: int, prefijo: str) -> list:
+    return [
+        {
+            "sucursal": random.choice(["Santiago", "Concepción", "Valparaíso"]),
+            "recepcionista": "Bench",
+            "proveedor": "Chilexpress",
+            "tipoDocumento": random.choice(["Paquete", "Carta", "Factura"]),
+            "numeroDocumento": f"{prefijo}{i:06d}",
+            "destinatarioNombre": f"Usuario {i % destinatarios}",
+            "destinatarioEmail": f"usuario{i % destinatarios}@example.com",
+            "medioNotificacion": "Correo",
+        }
+        for i in range(n)
+    ]
+
+def _uno_a_uno(client: httpx.Client, filas: list):
+    for fila in filas:
+        client.post("/register", json=fila).raise_for_status()
+
+def _masivo(client: httpx.Client, filas: list):
+    client.post("/register/bulk", json=filas).raise_for_status()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--destinatarios", type=int, default=50, help="Destinatarios distintos entre las filas")
+    parser.add_argument("--app-dir", type=Path, default=BACKEND_DIR)
+    parser.add_argument("--database-url", default="", help="PostgreSQL a usar (por defecto SQLite temporal)")
+    args = parser.parse_args()
+
+    servidor = Servidor(args.app_dir.resolve(), args.database_url)
+    try:
+        servidor.esperar()
+        with httpx.Client(base_url=servidor.url, timeout=300) as client:
+            for nombre, funcion in (("/register x N", _uno_a_uno), ("/register/bulk", _masivo)):
+                prefijo = f"B{int(time.time() * 1000) % 10**8:08d}"
+                antes = client.get("/metrics").json()
+                inicio = time.perf_counter()
+                funcion(client, _filas(args.rows, args.destinatarios, prefijo))
+                duracion = time.perf_counter() - inicio
+                despues = client.get("/metrics").json()
+                encolados = despues["outbox"]["pendientes"] - antes["outbox"]["pendientes"]
+                print(f"{nombre:16s} {args.rows} paquetes en {duracion:7.2f} s  "
+                      f"({args.rows / duracion:8.1f} paquetes/s, {encolados} notificaciones en el outbox)")
+    finally:
+        servidor.cerrar()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Microbenchmark del render de correos: tiempo por correo con las plantillas
+Jinja2 precompiladas (email_templates.py) versus el f-string que armaba el
+HTML completo, CSS incluido, en cada llamada (como hacía format_email_html).
+
+También mide lo que cuesta cargar y compilar todas las plantillas (una vez
+por proceso) y el recordatorio con renderizar_cacheado().
+
+Uso (desde backend/):
+    python benchmarks/bench_email_templates.py [--n 20000]
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+import timeit
+from datetime import date, time as dtime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+def _fstring(pkg, css: str) -> str:
+    """Referencia: el HTML de format_email_html antes de las plantillas (sin escapar)."""
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <style>
+{css}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <h2>📦 Recepción de Correspondencia</h2>
+        </div>
+        <div class="content">
+            <p>Estimado(a) <strong>{pkg.destinatarioNombre}</strong>,</p>
+            <p>Ha llegado correspondencia a su nombre:</p>
+            <table class="info-table">
+                <tr><td>🚚 Proveedor</td><td>{pkg.proveedor}</td></tr>
+                <tr><td>📄 Tipo de Documento</td><td>{pkg.tipoDocumento}</td></tr>
+                <tr><td>🔢 Número de Documento</td><td>{pkg.numeroDocumento}</td></tr>
+                {"" if pkg.tipoDocumento != "Cheque" or not pkg.montoCheque else f'''
+                <tr><td>💰 Monto del Cheque</td><td>{pkg.montoCheque}</td></tr>
+                '''}
+                {"" if pkg.tipoDocumento != "Cheque" or not pkg.fechaVencimientoCheque else f'''
+                <tr><td>📆 Fecha de Vencimiento</td><td>{pkg.fechaVencimientoCheque}</td></tr>
+                '''}
+                <tr><td>📅 Fecha de Recepción</td><td>{pkg.fechaRecepcion}</td></tr>
+                <tr><td>🕐 Hora de Recepción</td><td>{pkg.horaRecepcion}</td></tr>
+            </table>
+            <div class="important">
+                <strong>🚩 Importante:</strong> Retiro mismo día de notificación<br>
+                • Lunes a Jueves: hasta 18:00 hrs<br>
+                • Viernes: hasta 17:00 hrs
+            </div>
+            <div class="footer">
+                <p>De antemano, muchas gracias.</p>
+                <p><strong>Rudth Nuñez</strong><br>
+                Recepcionista - Multiaceros S.A.<br>
+                📧 recepcion@multiaceros.cl</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+def _medir(nombre: str, funcion, n: int):
+    segundos = min(timeit.repeat(funcion, number=n, repeat=3))
+    print(f"{nombre:34s} {segundos / n * 1e6:8.1f} µs/correo")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20000, help="Correos por medición")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # logs de arranque de database/main
+        import email_templates
+        from main import PackageIn
+    print(f"Importar y compilar {email_templates.precargar()} plantillas: "
+          f"{(time.perf_counter() - inicio) * 1000:.0f} ms (incluye importar main)")
+
+    inicio = time.perf_counter()
+    email_templates.entorno.cache.clear()
+    email_templates.precargar()
+    print(f"Recompilar plantillas: {(time.perf_counter() - inicio) * 1000:.1f} ms (una vez por proceso)")
+
+    pkg = PackageIn(
+        sucursal="Santiago", recepcionista="Bench", proveedor="Chilexpress", tipoDocumento="Cheque",
+        numeroDocumento="123456", destinatarioNombre="Usuario Prueba", destinatarioEmail="usuario@example.com",
+        medioNotificacion="Correo", montoCheque="$150.000", fechaVencimientoCheque=date(2026, 1, 31),
+        fechaRecepcion=date(2025, 11, 28), horaRecepcion=dtime(9, 30),
+    )
+    css = (BACKEND_DIR / "templates" / "recepcion.css").read_text(encoding="utf-8")
+    plantilla = email_templates.entorno.get_template("recepcion.html")
+
+    _medir("f-string (CSS en cada correo)", lambda: _fstring(pkg, css), args.n)
+    _medir("plantilla recepcion.html", lambda: plantilla.render(nombre=pkg.destinatarioNombre, pkg=pkg), args.n)
+    _medir("recepcion_agrupada.html (5 paq.)",
+           lambda: email_templates.renderizar("recepcion_agrupada.html", nombre=pkg.destinatarioNombre, paquetes=[pkg] * 5),
+           args.n)
+    _medir("recordatorio.html sin cache", lambda: email_templates.renderizar("recordatorio.html", nombre="Usuario Prueba"), args.n)
+    _medir("recordatorio.html cacheado",
+           lambda: email_templates.renderizar_cacheado("recordatorio.html", nombre="Usuario Prueba"), args.n)
+
+if __name__ == "__main__":
+    main()
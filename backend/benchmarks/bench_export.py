@@ -0,0 +1,117 @@
+"""
+Benchmark de /export: memoria máxima (RSS) y tiempo para exportar un año de
+paquetes en CSV, XLSX y Parquet, comparado con lo que hacía la pestaña
+Reportes (DataFrame completo + pd.ExcelWriter sobre un BytesIO).
+
+Cada medición corre en un subproceso propio para que el RSS máximo de una no
+contamine a la otra. Usa una base SQLite temporal con --rows paquetes.
+
+Uso (desde backend/):
+    python benchmarks/bench_export.py [--rows 60000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, time as dtime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+MODOS = ("csv", "xlsx", "parquet", "pandas-excel")
+
+def _rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _poblar(n: int):
+    from sqlalchemy import insert
+    from database import Package, engine
+
+    inicio = date.today() - timedelta(days=365)
+    with engine.begin() as conn:
+        for desde in range(0, n, 5000):
+            conn.execute(insert(Package), [
+                {
+                    "fecha_recepcion": inicio + timedelta(days=i * 365 // n),
+                    "hora_recepcion": dtime(9 + i % 9, i % 60),
+                    "sucursal": random.choice(["Santiago", "Concepción", "Valparaíso"]),
+                    "recepcionista": "Bench",
+                    "proveedor": random.choice(["Chilexpress", "Starken", "Correos"]),
+                    "tipo_documento": random.choice(["Paquete", "Carta", "Factura", "Cheque"]),
+                    "numero_documento": f"DOC{i:07d}",
+                    "destinatario_nombre": f"Usuario {i % 300}",
+                    "destinatario_email": f"usuario{i % 300}@example.com",
+                    "medio_notificacion": "Correo",
+                    "codigo_retiro": f"BENCH{i:07d}",
+                    "estado": random.choice(["Pendiente", "Notificado", "Retirado"]),
+                    "observaciones": "Observación de prueba con tildes y ñ",
+                    "monto_cheque": Decimal("150000.00") if i % 4 == 0 else None,
+                    "version": i + 1,
+                }
+                for i in range(desde, min(desde + 5000, n))
+            ])
+
+def _medir(modo: str):
+    from sqlalchemy import select
+    with contextlib.redirect_stdout(io.StringIO()):  # logs de arranque de database/main
+        import exporter
+        from database import Package, SessionLocal
+        from main import PACKAGE_FIELDS, serializar_valor
+    # Las librerías se importan antes de tomar la línea base: solo interesa
+    # la memoria que depende de la cantidad de filas
+    import openpyxl, pyarrow.parquet, pandas  # noqa: E401,F401
+
+    base = _rss_mb()
+    inicio = time.perf_counter()
+    total = 0
+    if modo == "pandas-excel":
+        import pandas as pd
+
+        with SessionLocal() as db:
+            filas = db.execute(select(*PACKAGE_FIELDS.values())).all()
+        df = pd.DataFrame([{n: serializar_valor(v) for n, v in zip(PACKAGE_FIELDS, fila)} for fila in filas])
+        output = io.BytesIO()
+        with pd.ExcelWriter(output, engine="openpyxl") as writer:
+            df.to_excel(writer, index=False, sheet_name="Paquetes")
+        total = len(output.getvalue())
+    else:
+        nombres = list(PACKAGE_FIELDS)
+        columnas = list(PACKAGE_FIELDS.values())
+        lotes = exporter.leer_en_lotes(SessionLocal, select(*columnas).order_by(Package.id))
+        for trozo in exporter.ESCRITORES[modo](lotes, nombres, columnas, serializar_valor):
+            total += len(trozo)
+    print(f"{modo:14s} {time.perf_counter() - inicio:7.2f} s  {total / 1e6:7.1f} MB  "
+          f"RSS máx +{_rss_mb() - base:6.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=60000, help="Paquetes a exportar (~1 año)")
+    parser.add_argument("--medir", choices=MODOS, help=argparse.SUPPRESS)
+    parser.add_argument("--poblar", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.poblar:
+        _poblar(args.rows)
+        return
+    if args.medir:
+        _medir(args.medir)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench-export-") as tmp:
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp}/paquetes.db", "OUTBOX_POLL_SECONDS": "3600"}
+        subprocess.run([sys.executable, __file__, "--poblar", "--rows", str(args.rows)],
+                       cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+        print(f"{args.rows} paquetes")
+        for modo in MODOS:
+            subprocess.run([sys.executable, __file__, "--medir", modo], cwd=BACKEND_DIR, env=env, check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: 100 notificaciones secuenciales contra un servidor local que imita
+el endpoint sendMail de Graph (responde 202), comparando requests.post "suelto"
+(una conexión nueva por request) con la sesión compartida de graph_client.
+
+Con --tls el servidor usa un certificado autofirmado (requiere el comando
+openssl) para incluir el costo del handshake TLS, como ocurre con Graph.
+
+Uso (desde backend/):
+    python benchmarks/bench_graph_client.py [--n 100] [--latency-ms 0] [--tls]
+"""
+import argparse
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import graph_client  # noqa: E402
+
+class FakeGraphHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Permite keep-alive
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def wrap_tls(server, workdir):
+    cert, key = f"{workdir}/cert.pem", f"{workdir}/key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+
+def run(label, post, url, n, verify):
+    payload = {"message": {"subject": "Recepción de paquete", "body": {"content": "x" * 2048}}}
+    start = time.perf_counter()
+    for _ in range(n):
+        r = post(url, json=payload, timeout=10, verify=verify)
+        assert r.status_code == 202
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} total {elapsed * 1000:8.1f} ms   por envío {elapsed / n * 1000:6.2f} ms")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia simulada del servidor")
+    parser.add_argument("--tls", action="store_true", help="Servir por HTTPS con certificado autofirmado")
+    args = parser.parse_args()
+
+    FakeGraphHandler.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGraphHandler)
+    workdir = tempfile.TemporaryDirectory()
+    scheme = "http"
+    if args.tls:
+        wrap_tls(server, workdir.name)
+        scheme = "https"
+        requests.packages.urllib3.disable_warnings()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"{scheme}://127.0.0.1:{server.server_port}/v1.0/users/recepcion/sendMail"
+    verify = not args.tls
+
+    try:
+        # Calentamiento
+        requests.post(url, json={}, timeout=10, verify=verify)
+        graph_client.post(url, json={}, verify=verify)
+
+        bare = run("requests.post (sin pool)", requests.post, url, args.n, verify)
+        pooled = run("graph_client (keep-alive)", graph_client.post, url, args.n, verify)
+        print(f"Mejora: {bare / pooled:.1f}x")
+    finally:
+        server.shutdown()
+        workdir.cleanup()
+
+if __name__ == "__main__":
+    main()
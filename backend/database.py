@@ -2,11 +2,20 @@
 Database module for PostgreSQL storage
 """
 import os
-from sqlalchemy import create_engine, Column, String, DateTime, Integer
+import threading
+import time
+from collections import deque
+from typing import List
+from sqlalchemy import create_engine, event, exc, func, inspect, select, Column, String, Date, DateTime, Time, Integer, Numeric, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from datetime import datetime
 
+import migrations
+import search
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 # SQLAlchemy setup
@@ -16,8 +25,8 @@ class Package(Base):
     __tablename__ = "packages"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    fecha_recepcion = Column(String, nullable=False)
-    hora_recepcion = Column(String, nullable=False)
+    fecha_recepcion = Column(Date, nullable=False)
+    hora_recepcion = Column(Time, nullable=False)
     sucursal = Column(String, nullable=False)
     recepcionista = Column(String, nullable=False)
     proveedor = Column(String, nullable=False)
@@ -28,32 +37,387 @@ class Package(Base):
     medio_notificacion = Column(String, nullable=False)
     codigo_retiro = Column(String, nullable=False, unique=True)
     estado = Column(String, nullable=False, default="Pendiente")
-    fecha_notificacion = Column(String, nullable=True)
+    fecha_notificacion = Column(DateTime, nullable=True)
     destinatario_confirmo = Column(String, nullable=True)
-    fecha_retiro = Column(String, nullable=True)
+    fecha_retiro = Column(DateTime, nullable=True)
     entregado_a = Column(String, nullable=True)
     observaciones = Column(String, nullable=True)
     adjunto_url = Column(String, nullable=True)
-    monto_cheque = Column(String, nullable=True)
-    fecha_vencimiento_cheque = Column(String, nullable=True)
+    monto_cheque = Column(Numeric(14, 2), nullable=True)
+    fecha_vencimiento_cheque = Column(Date, nullable=True)
+    # Versión monotónica global: cambia en cada insert/update (ver /packages/changes)
+    version = Column(Integer, nullable=False, default=0, index=True)
+    actualizado_en = Column(DateTime, nullable=True)
+    # Recordatorios automáticos (reminders.py); no cambian la versión del paquete
+    ultimo_recordatorio = Column(DateTime, nullable=True)
+    recordatorios_enviados = Column(Integer, nullable=False, default=0)
+
+    # Mantener en sincronía con migrations/m0003_packages_indexes.py y
+    # m0005_codigo_retiro_upper.py
+    __table_args__ = (
+        Index("ix_packages_estado_fecha", "estado", "fecha_recepcion"),
+        Index("ix_packages_sucursal_fecha", "sucursal", "fecha_recepcion"),
+        Index("ix_packages_destinatario_email", "destinatario_email"),
+        Index("ix_packages_numero_documento", "numero_documento"),
+        # Búsqueda por código sin distinguir mayúsculas: las consultas deben
+        # comparar func.upper(Package.codigo_retiro) para usar este índice
+        Index("ux_packages_codigo_retiro_upper", func.upper(codigo_retiro), unique=True),
+    )
+
+# Índices de texto completo (no se pueden declarar en el modelo): en bases
+# nuevas se crean junto con la tabla; las existentes los reciben en la migración 0006
+@event.listens_for(Package.__table__, "after_create")
+def _crear_indices_busqueda(target, connection, **kw):
+    search.crear_indices(connection)
+
+class PackageDailyStat(Base):
+    """
+    Rollup materializado: cantidad de paquetes por día de recepción, sucursal,
+    tipo de documento y estado. Se mantiene en la misma transacción que cada
+    cambio de paquete (ver _track_daily_stats y adjust_daily_stats), así las
+    estadísticas históricas cuestan O(días) y no O(paquetes).
+    Reconstruir / verificar: python rollups.py [rebuild|check]
+    """
+    __tablename__ = "package_daily_stats"
+
+    fecha = Column(Date, primary_key=True)
+    sucursal = Column(String, primary_key=True)
+    tipo_documento = Column(String, primary_key=True)
+    estado = Column(String, primary_key=True)
+    cantidad = Column(Integer, nullable=False, default=0)
+
+class CodigoRetiroSecuencia(Base):
+    """Último correlativo de código de retiro asignado por día (ver reserve_codigos_retiro)."""
+    __tablename__ = "codigo_retiro_secuencias"
+
+    fecha = Column(Date, primary_key=True)
+    ultimo = Column(Integer, nullable=False, default=0)
+
+class SyncCounter(Base):
+    """Contadores monotónicos usados como cursor de sincronización."""
+    __tablename__ = "sync_counters"
+
+    nombre = Column(String, primary_key=True)
+    valor = Column(Integer, nullable=False, default=0)
+
+class NotificationOutbox(Base):
+    """
+    Cola persistente de notificaciones (patrón outbox).
+    Las filas se escriben en la misma transacción que el paquete y un worker
+    en segundo plano las despacha a Graph/Teams con reintentos.
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    package_ids = Column(String, nullable=False, index=True)  # IDs de paquetes separados por coma
+    canal = Column(String, nullable=False)  # "Correo" o "Teams"
+    destinatario = Column(String, nullable=False)
+    asunto = Column(String, nullable=True)
+    cuerpo = Column(Text, nullable=False)
+    estado = Column(String, nullable=False, default="Pendiente", index=True)  # Pendiente, Enviado, Descartado
+    intentos = Column(Integer, nullable=False, default=0)
+    proximo_intento = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    ultimo_error = Column(Text, nullable=True)
+    creado_en = Column(DateTime, nullable=False, default=datetime.utcnow)
+    enviado_en = Column(DateTime, nullable=True)
+    # Modo resumen: email (minúsculas) del destinatario cuyos paquetes acumula
+    # esta fila; el asunto y el cuerpo se arman al despachar
+    resumen_de = Column(String, nullable=True, index=True)
+
+# Configuración del pool (por proceso: con N workers de uvicorn el máximo de
+# conexiones a Postgres es N * (DB_POOL_SIZE + DB_MAX_OVERFLOW))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+class PoolStats:
+    """Contadores en memoria del pool de conexiones (por proceso)."""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.conexiones_creadas = 0
+        self.invalidadas = 0
+        self._esperas = deque(maxlen=window)  # espera por una conexión libre (s)
+
+    def registrar_espera(self, segundos: float):
+        with self._lock:
+            self.checkouts += 1
+            self._esperas.append(segundos)
+
+    def registrar_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def registrar_conexion(self):
+        with self._lock:
+            self.conexiones_creadas += 1
+
+    def registrar_invalidada(self):
+        with self._lock:
+            self.invalidadas += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            esperas = sorted(self._esperas)
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "conexiones_creadas": self.conexiones_creadas,
+                "invalidadas": self.invalidadas,
+                "espera_promedio_ms": round(sum(esperas) / len(esperas) * 1000, 2) if esperas else None,
+                "espera_p95_ms": round(esperas[min(len(esperas) - 1, int(len(esperas) * 0.95))] * 1000, 2) if esperas else None,
+                "espera_max_ms": round(esperas[-1] * 1000, 2) if esperas else None,
+            }
+
+pool_stats = PoolStats()
+async_pool_stats = PoolStats()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre."""
+
+    stats = pool_stats
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexion = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.registrar_timeout()
+            raise
+        self.stats.registrar_espera(time.perf_counter() - inicio)
+        return conexion
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """Versión para el engine async (asyncpg/aiosqlite)."""
+
+    stats = async_pool_stats
+
+def _configure_sqlite(engine):
+    """WAL permite lecturas concurrentes con una escritura; busy_timeout evita
+    'database is locked' inmediatos cuando dos recepcionistas escriben a la vez."""
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+def _database_url() -> str:
+    if not DATABASE_URL:
+        # Fallback to SQLite for local development
+        return "sqlite:///./paquetes.db"
+    # Fix Railway's postgres:// to postgresql://
+    return DATABASE_URL.replace("postgres://", "postgresql://", 1)
+
+def _instrument(engine, stats: PoolStats):
+    if engine.dialect.name == "sqlite":
+        _configure_sqlite(engine)
+    event.listen(engine, "connect", lambda *_: stats.registrar_conexion())
+    event.listen(engine, "invalidate", lambda *_: stats.registrar_invalidada())
+
+def _pool_kwargs() -> dict:
+    kwargs = dict(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    if not DATABASE_URL:
+        kwargs["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    return kwargs
 
 # Initialize database connection
 def get_engine():
+    db_url = _database_url()
     if not DATABASE_URL:
-        # Fallback to SQLite for local development
-        db_url = "sqlite:///./paquetes.db"
         print(f"⚠️  WARNING: DATABASE_URL not set, using SQLite: {db_url}")
     else:
-        # Fix Railway's postgres:// to postgresql://
-        db_url = DATABASE_URL.replace("postgres://", "postgresql://", 1)
         print(f"✅ Using PostgreSQL: {db_url[:50]}...")
-    return create_engine(db_url)
+    engine = create_engine(db_url, poolclass=InstrumentedQueuePool, **_pool_kwargs())
+    _instrument(engine, pool_stats)
+    return engine
+
+def get_async_engine():
+    """
+    Engine async para los endpoints async def: asyncpg en PostgreSQL y
+    aiosqlite en el fallback local. Comparte la configuración de pool con el
+    engine sync (que siguen usando el outbox, las migraciones y los scripts).
+    """
+    db_url = _database_url()
+    if db_url.startswith("sqlite"):
+        db_url = db_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    else:
+        db_url = db_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    async_engine = create_async_engine(db_url, poolclass=InstrumentedAsyncQueuePool, **_pool_kwargs())
+    _instrument(async_engine.sync_engine, async_pool_stats)
+    return async_engine
 
 engine = get_engine()
+async_engine = get_async_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+PACKAGES_COUNTER = "packages"
+
+def ensure_sync_counter():
+    with engine.begin() as conn:
+        existe = conn.execute(
+            select(SyncCounter.valor).where(SyncCounter.nombre == PACKAGES_COUNTER)
+        ).first()
+        if existe is None:
+            conn.execute(SyncCounter.__table__.insert().values(nombre=PACKAGES_COUNTER, valor=0))
+
+# Crea las tablas nuevas y aplica las migraciones pendientes (ver migrations/).
+# Con AUTO_MIGRATE=0 se omiten y deben correrse con `python -m migrations`.
+if os.getenv("AUTO_MIGRATE", "1") != "0":
+    migrations.upgrade(engine, Base.metadata)
+    ensure_sync_counter()
+
+def next_package_version(session: Session, n: int = 1) -> int:
+    """
+    Reserva `n` versiones consecutivas y retorna la última.
+    El UPDATE bloquea la fila del contador hasta el commit, así que las
+    versiones quedan ordenadas según el orden de commit de las transacciones
+    (un cliente que sincroniza con ?since= nunca se salta una fila).
+    """
+    conn = session.connection()
+    tabla = SyncCounter.__table__
+    conn.execute(
+        tabla.update().where(tabla.c.nombre == PACKAGES_COUNTER).values(valor=tabla.c.valor + n)
+    )
+    return conn.execute(select(tabla.c.valor).where(tabla.c.nombre == PACKAGES_COUNTER)).scalar_one()
+
+def formato_codigo_retiro(fecha, correlativo: int) -> str:
+    """PK-AAMMDD-NNNN: correlativo del día con al menos 4 dígitos."""
+    return f"PK-{fecha:%y%m%d}-{correlativo:04d}"
+
+def reserve_codigos_retiro(session: Session, fecha, n: int = 1) -> List[str]:
+    """
+    Reserva `n` correlativos consecutivos del día `fecha` con un upsert atómico
+    (INSERT ... ON CONFLICT DO UPDATE ... RETURNING) y retorna sus códigos.
+    La fila del día queda bloqueada hasta el commit, así que dos transacciones
+    nunca reciben el mismo número.
+    """
+    conn = session.connection()
+    tabla = CodigoRetiroSecuencia.__table__
+    stmt = _dialect_insert(conn)(tabla).values(fecha=fecha, ultimo=n)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.c.fecha],
+        set_={"ultimo": tabla.c.ultimo + stmt.excluded.ultimo},
+    ).returning(tabla.c.ultimo)
+    ultimo = conn.execute(stmt).scalar_one()
+    return [formato_codigo_retiro(fecha, i) for i in range(ultimo - n + 1, ultimo + 1)]
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+def current_package_version(session: Session) -> int:
+    return session.execute(
+        select(SyncCounter.valor).where(SyncCounter.nombre == PACKAGES_COUNTER)
+    ).scalar() or 0
+
+@event.listens_for(Session, "before_flush")
+def _stamp_package_versions(session, flush_context, instances):
+    paquetes = [
+        obj for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, Package) and (obj in session.new or session.is_modified(obj))
+    ]
+    if not paquetes:
+        return
+    ultima = next_package_version(session, len(paquetes))
+    ahora = datetime.utcnow()
+    for i, pkg in enumerate(paquetes):
+        pkg.version = ultima - len(paquetes) + 1 + i
+        pkg.actualizado_en = ahora
+
+def daily_stat_key(fecha, sucursal, tipo_documento, estado):
+    return (fecha, sucursal, tipo_documento, estado)
+
+def _dialect_insert(conn):
+    """insert() con soporte de ON CONFLICT para el motor de `conn`."""
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert
+
+def adjust_daily_stats(conn, deltas: dict):
+    """
+    Suma `deltas` ({(fecha, sucursal, tipo_documento, estado): +n/-n}) al
+    rollup con un upsert atómico (INSERT ... ON CONFLICT DO UPDATE), de modo
+    que dos transacciones concurrentes sobre el mismo día no se pisan.
+    """
+    filas = [
+        {"fecha": k[0], "sucursal": k[1], "tipo_documento": k[2], "estado": k[3], "cantidad": n}
+        for k, n in deltas.items() if n and k[0] is not None
+    ]
+    if not filas:
+        return
+    tabla = PackageDailyStat.__table__
+    stmt = _dialect_insert(conn)(tabla)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.c.fecha, tabla.c.sucursal, tabla.c.tipo_documento, tabla.c.estado],
+        set_={"cantidad": tabla.c.cantidad + stmt.excluded.cantidad},
+    )
+    conn.execute(stmt, filas)
+
+_ROLLUP_ATTRS = ("fecha_recepcion", "sucursal", "tipo_documento", "estado")
+
+@event.listens_for(Session, "before_flush")
+def _track_daily_stats(session, flush_context, instances):
+    """Traduce los paquetes nuevos, modificados o borrados de la sesión en deltas del rollup."""
+    deltas = {}
+
+    def sumar(clave, n):
+        deltas[clave] = deltas.get(clave, 0) + n
+
+    for obj in session.new:
+        if isinstance(obj, Package):
+            sumar(daily_stat_key(*(getattr(obj, a) for a in _ROLLUP_ATTRS)), 1)
+    for obj in session.deleted:
+        if isinstance(obj, Package):
+            # Tras un commit (expire_on_commit) los atributos pueden estar
+            # expirados y su historia vacía: se recargan antes de leerla
+            sin_cargar = [a for a in _ROLLUP_ATTRS if a in inspect(obj).unloaded]
+            if sin_cargar:
+                session.refresh(obj, sin_cargar)
+            anteriores = [inspect(obj).attrs[a].history for a in _ROLLUP_ATTRS]
+            sumar(daily_stat_key(*((h.deleted or h.unchanged)[0] if (h.deleted or h.unchanged) else None
+                                   for h in anteriores)), -1)
+    for obj in session.dirty:
+        if not isinstance(obj, Package) or obj in session.new:
+            continue
+        historias = [inspect(obj).attrs[a].history for a in _ROLLUP_ATTRS]
+        if not any(h.has_changes() for h in historias):
+            continue
+        anterior = [(h.deleted or h.unchanged)[0] if (h.deleted or h.unchanged) else None for h in historias]
+        actual = [getattr(obj, a) for a in _ROLLUP_ATTRS]
+        sumar(daily_stat_key(*anterior), -1)
+        sumar(daily_stat_key(*actual), 1)
+
+    if any(deltas.values()):
+        adjust_daily_stats(session.connection(), deltas)
+
+def _pool_snapshot(pool, stats: PoolStats) -> dict:
+    return {
+        "tamano": pool.size(),
+        "en_uso": pool.checkedout(),
+        "disponibles": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": DB_MAX_OVERFLOW,
+        **stats.snapshot(),
+    }
+
+def db_pool_stats() -> dict:
+    """Estado actual del pool más los contadores acumulados (para /metrics)."""
+    return {
+        **_pool_snapshot(engine.pool, pool_stats),
+        "async": _pool_snapshot(async_engine.pool, async_pool_stats),
+    }
 
 def get_db():
     db = SessionLocal()
@@ -61,3 +425,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,227 @@
+"""
+Índice local del directorio de Microsoft 365 (usuarios y grupos con correo).
+
+Se sincroniza en segundo plano con consultas delta de Graph (la primera vez
+descarga todo siguiendo @odata.nextLink; después solo los cambios) y responde
+las búsquedas del autocompletado desde memoria usando un índice de n-gramas
+insensible a mayúsculas y tildes.
+"""
+import heapq
+import os
+import threading
+import time
+import unicodedata
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import graph_client
+
+DIRECTORY_SYNC_SECONDS = int(os.getenv("DIRECTORY_SYNC_SECONDS", "900"))
+
+USERS_DELTA_URL = "https://graph.microsoft.com/v1.0/users/delta?$select=displayName,mail,userPrincipalName"
+GROUPS_DELTA_URL = "https://graph.microsoft.com/v1.0/groups/delta?$select=displayName,mail,mailEnabled"
+
+MAX_USUARIOS = 10
+MAX_GRUPOS = 5
+
+def normalize(text: Optional[str]) -> str:
+    """Minúsculas y sin tildes: "Núñez" -> "nunez"."""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def _ngrams(text: str) -> Set[str]:
+    # Bigramas para consultas de 2 caracteres, trigramas para el resto
+    grams = {text[i:i + 2] for i in range(len(text) - 1)}
+    grams.update(text[i:i + 3] for i in range(len(text) - 2))
+    return grams
+
+class DirectoryIndex:
+    def __init__(self, token_getter: Callable[[], Optional[str]]):
+        self._token_getter = token_getter
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._delta_links: Dict[str, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.ready = False
+        self.last_sync: Optional[datetime] = None
+        self.last_sync_ms = 0.0
+        self.last_error: Optional[str] = None
+
+    # ---- Índice en memoria ----
+
+    def _unindex(self, key: str):
+        entry = self._entries.pop(key, None)
+        if not entry:
+            return
+        for gram in _ngrams(entry["text"]):
+            keys = self._postings.get(gram)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def _index(self, key: str, entry: dict):
+        self._unindex(key)
+        entry["text"] = f"{normalize(entry['displayName'])} {normalize(entry['email'])}"
+        self._entries[key] = entry
+        for gram in _ngrams(entry["text"]):
+            self._postings.setdefault(gram, set()).add(key)
+
+    def search(self, query: str) -> List[dict]:
+        """
+        Busca `query` como subcadena del nombre o email (igual que la búsqueda
+        anterior contra Graph) y retorna hasta 10 usuarios y 5 grupos,
+        priorizando los que empiezan con el texto buscado.
+        """
+        return self.search_results(query)[0]
+
+    def search_results(self, query: str) -> Tuple[List[dict], bool]:
+        """
+        Como search(), y además indica si la lista está completa (ningún
+        tipo superó su máximo). Una lista completa contiene todas las
+        coincidencias de cualquier búsqueda más larga que incluya `query`, así
+        que el autocompletado puede filtrarla localmente.
+        """
+        q = normalize(query).strip()
+        if len(q) < 2:
+            return [], False
+        grams = {q} if len(q) == 2 else {q[i:i + 3] for i in range(len(q) - 2)}
+
+        with self._lock:
+            postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:]) if postings else set()
+            matches = [self._entries[k] for k in candidates if q in self._entries[k]["text"]]
+
+        def rank(entry):
+            words = entry["text"].split()
+            starts = entry["text"].startswith(q) or any(w.startswith(q) for w in words)
+            return (0 if starts else 1, entry["displayName"].casefold())
+
+        todos_usuarios = [e for e in matches if e["type"] == "user"]
+        todos_grupos = [e for e in matches if e["type"] == "group"]
+        usuarios = heapq.nsmallest(MAX_USUARIOS, todos_usuarios, key=rank)
+        grupos = heapq.nsmallest(MAX_GRUPOS, todos_grupos, key=rank)
+        completo = len(todos_usuarios) <= MAX_USUARIOS and len(todos_grupos) <= MAX_GRUPOS
+
+        return [
+            {"displayName": e["displayName"], "email": e["email"], "type": "user"}
+            for e in usuarios
+        ] + [
+            {"displayName": f"📧 {e['displayName']} (Grupo)", "email": e["email"], "type": "group"}
+            for e in grupos
+        ], completo
+
+    # ---- Sincronización con Graph ----
+
+    def _fetch_delta(self, kind: str, initial_url: str, headers: dict):
+        """
+        Recorre todas las páginas de una consulta delta.
+        Retorna (cambios, deltaLink, es_completa).
+        """
+        link = self._delta_links.get(kind)
+        full = link is None
+        link = link or initial_url
+        changes = []
+        delta_link = None
+        while link:
+            r = graph_client.get(link, headers=headers, timeout=30)
+            if r.status_code == 410 and not full:
+                # El token delta expiró: volver a sincronizar todo
+                self._delta_links.pop(kind, None)
+                return self._fetch_delta(kind, initial_url, headers)
+            r.raise_for_status()
+            data = r.json()
+            changes.extend(data.get("value", []))
+            link = data.get("@odata.nextLink")
+            delta_link = data.get("@odata.deltaLink", delta_link)
+        return changes, delta_link, full
+
+    def _apply(self, kind: str, changes: List[dict], full: bool):
+        with self._lock:
+            if full:
+                for key in [k for k, e in self._entries.items() if e["type"] == kind]:
+                    self._unindex(key)
+
+            for item in changes:
+                key = f"{kind}:{item.get('id')}"
+                if "@removed" in item:
+                    self._unindex(key)
+                    continue
+
+                # En sincronizaciones incrementales Graph puede enviar solo los campos modificados
+                previous = self._entries.get(key, {})
+                raw = dict(previous.get("raw", {}))
+                raw.update({k: v for k, v in item.items() if not k.startswith("@")})
+
+                display_name = raw.get("displayName") or ""
+                if kind == "user":
+                    email = raw.get("mail") or raw.get("userPrincipalName") or ""
+                    valid = bool(email and display_name)
+                else:
+                    email = raw.get("mail") or ""
+                    valid = bool(email and display_name and raw.get("mailEnabled"))
+
+                if valid:
+                    self._index(key, {"displayName": display_name, "email": email, "type": kind, "raw": raw})
+                else:
+                    self._unindex(key)
+
+    def sync(self):
+        """Sincroniza usuarios y grupos (completa la primera vez, delta después)."""
+        with self._sync_lock:
+            token = self._token_getter()
+            if not token:
+                raise RuntimeError("No se pudo obtener token de Microsoft Graph")
+            headers = {"Authorization": f"Bearer {token}"}
+            inicio = time.perf_counter()
+
+            for kind, url in (("user", USERS_DELTA_URL), ("group", GROUPS_DELTA_URL)):
+                changes, delta_link, full = self._fetch_delta(kind, url, headers)
+                self._apply(kind, changes, full)
+                if delta_link:
+                    self._delta_links[kind] = delta_link
+
+            self.last_sync = datetime.utcnow()
+            self.last_sync_ms = (time.perf_counter() - inicio) * 1000
+            self.last_error = None
+            self.ready = True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+                espera = DIRECTORY_SYNC_SECONDS
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"❌ Directorio: error sincronizando con Graph: {e}")
+                espera = 60
+            if self._stop.wait(espera):
+                break
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="directory-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            usuarios = sum(1 for e in self._entries.values() if e["type"] == "user")
+            grupos = len(self._entries) - usuarios
+        return {
+            "listo": self.ready,
+            "usuarios": usuarios,
+            "grupos": grupos,
+            "ultima_sincronizacion": self.last_sync.isoformat() if self.last_sync else None,
+            "duracion_sync_ms": round(self.last_sync_ms, 1),
+            "ultimo_error": self.last_error,
+        }
@@ -0,0 +1,93 @@
+"""
+Plantillas HTML de los correos (Jinja2, carpeta templates/).
+
+- Se cargan y compilan una sola vez por proceso al importar el módulo; para
+  que un cambio en una plantilla se vea hay que reiniciar el backend.
+- El CSS se inserta al cargar: el marcador /* css: archivo.css */ se reemplaza
+  por un <style> con el contenido del archivo, así cada correo no vuelve a
+  armar el bloque de estilos.
+- Los valores se escapan (autoescape): un nombre u observación con "<" o "&"
+  no rompe el HTML.
+- Las plantillas que empiezan con "_" son fragmentos estáticos (no dependen
+  del correo, p. ej. _horario.html): se renderizan una sola vez al cargar y
+  las demás los usan como {{ fragmentos.horario }}, sin un include por correo.
+- renderizar_cacheado() guarda el HTML de contextos que se repiten, como los
+  recordatorios (solo dependen del nombre).
+
+Una plantilla nueva (p. ej. vencimiento de cheque) es un .html que extiende
+base.html; se usa con renderizar("archivo.html", nombre=..., ...).
+"""
+import os
+import re
+from datetime import date, time as dtime
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, select_autoescape
+from markupsafe import Markup
+
+EMAIL_TEMPLATES_DIR = os.getenv("EMAIL_TEMPLATES_DIR") or str(Path(__file__).resolve().parent / "templates")
+EMAIL_RENDER_CACHE = int(os.getenv("EMAIL_RENDER_CACHE", "512"))
+
+# Horario de retiro en Recepción: (texto, días de la semana con 0 = lunes, hora límite).
+# Se muestra en los correos y lo respetan los recordatorios automáticos (reminders.py)
+HORARIO_RETIRO = (
+    ("Lunes a Jueves", (0, 1, 2, 3), dtime(18, 0)),
+    ("Viernes", (4,), dtime(17, 0)),
+)
+
+def cierre_retiro(dia: date) -> Optional[dtime]:
+    """Hora límite de retiro de `dia`, o None si ese día no se atiende."""
+    for _, dias, hora in HORARIO_RETIRO:
+        if dia.weekday() in dias:
+            return hora
+    return None
+
+_MARCADOR_CSS = re.compile(r"/\*\s*css:\s*([\w.-]+)\s*\*/")
+
+class _CargadorConCss(FileSystemLoader):
+    """FileSystemLoader que reemplaza los marcadores de CSS por su contenido."""
+
+    def get_source(self, environment, template):
+        fuente, ruta, actualizado = super().get_source(environment, template)
+
+        def _estilo(m):
+            css = FileSystemLoader.get_source(self, environment, m.group(1))[0]
+            return "<style>{% raw %}\n" + css + "{% endraw %}</style>"
+
+        return _MARCADOR_CSS.sub(_estilo, fuente), ruta, actualizado
+
+entorno = Environment(
+    loader=_CargadorConCss(EMAIL_TEMPLATES_DIR),
+    autoescape=select_autoescape(["html"]),
+    undefined=StrictUndefined,
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+entorno.globals["horario_retiro"] = HORARIO_RETIRO
+
+def precargar() -> int:
+    """
+    Renderiza los fragmentos estáticos y compila el resto de las plantillas
+    .html; un error de sintaxis aparece al iniciar y no al enviar un correo.
+    """
+    nombres = entorno.list_templates(extensions=["html"])
+    entorno.globals["fragmentos"] = {
+        nombre[1:-len(".html")]: Markup(entorno.get_template(nombre).render())
+        for nombre in nombres if nombre.startswith("_")
+    }
+    for nombre in nombres:
+        entorno.get_template(nombre)
+    return len(nombres)
+
+def renderizar(plantilla: str, **contexto) -> str:
+    return entorno.get_template(plantilla).render(**contexto)
+
+@lru_cache(maxsize=EMAIL_RENDER_CACHE)
+def renderizar_cacheado(plantilla: str, **contexto) -> str:
+    """Como renderizar(), pero recuerda el resultado. Los valores del contexto deben ser hashables."""
+    return renderizar(plantilla, **contexto)
+
+precargar()
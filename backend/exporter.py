@@ -0,0 +1,116 @@
+"""
+Exportación de paquetes en streaming: CSV, XLSX y Parquet.
+
+Las filas se leen en lotes de EXPORT_BATCH_SIZE con un cursor del lado del
+servidor (stream_results), así que la memoria usada no depende de cuántos
+paquetes se exporten:
+- CSV se envía lote a lote a medida que llegan las filas.
+- XLSX usa el modo write_only de openpyxl (cada fila se escribe a disco al
+  agregarla). Un .xlsx es un zip que recién queda completo al cerrarlo, así
+  que se arma en un archivo temporal y después se envía en trozos.
+- Parquet escribe un row group por lote con pyarrow y se envía igual que XLSX.
+
+CSV usa los mismos textos que la API ('$500.000', 'YYYY-MM-DD'); XLSX y
+Parquet conservan los tipos (fechas, horas y montos numéricos).
+"""
+import csv
+import io
+import os
+import tempfile
+from typing import Iterator, List
+
+from sqlalchemy import Date, DateTime, Integer, Numeric, Time
+from sqlalchemy.orm import Session
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+CHUNK_BYTES = 64 * 1024
+
+# formato -> (media type, extensión)
+FORMATOS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+def leer_en_lotes(session_factory, query) -> Iterator[list]:
+    """Ejecuta la consulta con una sesión propia y entrega las filas por lotes."""
+    db: Session = session_factory()
+    try:
+        resultado = db.execute(query.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE))
+        for lote in resultado.partitions():
+            yield lote
+    finally:
+        db.close()
+
+def _enviar_archivo(archivo) -> Iterator[bytes]:
+    archivo.seek(0)
+    while trozo := archivo.read(CHUNK_BYTES):
+        yield trozo
+
+def exportar_csv(lotes, nombres: List[str], columnas, serializar) -> Iterator[bytes]:
+    def generar():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write("\ufeff")  # BOM: Excel reconoce el UTF-8 (tildes, ñ)
+        writer.writerow(nombres)
+        yield buffer.getvalue().encode("utf-8")
+        for lote in lotes:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([serializar(v) for v in fila] for fila in lote)
+            yield buffer.getvalue().encode("utf-8")
+    return generar()
+
+def exportar_xlsx(lotes, nombres: List[str], columnas, serializar) -> Iterator[bytes]:
+    from openpyxl import Workbook
+
+    def generar():
+        libro = Workbook(write_only=True)
+        hoja = libro.create_sheet("Paquetes")
+        hoja.append(nombres)
+        for lote in lotes:
+            for fila in lote:
+                hoja.append(list(fila))
+        with tempfile.TemporaryFile() as archivo:
+            libro.save(archivo)
+            yield from _enviar_archivo(archivo)
+    return generar()
+
+def _tipo_arrow(columna):
+    import pyarrow as pa
+
+    tipo = columna.type
+    if isinstance(tipo, DateTime):
+        return pa.timestamp("us")
+    if isinstance(tipo, Date):
+        return pa.date32()
+    if isinstance(tipo, Time):
+        return pa.time64("us")
+    if isinstance(tipo, Numeric):
+        return pa.decimal128(tipo.precision, tipo.scale)
+    if isinstance(tipo, Integer):
+        return pa.int64()
+    return pa.string()
+
+def exportar_parquet(lotes, nombres: List[str], columnas, serializar) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([(n, _tipo_arrow(c)) for n, c in zip(nombres, columnas)])
+
+    def generar():
+        with tempfile.TemporaryFile() as archivo:
+            with pq.ParquetWriter(pa.PythonFile(archivo, mode="w"), esquema) as writer:
+                for lote in lotes:
+                    valores = list(zip(*lote))
+                    writer.write_batch(pa.record_batch(
+                        [pa.array(v, type=t) for v, t in zip(valores, esquema.types)], schema=esquema
+                    ))
+            yield from _enviar_archivo(archivo)
+    return generar()
+
+ESCRITORES = {
+    "csv": exportar_csv,
+    "xlsx": exportar_xlsx,
+    "parquet": exportar_parquet,
+}
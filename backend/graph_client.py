@@ -0,0 +1,135 @@
+"""
+Cliente HTTP compartido para Microsoft Graph y webhooks de Teams.
+
+Todas las llamadas salientes del backend pasan por una única requests.Session
+con pool de conexiones keep-alive, de modo que el handshake TCP/TLS con
+graph.microsoft.com se hace una vez por conexión y no una vez por request.
+Las respuestas 429/503 se reintentan respetando el header Retry-After.
+
+Los endpoints async usan en cambio un httpx.AsyncClient con los mismos límites
+de pool y la misma política de reintentos (aget/apost).
+"""
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Cantidad de hosts distintos con pool propio (Graph, login, webhook de Teams...)
+GRAPH_POOL_CONNECTIONS = int(os.getenv("GRAPH_POOL_CONNECTIONS", "4"))
+# Conexiones keep-alive máximas por host
+GRAPH_POOL_MAXSIZE = int(os.getenv("GRAPH_POOL_MAXSIZE", "10"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "3"))
+GRAPH_BACKOFF_FACTOR = float(os.getenv("GRAPH_BACKOFF_FACTOR", "0.5"))
+GRAPH_RETRY_STATUS = (429, 503)
+DEFAULT_TIMEOUT = 30
+
+def build_session() -> requests.Session:
+    """
+    Crea una sesión con pool por host y reintentos ante throttling.
+    Solo se reintentan errores de conexión y respuestas 429/503: en ambos casos
+    Graph no procesó el request, así que reintentar un POST (sendMail) es seguro.
+    """
+    retry = Retry(
+        total=GRAPH_MAX_RETRIES,
+        connect=GRAPH_MAX_RETRIES,
+        read=0,
+        status=GRAPH_MAX_RETRIES,
+        status_forcelist=GRAPH_RETRY_STATUS,
+        allowed_methods=frozenset({"GET", "POST"}),
+        backoff_factor=GRAPH_BACKOFF_FACTOR,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=GRAPH_POOL_CONNECTIONS,
+        pool_maxsize=GRAPH_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+session = build_session()
+
+def get(url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return session.get(url, **kwargs)
+
+def post(url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    return session.post(url, **kwargs)
+
+GRAPH_BATCH_URL = "https://graph.microsoft.com/v1.0/$batch"
+GRAPH_BATCH_LIMIT = 20  # Máximo de requests por $batch que acepta Graph
+
+def batch(requests_json: list, headers: dict, timeout: int = DEFAULT_TIMEOUT) -> dict:
+    """
+    Envía hasta 20 requests en un solo POST a /$batch (JSON batching de Graph).
+    Retorna un dict {id: respuesta} con status, headers y body de cada sub-request.
+    """
+    if len(requests_json) > GRAPH_BATCH_LIMIT:
+        raise ValueError(f"Graph acepta como máximo {GRAPH_BATCH_LIMIT} requests por batch")
+    r = post(GRAPH_BATCH_URL, headers=headers, json={"requests": requests_json}, timeout=timeout)
+    r.raise_for_status()
+    return {resp["id"]: resp for resp in r.json().get("responses", [])}
+
+# --- Cliente async (endpoints async def) ---
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+def build_async_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=DEFAULT_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=GRAPH_POOL_CONNECTIONS * GRAPH_POOL_MAXSIZE,
+            max_keepalive_connections=GRAPH_POOL_MAXSIZE,
+        ),
+    )
+
+def async_client() -> httpx.AsyncClient:
+    """Cliente async del proceso; se crea al primer uso dentro del event loop."""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = build_async_client()
+    return _async_client
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+def _retry_after(response: httpx.Response, intento: int) -> float:
+    valor = response.headers.get("Retry-After")
+    if valor and valor.isdigit():
+        return float(valor)
+    return GRAPH_BACKOFF_FACTOR * (2 ** intento)
+
+async def arequest(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Igual que get/post pero sin bloquear el event loop. Reintenta errores de
+    conexión y 429/503 (respetando Retry-After) hasta GRAPH_MAX_RETRIES veces.
+    """
+    for intento in range(GRAPH_MAX_RETRIES + 1):
+        try:
+            r = await async_client().request(method, url, **kwargs)
+        except httpx.ConnectError:
+            if intento == GRAPH_MAX_RETRIES:
+                raise
+            await asyncio.sleep(GRAPH_BACKOFF_FACTOR * (2 ** intento))
+            continue
+        if r.status_code not in GRAPH_RETRY_STATUS or intento == GRAPH_MAX_RETRIES:
+            return r
+        await asyncio.sleep(_retry_after(r, intento))
+    return r
+
+async def aget(url: str, **kwargs) -> httpx.Response:
+    return await arequest("GET", url, **kwargs)
+
+async def apost(url: str, **kwargs) -> httpx.Response:
+    return await arequest("POST", url, **kwargs)
@@ -1,17 +1,37 @@
 # Backend API for Recepción de Paquetes - v3.0 (PostgreSQL)
 import os
-from typing import Optional, Literal
-from fastapi import FastAPI, HTTPException, Depends
+from typing import Optional, Literal, List
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from sqlalchemy import Float, Integer, func, insert, or_, select, text, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr, Field
-from datetime import datetime
-import requests
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, EmailStr, Field, ValidationError, field_validator
+from datetime import date, datetime, time as dtime, timedelta
+from decimal import Decimal
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import io
+import json
+import threading
+import time
 import msal
 
 from dotenv import load_dotenv
 from pathlib import Path
-from database import Package, get_db, SessionLocal
+from database import Package, NotificationOutbox, get_db, SessionLocal, next_package_version, current_package_version, db_pool_stats, get_async_db, async_engine
+from database import PackageDailyStat, adjust_daily_stats, daily_stat_key, reserve_codigos_retiro
+import email_templates
+import exporter
+import graph_client
+import reminders
+import search
+from directory_index import DirectoryIndex
+from migrations.backfill import parse_monto
 
 # Cargar .env solo si existe (para desarrollo local)
 # En producción (Railway), las variables se inyectan directamente
@@ -53,38 +73,193 @@ class PackageIn(BaseModel):
     medioNotificacion: Literal["Correo", "Teams", "Ambos"]
     observaciones: Optional[str] = ""
     adjuntoUrl: Optional[str] = ""
-    fechaRecepcion: str = Field(default_factory=lambda: datetime.now().strftime("%Y-%m-%d"))
-    horaRecepcion: str = Field(default_factory=lambda: datetime.now().strftime("%H:%M:%S"))
-    codigoRetiro: str
+    fechaRecepcion: date = Field(default_factory=date.today)
+    horaRecepcion: dtime = Field(default_factory=lambda: datetime.now().time().replace(microsecond=0))
+    codigoRetiro: Optional[str] = None  # vacío: lo asigna el servidor (reserve_codigos_retiro)
     # Campos específicos para cheques
-    montoCheque: Optional[str] = ""
-    fechaVencimientoCheque: Optional[str] = ""
+    montoCheque: Optional[str] = ""  # texto libre ("$500.000"), se guarda como Numeric
+    fechaVencimientoCheque: Optional[date] = None
+
+    @field_validator("fechaVencimientoCheque", mode="before")
+    @classmethod
+    def _fecha_vacia(cls, v):
+        return v or None
 
 class PackageOut(BaseModel):
     id: str
     estado: str
+    codigoRetiro: str
 
 # Excel functions removed - now using PostgreSQL database
 
-def msal_acquire_token() -> Optional[str]:
-    if not (TENANT_ID and CLIENT_ID and CLIENT_SECRET):
-        print(f"MSAL ERROR: Missing credentials - TENANT_ID={bool(TENANT_ID)}, CLIENT_ID={bool(CLIENT_ID)}, CLIENT_SECRET={bool(CLIENT_SECRET)}")
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+# Opcional: archivo de cache MSAL compartido entre workers de uvicorn
+MSAL_CACHE_PATH = os.getenv("MSAL_CACHE_PATH", "")
+# Segundos antes del vencimiento en que se renueva el token en segundo plano.
+# Debe ser menor a 300: MSAL devuelve el token cacheado hasta 5 min antes de vencer.
+TOKEN_REFRESH_MARGIN = min(int(os.getenv("TOKEN_REFRESH_MARGIN", "240")), 290)
+
+class GraphTokenProvider:
+    """
+    Proveedor de tokens de aplicación para Microsoft Graph (uno por proceso).
+    Reutiliza una sola ConfidentialClientApplication, mantiene el token en
+    memoria y lo renueva antes de que venga para que las rutas de
+    notificación nunca esperen a login.microsoftonline.com.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._app = None
+        self._cache = None
+        self._cache_mtime = 0.0
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def _get_app(self):
+        if self._app is None:
+            self._cache = msal.SerializableTokenCache()
+            self._load_disk_cache()
+            self._app = msal.ConfidentialClientApplication(
+                CLIENT_ID,
+                authority=f"https://login.microsoftonline.com/{TENANT_ID}",
+                client_credential=CLIENT_SECRET,
+                token_cache=self._cache,
+                http_client=graph_client.session,
+            )
+        return self._app
+
+    def _load_disk_cache(self):
+        if not MSAL_CACHE_PATH or not os.path.exists(MSAL_CACHE_PATH):
+            return
+        try:
+            mtime = os.path.getmtime(MSAL_CACHE_PATH)
+            if mtime != self._cache_mtime:
+                with open(MSAL_CACHE_PATH, "r", encoding="utf-8") as f:
+                    self._cache.deserialize(f.read())
+                self._cache_mtime = mtime
+        except Exception as e:
+            print(f"MSAL WARNING: No se pudo leer la cache {MSAL_CACHE_PATH}: {e}")
+
+    def _save_disk_cache(self):
+        if not MSAL_CACHE_PATH or not self._cache.has_state_changed:
+            return
+        try:
+            tmp_path = f"{MSAL_CACHE_PATH}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self._cache.serialize())
+            os.replace(tmp_path, MSAL_CACHE_PATH)  # Escritura atómica entre workers
+            self._cache_mtime = os.path.getmtime(MSAL_CACHE_PATH)
+            self._cache.has_state_changed = False
+        except Exception as e:
+            print(f"MSAL WARNING: No se pudo escribir la cache {MSAL_CACHE_PATH}: {e}")
+
+    def _valid_token(self) -> Optional[str]:
+        # 60 s de holgura para no entregar un token que vence en vuelo
+        if self._token and time.time() < self._expires_at - 60:
+            return self._token
         return None
-    authority = f"https://login.microsoftonline.com/{TENANT_ID}"
-    app_msal = msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=authority, client_credential=CLIENT_SECRET
-    )
-    result = app_msal.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
-    if "access_token" not in result:
-        print(f"MSAL ERROR: No access token in result. Full response: {result}")
-    return result.get("access_token")
 
-def send_email_graph(to_email: str, subject: str, html_body: str) -> bool:
-    token = msal_acquire_token()
-    if not token:
-        return False
-    url = f"https://graph.microsoft.com/v1.0/users/{GRAPH_SENDER_UPN}/sendMail"
-    payload = {
+    def _acquire(self) -> Optional[str]:
+        """Obtiene un token de MSAL (cache o red). Requiere tener self._lock."""
+        app = self._get_app()
+        self._load_disk_cache()
+        result = app.acquire_token_for_client(scopes=GRAPH_SCOPES)
+        if "access_token" not in result:
+            self.errors += 1
+            print(f"MSAL ERROR: No access token in result. Full response: {result}")
+            return None
+        self._token = result["access_token"]
+        self._expires_at = time.time() + int(result.get("expires_in", 3600))
+        self._save_disk_cache()
+        return self._token
+
+    def get_token(self) -> Optional[str]:
+        if not (TENANT_ID and CLIENT_ID and CLIENT_SECRET):
+            print(f"MSAL ERROR: Missing credentials - TENANT_ID={bool(TENANT_ID)}, CLIENT_ID={bool(CLIENT_ID)}, CLIENT_SECRET={bool(CLIENT_SECRET)}")
+            return None
+        token = self._valid_token()
+        if token:
+            self.hits += 1
+            return token
+        with self._lock:
+            token = self._valid_token()  # Otro hilo pudo renovarlo mientras esperábamos
+            if token:
+                self.hits += 1
+                return token
+            self.misses += 1
+            return self._acquire()
+
+    async def get_token_async(self) -> Optional[str]:
+        """Para handlers async: el token en memoria se retorna sin bloquear;
+        solo si hay que ir a login.microsoftonline.com se usa el threadpool."""
+        if TENANT_ID and CLIENT_ID and CLIENT_SECRET:
+            token = self._valid_token()
+            if token:
+                self.hits += 1
+                return token
+        return await run_in_threadpool(self.get_token)
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            if self._token:
+                wait = self._expires_at - TOKEN_REFRESH_MARGIN - time.time()
+            else:
+                wait = 0
+            if wait > 0 and self._stop.wait(wait):
+                break
+            with self._lock:
+                try:
+                    ok = self._acquire() is not None
+                except Exception as e:
+                    ok = False
+                    self.errors += 1
+                    print(f"MSAL ERROR: Falló la renovación del token: {e}")
+                if ok:
+                    self.refreshes += 1
+            if not ok and self._stop.wait(30):
+                break
+
+    def start(self):
+        if not (TENANT_ID and CLIENT_ID and CLIENT_SECRET):
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="msal-token-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        restante = self._expires_at - time.time() if self._token else 0
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "expira_en_s": max(int(restante), 0),
+            "cache_disco": bool(MSAL_CACHE_PATH),
+        }
+
+token_provider = GraphTokenProvider()
+
+def msal_acquire_token() -> Optional[str]:
+    return token_provider.get_token()
+
+directory_index = DirectoryIndex(token_getter=msal_acquire_token)
+
+async def msal_acquire_token_async() -> Optional[str]:
+    return await token_provider.get_token_async()
+
+def sendmail_payload(to_email: str, subject: str, html_body: str) -> dict:
+    return {
         "message": {
             "subject": subject,
             "body": {"contentType": "HTML", "content": html_body},
@@ -92,8 +267,25 @@ def send_email_graph(to_email: str, subject: str, html_body: str) -> bool:
         },
         "saveToSentItems": "true",
     }
+
+def send_email_graph(to_email: str, subject: str, html_body: str) -> bool:
+    token = msal_acquire_token()
+    if not token:
+        return False
+    url = f"https://graph.microsoft.com/v1.0/users/{GRAPH_SENDER_UPN}/sendMail"
+    payload = sendmail_payload(to_email, subject, html_body)
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    r = requests.post(url, headers=headers, json=payload, timeout=30)
+    r = graph_client.post(url, headers=headers, json=payload, timeout=30)
+    return r.status_code in (202, 200)
+
+async def send_email_graph_async(to_email: str, subject: str, html_body: str) -> bool:
+    token = await msal_acquire_token_async()
+    if not token:
+        return False
+    url = f"https://graph.microsoft.com/v1.0/users/{GRAPH_SENDER_UPN}/sendMail"
+    payload = sendmail_payload(to_email, subject, html_body)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    r = await graph_client.apost(url, headers=headers, json=payload, timeout=30)
     return r.status_code in (202, 200)
 
 def notify_teams_webhook(text: str) -> bool:
@@ -101,134 +293,13 @@ def notify_teams_webhook(text: str) -> bool:
         return False
     payload = {"text": text}
     try:
-        r = requests.post(TEAMS_WEBHOOK_URL, json=payload, timeout=15)
+        r = graph_client.post(TEAMS_WEBHOOK_URL, json=payload, timeout=15)
         return r.status_code in (200, 204)
     except Exception:
         return False
 
 def format_email_html(pkg: PackageIn) -> str:
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                line-height: 1.4;
-                color: #333;
-                max-width: 550px;
-                margin: 0 auto;
-            }}
-            .header {{
-                background: #4a5568;
-                color: white;
-                padding: 15px;
-                text-align: center;
-            }}
-            .header h2 {{
-                margin: 0;
-                font-size: 18px;
-            }}
-            .content {{
-                padding: 20px;
-                background: #f9f9f9;
-            }}
-            .info-table {{
-                width: 100%;
-                margin: 15px 0;
-                background: white;
-                border: 1px solid #ddd;
-            }}
-            .info-table td {{
-                padding: 8px 12px;
-                border-bottom: 1px solid #eee;
-                font-size: 14px;
-            }}
-            .info-table tr:last-child td {{
-                border-bottom: none;
-            }}
-            .info-table td:first-child {{
-                font-weight: 600;
-                color: #4a5568;
-                width: 35%;
-            }}
-            .important {{
-                background: #fff3cd;
-                border-left: 3px solid #ff9800;
-                padding: 12px;
-                margin: 15px 0;
-                font-size: 13px;
-            }}
-            .important strong {{
-                color: #e65100;
-            }}
-            .footer {{
-                margin-top: 15px;
-                font-size: 13px;
-                color: #666;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h2>📦 Recepción de Correspondencia</h2>
-        </div>
-
-        <div class="content">
-            <p>Estimado(a) <strong>{pkg.destinatarioNombre}</strong>,</p>
-            <p>Ha llegado correspondencia a su nombre:</p>
-
-            <table class="info-table">
-                <tr>
-                    <td>🚚 Proveedor</td>
-                    <td>{pkg.proveedor}</td>
-                </tr>
-                <tr>
-                    <td>📄 Tipo de Documento</td>
-                    <td>{pkg.tipoDocumento}</td>
-                </tr>
-                <tr>
-                    <td>🔢 Número de Documento</td>
-                    <td>{pkg.numeroDocumento}</td>
-                </tr>
-                {"" if pkg.tipoDocumento != "Cheque" or not pkg.montoCheque else f'''
-                <tr>
-                    <td>💰 Monto del Cheque</td>
-                    <td>{pkg.montoCheque}</td>
-                </tr>
-                '''}
-                {"" if pkg.tipoDocumento != "Cheque" or not pkg.fechaVencimientoCheque else f'''
-                <tr>
-                    <td>📆 Fecha de Vencimiento</td>
-                    <td>{pkg.fechaVencimientoCheque}</td>
-                </tr>
-                '''}
-                <tr>
-                    <td>📅 Fecha de Recepción</td>
-                    <td>{pkg.fechaRecepcion}</td>
-                </tr>
-                <tr>
-                    <td>🕐 Hora de Recepción</td>
-                    <td>{pkg.horaRecepcion}</td>
-                </tr>
-            </table>
-
-            <div class="important">
-                <strong>🚩 Importante:</strong> Retiro mismo día de notificación<br>
-                • Lunes a Jueves: hasta 18:00 hrs<br>
-                • Viernes: hasta 17:00 hrs
-            </div>
-
-            <div class="footer">
-                <p>De antemano, muchas gracias.</p>
-                <p><strong>Rudth Nuñez</strong><br>
-                Recepcionista - Multiaceros S.A.<br>
-                📧 recepcion@multiaceros.cl</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
+    return email_templates.renderizar("recepcion.html", nombre=pkg.destinatarioNombre, pkg=pkg)
 
 @app.get("/health")
 def health():
@@ -272,8 +343,8 @@ def debug_database(db: Session = Depends(get_db)):
                 "id": pkg.id,
                 "codigo": pkg.codigo_retiro,
                 "destinatario": pkg.destinatario_nombre,
-                "fecha": pkg.fecha_recepcion,
-                "hora": pkg.hora_recepcion,
+                "fecha": serializar_valor(pkg.fecha_recepcion),
+                "hora": serializar_valor(pkg.hora_recepcion),
                 "sucursal": pkg.sucursal
             })
 
@@ -285,32 +356,9 @@ def debug_database(db: Session = Depends(get_db)):
             "total_packages": 0
         }
 
-@app.post("/register", response_model=PackageOut)
-def register_package(pkg: PackageIn, db: Session = Depends(get_db)):
-    from datetime import datetime as dt
-
-    estado = "Pendiente"
-    notified = False
-
-    # Send notifications
-    if pkg.medioNotificacion in ("Correo", "Ambos"):
-        ok_mail = send_email_graph(
-            pkg.destinatarioEmail,
-            f"Recepción de paquete — {pkg.destinatarioNombre} — {pkg.sucursal}",
-            format_email_html(pkg),
-        )
-        notified = notified or ok_mail
-
-    if pkg.medioNotificacion in ("Teams", "Ambos"):
-        text = f"📦 Paquete para {pkg.destinatarioNombre} ({pkg.destinatarioEmail}). Proveedor: {pkg.proveedor}. Doc: {pkg.tipoDocumento} {pkg.numeroDocumento}. Código: {pkg.codigoRetiro}. Sucursal: {pkg.sucursal}."
-        ok_teams = notify_teams_webhook(text)
-        notified = notified or ok_teams
-
-    if notified:
-        estado = "Notificado"
-
-    # Save to database
-    db_package = Package(
+def package_values(pkg: PackageIn, codigo_retiro: str, monto_cheque: Optional[Decimal]) -> dict:
+    """Columnas de un paquete recién recibido (estado Pendiente) a partir del formulario."""
+    return dict(
         fecha_recepcion=pkg.fechaRecepcion,
         hora_recepcion=pkg.horaRecepcion,
         sucursal=pkg.sucursal,
@@ -321,150 +369,1018 @@ def register_package(pkg: PackageIn, db: Session = Depends(get_db)):
         destinatario_nombre=pkg.destinatarioNombre,
         destinatario_email=pkg.destinatarioEmail,
         medio_notificacion=pkg.medioNotificacion,
-        codigo_retiro=pkg.codigoRetiro,
-        estado=estado,
-        fecha_notificacion=dt.utcnow().strftime("%Y-%m-%d %H:%M:%S") if notified else "",
+        codigo_retiro=codigo_retiro,
+        estado="Pendiente",
+        fecha_notificacion=None,
         destinatario_confirmo="No",
-        fecha_retiro="",
+        fecha_retiro=None,
         entregado_a="",
         observaciones=pkg.observaciones or "",
         adjunto_url=pkg.adjuntoUrl or "",
-        monto_cheque=pkg.montoCheque or "",
-        fecha_vencimiento_cheque=pkg.fechaVencimientoCheque or ""
+        monto_cheque=monto_cheque,
+        fecha_vencimiento_cheque=pkg.fechaVencimientoCheque,
     )
 
+# Reintentos cuando un correlativo coincide con un código ya guardado
+# (los códigos anteriores al correlativo eran aleatorios)
+CODIGO_MAX_INTENTOS = 5
+
+@app.post("/register", response_model=PackageOut)
+async def register_package(pkg: PackageIn, db: AsyncSession = Depends(get_async_db)):
+    """
+    Registra el paquete y encola sus notificaciones en la misma transacción.
+    El envío real lo hace el worker del outbox, que cambia el estado a
+    "Notificado" cuando Graph/Teams confirman la entrega.
+    """
+    estado = "Pendiente"
+
+    monto_cheque = parse_monto(pkg.montoCheque) if pkg.montoCheque else None
+    if pkg.montoCheque and monto_cheque is None:
+        raise HTTPException(status_code=422, detail=f"Monto de cheque inválido: {pkg.montoCheque}")
+
+    recibido = (pkg.codigoRetiro or "").strip()
     try:
-        db.add(db_package)
-        db.commit()
-        db.refresh(db_package)
-        print(f"✅ Package saved successfully: ID={db_package.id}, Code={pkg.codigoRetiro}")
+        for intento in range(1, CODIGO_MAX_INTENTOS + 1):
+            codigo = recibido or (await db.run_sync(reserve_codigos_retiro, pkg.fechaRecepcion))[0]
+            db_package = Package(**package_values(pkg, codigo, monto_cheque))
+            try:
+                # Savepoint: si el código ya existe (p. ej. uno aleatorio de
+                # antes del correlativo) se toma el siguiente sin perder la reserva
+                async with db.begin_nested():
+                    db.add(db_package)
+                    await db.flush()  # Necesario para conocer el ID antes de encolar
+                break
+            except IntegrityError:
+                if recibido or intento == CODIGO_MAX_INTENTOS:
+                    raise HTTPException(status_code=409, detail=f"Código de retiro ya usado: {codigo}")
+        pkg = pkg.model_copy(update={"codigoRetiro": codigo})
+        await db.run_sync(enqueue_package_notifications, db_package, pkg)
+        await db.commit()
+        print(f"✅ Package saved successfully: ID={db_package.id}, Code={codigo}")
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"❌ Error saving package: {e}")
         raise HTTPException(status_code=500, detail=f"Error guardando en base de datos: {e}")
 
-    id_simple = f"{db_package.id}-{pkg.codigoRetiro}"
-    return {"id": id_simple, "estado": estado}
+    outbox_wakeup.set()
+
+    id_simple = f"{db_package.id}-{codigo}"
+    return {"id": id_simple, "estado": estado, "codigoRetiro": codigo}
+
+# ==== Outbox de notificaciones ====
+# /register solo escribe en la tabla notification_outbox; este worker la drena
+# en segundo plano con reintentos y backoff exponencial. Las filas que agotan
+# los reintentos quedan en estado "Descartado" (dead letter) para revisión.
+
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_MAX_INTENTOS = int(os.getenv("OUTBOX_MAX_INTENTOS", "6"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "15"))  # segundos
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "1800"))  # segundos
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+
+outbox_wakeup = threading.Event()
+_outbox_stop = threading.Event()
+_outbox_thread: Optional[threading.Thread] = None
+
+class OutboxStats:
+    """Contadores en memoria del dispatcher (por proceso)."""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self.enviados = 0
+        self.fallidos = 0
+        self.descartados = 0
+        self._latencias = deque(maxlen=window)  # creado_en -> enviado_en (s)
+        self._duraciones = deque(maxlen=window)  # duración de la llamada (s)
+
+    def registrar_envio(self, latencia: float, duracion: float):
+        with self._lock:
+            self.enviados += 1
+            self._latencias.append(latencia)
+            self._duraciones.append(duracion)
+
+    def registrar_fallo(self, descartado: bool):
+        with self._lock:
+            self.fallidos += 1
+            if descartado:
+                self.descartados += 1
+
+    @staticmethod
+    def _resumen(valores) -> dict:
+        if not valores:
+            return {"ultima_ms": None, "promedio_ms": None, "p95_ms": None}
+        ordenados = sorted(valores)
+        p95 = ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.95))]
+        return {
+            "ultima_ms": round(valores[-1] * 1000, 1),
+            "promedio_ms": round(sum(valores) / len(valores) * 1000, 1),
+            "p95_ms": round(p95 * 1000, 1),
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "enviados": self.enviados,
+                "fallidos": self.fallidos,
+                "descartados": self.descartados,
+                "latencia_despacho": self._resumen(list(self._latencias)),
+                "duracion_envio": self._resumen(list(self._duraciones)),
+            }
+
+outbox_stats = OutboxStats()
+
+def _canales(pkg: PackageIn) -> List[str]:
+    canales = []
+    if pkg.medioNotificacion in ("Correo", "Ambos"):
+        canales.append("Correo")
+    if pkg.medioNotificacion in ("Teams", "Ambos") and TEAMS_WEBHOOK_URL:
+        canales.append("Teams")
+    return canales
+
+def _contenido_notificacion(canal: str, paquetes: List[PackageIn]) -> tuple:
+    """
+    (destinatario, asunto, cuerpo) de la notificación por `canal` para uno o
+    varios paquetes del mismo destinatario (codigoRetiro ya asignado).
+    """
+    primero = paquetes[0]
+    if canal == "Correo":
+        if len(paquetes) == 1:
+            asunto = f"Recepción de paquete — {primero.destinatarioNombre} — {primero.sucursal}"
+            return primero.destinatarioEmail, asunto, format_email_html(primero)
+        asunto = f"Recepción de {len(paquetes)} paquetes — {primero.destinatarioNombre} — {primero.sucursal}"
+        return primero.destinatarioEmail, asunto, format_bulk_email_html(paquetes)
+
+    if len(paquetes) == 1:
+        text = f"📦 Paquete para {primero.destinatarioNombre} ({primero.destinatarioEmail}). Proveedor: {primero.proveedor}. Doc: {primero.tipoDocumento} {primero.numeroDocumento}. Código: {primero.codigoRetiro}. Sucursal: {primero.sucursal}."
+    else:
+        detalle = "; ".join(f"{pkg.proveedor} {pkg.tipoDocumento} {pkg.numeroDocumento} ({pkg.codigoRetiro})" for pkg in paquetes)
+        text = f"📦 {len(paquetes)} paquetes para {primero.destinatarioNombre} ({primero.destinatarioEmail}). Sucursal: {primero.sucursal}. {detalle}."
+    return TEAMS_WEBHOOK_URL, None, text
+
+def _encolar(db: Session, canal: str, package_ids: List[int], paquetes: List[PackageIn]) -> int:
+    """
+    Encola la notificación de `paquetes` (mismo destinatario) por `canal`, o
+    la suma al resumen retenido si el modo resumen está activo.
+    Retorna 1 si agregó una fila al outbox. No hace commit.
+    """
+    if NOTIFICATION_DIGEST_SECONDS > 0:
+        return encolar_resumen(db, paquetes[0].destinatarioEmail, canal, package_ids)
+
+    destinatario, asunto, cuerpo = _contenido_notificacion(canal, paquetes)
+    db.add(NotificationOutbox(
+        package_ids=",".join(str(package_id) for package_id in package_ids),
+        canal=canal,
+        destinatario=destinatario,
+        asunto=asunto,
+        cuerpo=cuerpo,
+        estado="Pendiente",
+        intentos=0,
+        proximo_intento=datetime.utcnow(),
+    ))
+    return 1
+
+def enqueue_package_notifications(db: Session, db_package: Package, pkg: PackageIn) -> int:
+    """
+    Agrega a la sesión las notificaciones del paquete (no hace commit).
+    Retorna la cantidad de mensajes nuevos en el outbox.
+    """
+    return sum(_encolar(db, canal, [db_package.id], [pkg]) for canal in _canales(pkg))
+
+# ==== Modo resumen ====
+# Con NOTIFICATION_DIGEST_SECONDS > 0 las notificaciones de un destinatario se
+# retienen ese tiempo (contado desde el primer paquete) en una sola fila del
+# outbox por canal, que va acumulando los IDs de los paquetes que llegan
+# mientras tanto. El dispatcher arma el correo al despachar, con todos ellos.
+
+NOTIFICATION_DIGEST_SECONDS = float(os.getenv("NOTIFICATION_DIGEST_SECONDS", "0"))
+
+def encolar_resumen(db: Session, destinatario_email: str, canal: str, package_ids: List[int]) -> int:
+    """
+    Suma los paquetes a la fila retenida del destinatario en `canal` o crea
+    una nueva. El UPDATE condicional solo alcanza filas que el dispatcher
+    todavía no puede tomar (proximo_intento en el futuro, sin intentos), así
+    que un paquete nunca se agrega a un resumen ya enviado.
+    Retorna 1 si creó una fila, 0 si se sumó a una existente. No hace commit.
+    """
+    clave = destinatario_email.lower()
+    ahora = datetime.utcnow()
+    ids = ",".join(str(package_id) for package_id in package_ids)
+    retenida = (
+        NotificationOutbox.resumen_de == clave,
+        NotificationOutbox.canal == canal,
+        NotificationOutbox.estado == "Pendiente",
+        NotificationOutbox.intentos == 0,
+        NotificationOutbox.proximo_intento > ahora,
+    )
+    fila = select(NotificationOutbox.id).where(*retenida).order_by(NotificationOutbox.id).limit(1).scalar_subquery()
+    # Las condiciones se repiten fuera de la subconsulta: en PostgreSQL se
+    # vuelven a evaluar si otra transacción modificó la fila mientras tanto
+    agregado = db.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id == fila, *retenida)
+        .values(package_ids=NotificationOutbox.package_ids + "," + ids)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if agregado:
+        return 0
+
+    db.add(NotificationOutbox(
+        package_ids=ids,
+        canal=canal,
+        destinatario=destinatario_email if canal == "Correo" else TEAMS_WEBHOOK_URL,
+        cuerpo="",  # se arma al despachar (_componer_resumen)
+        estado="Pendiente",
+        intentos=0,
+        proximo_intento=ahora + timedelta(seconds=NOTIFICATION_DIGEST_SECONDS),
+        resumen_de=clave,
+    ))
+    return 1
+
+def _package_in(p: Package) -> PackageIn:
+    """PackageIn (sin validar) con los datos guardados del paquete."""
+    return PackageIn.model_construct(
+        sucursal=p.sucursal,
+        recepcionista=p.recepcionista,
+        proveedor=p.proveedor,
+        tipoDocumento=p.tipo_documento,
+        numeroDocumento=p.numero_documento,
+        destinatarioNombre=p.destinatario_nombre,
+        destinatarioEmail=p.destinatario_email,
+        medioNotificacion=p.medio_notificacion,
+        observaciones=p.observaciones,
+        adjuntoUrl=p.adjunto_url,
+        fechaRecepcion=p.fecha_recepcion,
+        horaRecepcion=p.hora_recepcion,
+        codigoRetiro=p.codigo_retiro,
+        montoCheque=formatear_monto(p.monto_cheque) if p.monto_cheque is not None else "",
+        fechaVencimientoCheque=p.fecha_vencimiento_cheque,
+    )
+
+def _componer_resumen(db: Session, mensaje: NotificationOutbox):
+    """Completa asunto y cuerpo de una fila del modo resumen con los paquetes que acumuló."""
+    ids = [int(x) for x in mensaje.package_ids.split(",") if x]
+    paquetes = [_package_in(p) for p in db.query(Package).filter(Package.id.in_(ids)).order_by(Package.id)]
+    if not paquetes:
+        raise ValueError(f"Los paquetes del resumen ya no existen: {mensaje.package_ids}")
+    _, mensaje.asunto, mensaje.cuerpo = _contenido_notificacion(mensaje.canal, paquetes)
+
+# ==== Registro masivo ====
+# Para entregas grandes (p. ej. 40 guías de un mismo courier): todas las filas
+# se insertan en una transacción, los códigos de retiro los asigna el servidor
+# y cada destinatario recibe una sola notificación con todos sus paquetes.
+
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "2000"))
+# Zona de la fecha/hora de recepción de las filas que no la traen (la misma
+# hora de Chile que envía el Dashboard en /register, no la del servidor)
+BULK_TZ = reminders.zona_horaria(reminders.REMINDER_TZ)
+
+def format_bulk_email_html(paquetes: List[PackageIn]) -> str:
+    """Un solo correo con todos los paquetes recibidos para el mismo destinatario."""
+    return email_templates.renderizar("recepcion_agrupada.html", nombre=paquetes[0].destinatarioNombre, paquetes=paquetes)
+
+def enqueue_grouped_notifications(db: Session, registrados: List[tuple]) -> int:
+    """
+    Encola una notificación por destinatario (y canal) para todos sus paquetes.
+    `registrados` son tuplas (id, codigo_retiro, PackageIn). No hace commit.
+    """
+    grupos = {}
+    for package_id, codigo, pkg in registrados:
+        grupos.setdefault(pkg.destinatarioEmail.lower(), []).append(
+            (package_id, pkg.model_copy(update={"codigoRetiro": codigo}))
+        )
+
+    nuevos = 0
+    for grupo in grupos.values():
+        for canal in ("Correo", "Teams"):
+            del_canal = [(package_id, pkg) for package_id, pkg in grupo if canal in _canales(pkg)]
+            if del_canal:
+                nuevos += _encolar(db, canal, [package_id for package_id, _ in del_canal], [pkg for _, pkg in del_canal])
+    return nuevos
+
+def _leer_csv(contenido: bytes) -> List[dict]:
+    """
+    Filas de un CSV con los mismos campos que /register (acepta también los
+    encabezados PascalCase de /export, separador "," o ";"). Las celdas vacías
+    se omiten para que apliquen los valores por defecto.
+    """
+    texto = contenido.decode("utf-8-sig")
+    primera_linea = texto.split("\n", 1)[0]
+    separador = ";" if primera_linea.count(";") > primera_linea.count(",") else ","
+    lector = csv.DictReader(io.StringIO(texto), delimiter=separador)
+    lector.fieldnames = [c.strip()[:1].lower() + c.strip()[1:] for c in lector.fieldnames or []]
+    return [{k: v.strip() for k, v in fila.items() if k and v and v.strip()} for fila in lector]
+
+async def _codigos_existentes(db: AsyncSession, codigos: List[str]) -> set:
+    existentes = set()
+    for i in range(0, len(codigos), 500):
+        lote = [c.upper() for c in codigos[i:i + 500]]
+        existentes.update((await db.execute(
+            select(func.upper(Package.codigo_retiro)).where(func.upper(Package.codigo_retiro).in_(lote))
+        )).scalars())
+    return existentes
+
+async def _asignar_codigos(db: AsyncSession, paquetes: List[PackageIn]) -> List[str]:
+    """
+    Código de retiro de cada fila: el recibido o el siguiente correlativo de
+    su fecha de recepción. Un código recibido repetido es 409.
+    """
+    recibidos = [p.codigoRetiro.strip().upper() for p in paquetes if p.codigoRetiro and p.codigoRetiro.strip()]
+    repetidos = {c for c in recibidos if recibidos.count(c) > 1} | await _codigos_existentes(db, recibidos)
+    if repetidos:
+        raise HTTPException(status_code=409, detail=f"Códigos de retiro ya usados: {', '.join(sorted(repetidos))}")
+
+    codigos = [p.codigoRetiro.strip() if p.codigoRetiro and p.codigoRetiro.strip() else None for p in paquetes]
+    por_fecha = {}
+    for i, codigo in enumerate(codigos):
+        if codigo is None:
+            por_fecha.setdefault(paquetes[i].fechaRecepcion, []).append(i)
+    # Fechas en orden para que dos cargas simultáneas bloqueen las filas de
+    # codigo_retiro_secuencias en el mismo orden (sin deadlock)
+    for fecha in sorted(por_fecha):
+        indices = por_fecha[fecha]
+        for i, codigo in zip(indices, await db.run_sync(reserve_codigos_retiro, fecha, len(indices))):
+            codigos[i] = codigo
+    return codigos
+
+@app.post("/register/bulk")
+async def register_bulk(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Registra muchos paquetes en una sola transacción. El cuerpo puede ser una
+    lista JSON de paquetes (mismos campos que /register; codigoRetiro es
+    opcional) o un CSV (Content-Type: text/csv) con esos campos como columnas.
+    Si alguna fila es inválida no se registra ninguna (422 con el detalle).
+    Cada destinatario recibe una sola notificación con todos sus paquetes.
+    """
+    tipo_contenido = request.headers.get("content-type", "")
+    cuerpo = await request.body()
+    try:
+        filas = _leer_csv(cuerpo) if tipo_contenido.startswith("text/csv") else json.loads(cuerpo or b"null")
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Cuerpo inválido: {e}")
+    if not isinstance(filas, list) or not filas:
+        raise HTTPException(status_code=400, detail="Se esperaba una lista de paquetes (JSON) o un CSV con al menos una fila")
+    if len(filas) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_ROWS} paquetes por carga")
+
+    # Una sola marca de tiempo para toda la carga (la plantilla CSV no trae
+    # fecha ni hora de recepción)
+    ahora_local = datetime.now(BULK_TZ)
+    recepcion = {"fechaRecepcion": ahora_local.date(), "horaRecepcion": ahora_local.time().replace(microsecond=0, tzinfo=None)}
+
+    paquetes, montos, errores = [], [], []
+    for n, fila in enumerate(filas, start=1):
+        if isinstance(fila, dict):
+            fila = {**fila, **{k: v for k, v in recepcion.items() if not fila.get(k)}}
+        try:
+            pkg = PackageIn.model_validate(fila)
+        except ValidationError as e:
+            errores.append(f"Fila {n}: " + "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        monto = parse_monto(pkg.montoCheque) if pkg.montoCheque else None
+        if pkg.montoCheque and monto is None:
+            errores.append(f"Fila {n}: monto de cheque inválido: {pkg.montoCheque}")
+        paquetes.append(pkg)
+        montos.append(monto)
+    if errores:
+        raise HTTPException(status_code=422, detail=errores)
+
+    try:
+        codigos = await _asignar_codigos(db, paquetes)
+        generados = [not (p.codigoRetiro and p.codigoRetiro.strip()) for p in paquetes]
+        ultima_version = await db.run_sync(next_package_version, len(paquetes))
+        ahora = datetime.utcnow()
+        valores = [
+            {**package_values(pkg, codigo, monto), "version": ultima_version - len(paquetes) + 1 + i, "actualizado_en": ahora}
+            for i, (pkg, codigo, monto) in enumerate(zip(paquetes, codigos, montos))
+        ]
+        for intento in range(1, CODIGO_MAX_INTENTOS + 1):
+            try:
+                # INSERT masivo (executemany / insertmanyvalues): no pasa por los
+                # listeners del ORM, así que versión y rollup se ajustan aquí
+                async with db.begin_nested():
+                    ids = (await db.execute(
+                        insert(Package).returning(Package.id, sort_by_parameter_order=True), valores
+                    )).scalars().all()
+                break
+            except IntegrityError as e:
+                # Un correlativo coincidió con un código anterior (aleatorio):
+                # solo esos toman el siguiente número; el resto de la reserva se mantiene
+                ocupados = await _codigos_existentes(db, [v["codigo_retiro"] for v, g in zip(valores, generados) if g])
+                if not ocupados or intento == CODIGO_MAX_INTENTOS:
+                    raise HTTPException(status_code=409, detail=f"No se pudieron asignar códigos de retiro únicos: {e.orig}")
+                for v, generado in zip(valores, generados):
+                    if generado and v["codigo_retiro"].upper() in ocupados:
+                        v["codigo_retiro"] = (await db.run_sync(reserve_codigos_retiro, v["fecha_recepcion"]))[0]
+        codigos = [v["codigo_retiro"] for v in valores]
+
+        deltas = {}
+        for v in valores:
+            clave = daily_stat_key(v["fecha_recepcion"], v["sucursal"], v["tipo_documento"], v["estado"])
+            deltas[clave] = deltas.get(clave, 0) + 1
+        await db.run_sync(lambda sesion: adjust_daily_stats(sesion.connection(), deltas))
+
+        notificaciones = await db.run_sync(enqueue_grouped_notifications, list(zip(ids, codigos, paquetes)))
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
+        print(f"❌ Error en registro masivo: {e}")
+        raise HTTPException(status_code=500, detail=f"Error guardando en base de datos: {e}")
+
+    print(f"✅ Registro masivo: {len(ids)} paquetes, {notificaciones} notificaciones")
+    outbox_wakeup.set()
+    return {
+        "registrados": len(ids),
+        "notificaciones": notificaciones,
+        "paquetes": [{"id": f"{package_id}-{codigo}", "codigo": codigo} for package_id, codigo in zip(ids, codigos)],
+    }
+
+def _outbox_backoff(intentos: int) -> timedelta:
+    segundos = min(OUTBOX_BACKOFF_BASE * (2 ** max(intentos - 1, 0)), OUTBOX_BACKOFF_MAX)
+    return timedelta(seconds=segundos)
+
+def _deliver(mensaje: NotificationOutbox) -> bool:
+    if mensaje.canal == "Correo":
+        return send_email_graph(mensaje.destinatario, mensaje.asunto or "", mensaje.cuerpo)
+    if mensaje.canal == "Teams":
+        return notify_teams_webhook(mensaje.cuerpo)
+    raise ValueError(f"Canal desconocido: {mensaje.canal}")
+
+def _claim_outbox_message(db: Session, msg_id: int, proximo_intento: datetime) -> bool:
+    """
+    Reserva un mensaje para este worker con un UPDATE condicional, de modo que
+    varios workers de uvicorn puedan drenar la misma tabla sin duplicar envíos.
+    Si el worker muere, la reserva expira tras OUTBOX_LEASE_SECONDS.
+    """
+    claimed = db.query(NotificationOutbox).filter(
+        NotificationOutbox.id == msg_id,
+        NotificationOutbox.estado == "Pendiente",
+        NotificationOutbox.proximo_intento == proximo_intento,
+    ).update({
+        NotificationOutbox.proximo_intento: datetime.utcnow() + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+        NotificationOutbox.intentos: NotificationOutbox.intentos + 1,
+    }, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+def dispatch_outbox_batch() -> int:
+    """
+    Procesa un lote de mensajes vencidos del outbox.
+    Retorna la cantidad de mensajes procesados (enviados o fallidos).
+    """
+    db = SessionLocal()
+    procesados = 0
+    try:
+        due = db.query(NotificationOutbox.id, NotificationOutbox.proximo_intento).filter(
+            NotificationOutbox.estado == "Pendiente",
+            NotificationOutbox.proximo_intento <= datetime.utcnow(),
+        ).order_by(NotificationOutbox.proximo_intento, NotificationOutbox.id).limit(OUTBOX_BATCH_SIZE).all()
+        db.commit()
+
+        for msg_id, proximo_intento in due:
+            if _outbox_stop.is_set():
+                break
+            if not _claim_outbox_message(db, msg_id, proximo_intento):
+                continue  # Otro worker lo tomó
+
+            mensaje = db.get(NotificationOutbox, msg_id)
+            inicio = time.perf_counter()
+            try:
+                if mensaje.resumen_de:
+                    _componer_resumen(db, mensaje)
+                ok = _deliver(mensaje)
+                error = None if ok else "El servicio rechazó el envío"
+            except Exception as e:
+                ok = False
+                error = str(e)
+            duracion = time.perf_counter() - inicio
+
+            ahora = datetime.utcnow()
+            if ok:
+                mensaje.estado = "Enviado"
+                mensaje.enviado_en = ahora
+                mensaje.ultimo_error = None
+                ids = [int(x) for x in mensaje.package_ids.split(",") if x]
+                ultima_version = next_package_version(db, len(ids))
+                deltas = {}
+                for i, package_id in enumerate(ids):
+                    # UPDATE masivo (no pasa por el listener del ORM): el
+                    # RETURNING entrega la clave del rollup para ajustarlo aquí
+                    fila = db.execute(
+                        update(Package)
+                        .where(Package.id == package_id, Package.estado == "Pendiente")
+                        .values(
+                            estado="Notificado",
+                            fecha_notificacion=ahora,
+                            version=ultima_version - len(ids) + 1 + i,
+                            actualizado_en=ahora,
+                        )
+                        .returning(Package.fecha_recepcion, Package.sucursal, Package.tipo_documento)
+                        .execution_options(synchronize_session=False)
+                    ).first()
+                    if fila:
+                        for estado, n in (("Pendiente", -1), ("Notificado", 1)):
+                            clave = daily_stat_key(*fila, estado)
+                            deltas[clave] = deltas.get(clave, 0) + n
+                adjust_daily_stats(db.connection(), deltas)
+                outbox_stats.registrar_envio((ahora - mensaje.creado_en).total_seconds(), duracion)
+            else:
+                mensaje.ultimo_error = error
+                descartado = mensaje.intentos >= OUTBOX_MAX_INTENTOS
+                if descartado:
+                    mensaje.estado = "Descartado"
+                    print(f"❌ Outbox: mensaje {msg_id} descartado tras {mensaje.intentos} intentos: {error}")
+                else:
+                    mensaje.proximo_intento = ahora + _outbox_backoff(mensaje.intentos)
+                outbox_stats.registrar_fallo(descartado)
+            db.commit()
+            procesados += 1
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Outbox: error procesando lote: {e}")
+    finally:
+        db.close()
+    return procesados
+
+def _outbox_worker():
+    print("📬 Outbox dispatcher iniciado")
+    while not _outbox_stop.is_set():
+        procesados = dispatch_outbox_batch()
+        if procesados < OUTBOX_BATCH_SIZE:
+            # Cola vacía (o solo con mensajes en backoff): esperar al siguiente registro o al poll
+            outbox_wakeup.wait(OUTBOX_POLL_SECONDS)
+            outbox_wakeup.clear()
+
+@app.on_event("startup")
+def start_outbox_dispatcher():
+    global _outbox_thread
+    _outbox_stop.clear()
+    _outbox_thread = threading.Thread(target=_outbox_worker, name="outbox-dispatcher", daemon=True)
+    _outbox_thread.start()
+
+@app.on_event("startup")
+def start_token_refresh():
+    token_provider.start()
+
+@app.on_event("startup")
+def start_directory_sync():
+    if TENANT_ID and CLIENT_ID and CLIENT_SECRET:
+        directory_index.start()
+
+@app.on_event("shutdown")
+def stop_outbox_dispatcher():
+    _outbox_stop.set()
+    outbox_wakeup.set()
+    if _outbox_thread:
+        _outbox_thread.join(timeout=5)
+
+@app.on_event("shutdown")
+def stop_token_refresh():
+    token_provider.stop()
+
+@app.on_event("shutdown")
+def stop_directory_sync():
+    directory_index.stop()
+
+@app.on_event("shutdown")
+async def close_async_clients():
+    await graph_client.aclose()
+    await async_engine.dispose()
+
+@app.get("/metrics")
+def metrics(db: Session = Depends(get_db)):
+    """
+    Métricas operativas del backend: profundidad de la cola de notificaciones,
+    latencia de despacho, uso de la cache de tokens de Graph, estado del
+    índice local del directorio y del pool de conexiones a la base.
+    """
+    por_estado = dict(
+        db.query(NotificationOutbox.estado, func.count(NotificationOutbox.id))
+        .group_by(NotificationOutbox.estado).all()
+    )
+    mas_antiguo = db.query(func.min(NotificationOutbox.creado_en)).filter(
+        NotificationOutbox.estado == "Pendiente"
+    ).scalar()
+    en_resumen = db.query(func.count(NotificationOutbox.id)).filter(
+        NotificationOutbox.estado == "Pendiente",
+        NotificationOutbox.resumen_de.isnot(None),
+        NotificationOutbox.intentos == 0,
+    ).scalar()
+    return {
+        "outbox": {
+            "pendientes": por_estado.get("Pendiente", 0),
+            "en_resumen": en_resumen,
+            "enviados_total": por_estado.get("Enviado", 0),
+            "descartados_total": por_estado.get("Descartado", 0),
+            "antiguedad_pendiente_s": round((datetime.utcnow() - mas_antiguo).total_seconds(), 1) if mas_antiguo else 0,
+            "proceso": outbox_stats.snapshot(),
+        },
+        "token": token_provider.stats(),
+        "directorio": directory_index.stats(),
+        "recordatorios": reminder_scheduler.stats(),
+        "db_pool": db_pool_stats(),
+    }
 
 class ReminderRequest(BaseModel):
     email: EmailStr
     nombre: str
 
 def format_reminder_email_html(nombre: str) -> str:
-    return f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                line-height: 1.4;
-                color: #333;
-                max-width: 550px;
-                margin: 0 auto;
-            }}
-            .header {{
-                background: #e65100;
-                color: white;
-                padding: 15px;
-                text-align: center;
-            }}
-            .header h2 {{
-                margin: 0;
-                font-size: 18px;
-            }}
-            .content {{
-                padding: 20px;
-                background: #fff8e1;
-            }}
-            .reminder {{
-                background: #ffccbc;
-                border-left: 4px solid #d84315;
-                padding: 15px;
-                margin: 15px 0;
-                font-size: 14px;
-            }}
-            .reminder strong {{
-                color: #bf360c;
-                font-size: 16px;
-            }}
-            .footer {{
-                margin-top: 15px;
-                font-size: 13px;
-                color: #666;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h2>⏰ Recordatorio de Retiro</h2>
-        </div>
-
-        <div class="content">
-            <p>Estimado(a) <strong>{nombre}</strong>,</p>
-
-            <div class="reminder">
-                <strong>🚨 Recordatorio:</strong><br><br>
-                Tiene correspondencia pendiente de retiro en Recepción.<br><br>
-                Por favor, recuerde retirarla durante el horario de atención:<br>
-                • Lunes a Jueves: hasta 18:00 hrs<br>
-                • Viernes: hasta 17:00 hrs
-            </div>
-
-            <div class="footer">
-                <p>De antemano, muchas gracias.</p>
-                <p><strong>Rudth Nuñez</strong><br>
-                Recepcionista - Multiaceros S.A.<br>
-                📧 recepcion@multiaceros.cl</p>
-            </div>
-        </div>
-    </body>
-    </html>
+    return email_templates.renderizar_cacheado("recordatorio.html", nombre=nombre)
+
+# Campos que expone la API (PascalCase, compatibles con el frontend) -> columna
+PACKAGE_FIELDS = {
+    "Id": Package.id,
+    "FechaRecepcion": Package.fecha_recepcion,
+    "HoraRecepcion": Package.hora_recepcion,
+    "Sucursal": Package.sucursal,
+    "Recepcionista": Package.recepcionista,
+    "Proveedor": Package.proveedor,
+    "TipoDocumento": Package.tipo_documento,
+    "NumeroDocumento": Package.numero_documento,
+    "DestinatarioNombre": Package.destinatario_nombre,
+    "DestinatarioEmail": Package.destinatario_email,
+    "MedioNotificacion": Package.medio_notificacion,
+    "CodigoRetiro": Package.codigo_retiro,
+    "Estado": Package.estado,
+    "FechaNotificacion": Package.fecha_notificacion,
+    "DestinatarioConfirmo": Package.destinatario_confirmo,
+    "FechaRetiro": Package.fecha_retiro,
+    "EntregadoA": Package.entregado_a,
+    "Observaciones": Package.observaciones,
+    "AdjuntoUrl": Package.adjunto_url,
+    "MontoCheque": Package.monto_cheque,
+    "FechaVencimientoCheque": Package.fecha_vencimiento_cheque,
+}
+
+PACKAGES_MAX_LIMIT = 1000
+
+def formatear_monto(monto: Decimal) -> str:
+    """Decimal('500000.00') -> '$500.000' (formato chileno, decimales solo si existen)."""
+    entero, _, decimales = f"{monto:,.2f}".partition(".")
+    texto = "$" + entero.replace(",", ".")
+    return texto if decimales == "00" else f"{texto},{decimales}"
+
+def serializar_valor(valor):
+    """
+    Convierte los tipos de columna a los textos que el frontend ya conoce:
+    fechas 'YYYY-MM-DD', horas 'HH:MM:SS', fecha-hora 'YYYY-MM-DD HH:MM:SS'
+    y montos '$500.000'. NULL se entrega como "".
     """
+    if valor is None:
+        return ""
+    if isinstance(valor, datetime):
+        return valor.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, dtime):
+        return valor.strftime("%H:%M:%S")
+    if isinstance(valor, Decimal):
+        return formatear_monto(valor)
+    return valor
+
+def serializar_fila(nombres: List[str], valores) -> dict:
+    return {nombre: serializar_valor(v) for nombre, v in zip(nombres, valores)}
+
+class PackageFilters:
+    """
+    Filtros comunes de paquetes recibidos como query params.
+    apply() acepta tanto un Query del ORM como un select() (ambos tienen .filter).
+    Los parámetros de lista aceptan varios valores (?estado=Pendiente&estado=Notificado).
+    """
+
+    def __init__(
+        self,
+        fecha_desde: Optional[date] = None,
+        fecha_hasta: Optional[date] = None,
+        sucursal: Optional[List[str]] = Query(None),
+        estado: Optional[List[str]] = Query(None),
+        tipo_documento: Optional[List[str]] = Query(None),
+        destinatario: Optional[str] = None,
+    ):
+        self.fecha_desde = fecha_desde
+        self.fecha_hasta = fecha_hasta
+        self.sucursal = sucursal
+        self.estado = estado
+        self.tipo_documento = tipo_documento
+        self.destinatario = destinatario
+
+    def apply(self, query):
+        if self.fecha_desde:
+            query = query.filter(Package.fecha_recepcion >= self.fecha_desde)
+        if self.fecha_hasta:
+            query = query.filter(Package.fecha_recepcion <= self.fecha_hasta)
+        if self.sucursal:
+            query = query.filter(Package.sucursal.in_(self.sucursal))
+        if self.estado:
+            query = query.filter(Package.estado.in_(self.estado))
+        if self.tipo_documento:
+            query = query.filter(Package.tipo_documento.in_(self.tipo_documento))
+        if self.destinatario:
+            patron = f"%{self.destinatario}%"
+            query = query.filter(or_(
+                Package.destinatario_nombre.ilike(patron),
+                Package.destinatario_email.ilike(patron),
+            ))
+        return query
+
+    @property
+    def admite_rollup(self) -> bool:
+        """True si los filtros se pueden resolver sobre package_daily_stats."""
+        return not self.destinatario
+
+    def apply_rollup(self, query):
+        """Mismos filtros que apply() pero sobre el rollup diario."""
+        if self.fecha_desde:
+            query = query.filter(PackageDailyStat.fecha >= self.fecha_desde)
+        if self.fecha_hasta:
+            query = query.filter(PackageDailyStat.fecha <= self.fecha_hasta)
+        if self.sucursal:
+            query = query.filter(PackageDailyStat.sucursal.in_(self.sucursal))
+        if self.estado:
+            query = query.filter(PackageDailyStat.estado.in_(self.estado))
+        if self.tipo_documento:
+            query = query.filter(PackageDailyStat.tipo_documento.in_(self.tipo_documento))
+        return query
+
+def parse_package_fields(campos: Optional[str]) -> List[str]:
+    if not campos:
+        return list(PACKAGE_FIELDS)
+    seleccion = [c.strip() for c in campos.split(",") if c.strip()]
+    desconocidos = [c for c in seleccion if c not in PACKAGE_FIELDS]
+    if desconocidos:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos: {', '.join(desconocidos)}")
+    return seleccion
 
 @app.get("/packages")
-def get_packages(db: Session = Depends(get_db)):
+async def get_packages(
+    filtros: PackageFilters = Depends(),
+    campos: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PACKAGES_MAX_LIMIT),
+    cursor: Optional[int] = None,
+    orden: Literal["asc", "desc"] = "asc",
+    db: AsyncSession = Depends(get_async_db),
+):
     """
-    Endpoint para obtener todos los paquetes registrados de la base de datos PostgreSQL.
+    Endpoint para obtener los paquetes registrados de la base de datos PostgreSQL.
+
+    Sin parámetros retorna todos los paquetes (compatibilidad). Admite:
+    - filtros: fecha_desde, fecha_hasta (YYYY-MM-DD), sucursal, estado,
+      tipo_documento, destinatario (nombre o email parcial)
+    - campos: lista separada por coma de los campos a retornar (ej. "Id,CodigoRetiro,Estado")
+    - paginación por cursor: limit + cursor (el "next_cursor" de la página anterior)
+    - orden: "asc" o "desc" por orden de registro
     """
     try:
-        db_packages = db.query(Package).all()
+        nombres = parse_package_fields(campos)
+        columnas = [PACKAGE_FIELDS[n] for n in nombres]
+
+        query = filtros.apply(select(Package.id, *columnas))
+        if cursor is not None:
+            query = query.filter(Package.id > cursor if orden == "asc" else Package.id < cursor)
+        query = query.order_by(Package.id.asc() if orden == "asc" else Package.id.desc())
+        if limit:
+            query = query.limit(limit + 1)  # Uno extra para saber si hay otra página
+
+        rows = (await db.execute(query)).all()
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+
+        packages = [serializar_fila(nombres, row[1:]) for row in rows]
+        # serializar_fila ya deja tipos JSON nativos: JSONResponse evita pasar
+        # miles de valores por jsonable_encoder
+        return JSONResponse({"packages": packages, "next_cursor": next_cursor})
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error leyendo paquetes: {e}")
 
-        packages = []
-        for pkg in db_packages:
-            packages.append({
-                "FechaRecepcion": pkg.fecha_recepcion,
-                "HoraRecepcion": pkg.hora_recepcion,
-                "Sucursal": pkg.sucursal,
-                "Recepcionista": pkg.recepcionista,
-                "Proveedor": pkg.proveedor,
-                "TipoDocumento": pkg.tipo_documento,
-                "NumeroDocumento": pkg.numero_documento,
-                "DestinatarioNombre": pkg.destinatario_nombre,
-                "DestinatarioEmail": pkg.destinatario_email,
-                "MedioNotificacion": pkg.medio_notificacion,
-                "CodigoRetiro": pkg.codigo_retiro,
-                "Estado": pkg.estado,
-                "FechaNotificacion": pkg.fecha_notificacion,
-                "DestinatarioConfirmo": pkg.destinatario_confirmo,
-                "FechaRetiro": pkg.fecha_retiro,
-                "EntregadoA": pkg.entregado_a,
-                "Observaciones": pkg.observaciones,
-                "AdjuntoUrl": pkg.adjunto_url
-            })
+@app.get("/packages/changes")
+def get_package_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=PACKAGES_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    """
+    Sincronización incremental: retorna los paquetes creados o modificados
+    después del cursor `since` (0 = todos), ordenados por versión.
+    El cliente guarda el "cursor" recibido y lo envía en la próxima llamada;
+    si "has_more" es true debe volver a llamar de inmediato.
+    Si "reset" es true la base fue recreada y el cliente debe descartar su cache.
+    """
+    try:
+        version_actual = current_package_version(db)
+        if since > version_actual:
+            return {"packages": [], "cursor": 0, "has_more": False, "reset": True}
+
+        nombres = list(PACKAGE_FIELDS)
+        rows = (
+            db.query(Package.version, *PACKAGE_FIELDS.values())
+            .filter(Package.version > since)
+            .order_by(Package.version)
+            .limit(limit + 1)
+            .all()
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return JSONResponse({
+            "packages": [serializar_fila(nombres, row[1:]) for row in rows],
+            "cursor": rows[-1][0] if rows else since,
+            "has_more": has_more,
+            "reset": False,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error leyendo cambios de paquetes: {e}")
+
+def codigo_retiro_igual(codigo: str):
+    """Condición por código de retiro sin distinguir mayúsculas (usa ux_packages_codigo_retiro_upper)."""
+    return func.upper(Package.codigo_retiro) == codigo.strip().upper()
+
+# Debe declararse después de /packages/changes: de lo contrario "changes"
+# se tomaría como un código de retiro
+@app.get("/packages/{codigo_retiro}")
+async def get_package_by_code(codigo_retiro: str, db: AsyncSession = Depends(get_async_db)):
+    """Retorna un paquete por su código de retiro (sin distinguir mayúsculas)."""
+    nombres = list(PACKAGE_FIELDS)
+    row = (await db.execute(
+        select(*PACKAGE_FIELDS.values()).where(codigo_retiro_igual(codigo_retiro))
+    )).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Paquete con código {codigo_retiro} no encontrado")
+    return JSONResponse(serializar_fila(nombres, row))
+
+SEARCH_MAX_LIMIT = 200
+_busqueda_indexada: Optional[bool] = None
+
+async def busqueda_indexada(db: AsyncSession) -> bool:
+    """Si existen los índices de texto completo (se consulta una vez por proceso)."""
+    global _busqueda_indexada
+    if _busqueda_indexada is None:
+        detectar = search.DETECTAR_SQL.get(async_engine.dialect.name)
+        _busqueda_indexada = bool(detectar and (await db.execute(text(detectar))).scalar())
+    return _busqueda_indexada
+
+@app.get("/search")
+async def search_packages(
+    q: str = Query(..., min_length=1),
+    filtros: PackageFilters = Depends(),
+    campos: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Búsqueda de texto completo (código, destinatario, número de documento,
+    proveedor y observaciones) sin distinguir mayúsculas ni tildes. Cada
+    palabra se busca como prefijo. Retorna los `limit` paquetes más relevantes
+    (admite los mismos filtros y campos que /packages) y el total de coincidencias.
+    """
+    nombres = parse_package_fields(campos)
+    columnas = [PACKAGE_FIELDS[n] for n in nombres]
+    try:
+        sql = search.consulta(async_engine.dialect.name, await busqueda_indexada(db), q)
+        if sql is None:
+            return JSONResponse({"packages": [], "total": 0})
+        sentencia, params = sql
+        coincidencias = text(sentencia).bindparams(**params).columns(id=Integer, relevancia=Float).subquery("coincidencias")
+
+        total = (await db.execute(filtros.apply(
+            select(func.count()).select_from(Package).join(coincidencias, Package.id == coincidencias.c.id)
+        ))).scalar()
+        rows = (await db.execute(
+            filtros.apply(select(*columnas).join(coincidencias, Package.id == coincidencias.c.id))
+            .order_by(coincidencias.c.relevancia.desc(), Package.id.desc())
+            .limit(limit)
+        )).all()
+        return JSONResponse({"packages": [serializar_fila(nombres, row) for row in rows], "total": total})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en la búsqueda: {e}")
+
+STATS_TOP = 5
+
+class _FuenteStats:
+    """
+    Columnas y filtros para agregar: el rollup diario (O(días)) cuando los
+    filtros lo permiten, o la tabla packages (O(paquetes)) si se filtra por
+    destinatario.
+    """
+
+    def __init__(self, filtros: PackageFilters):
+        self.filtros = filtros
+        if filtros.admite_rollup:
+            t = PackageDailyStat
+            self.fecha, self.sucursal, self.tipo, self.estado = t.fecha, t.sucursal, t.tipo_documento, t.estado
+            self.cantidad = func.coalesce(func.sum(t.cantidad), 0)
+            self.aplicar = filtros.apply_rollup
+        else:
+            self.fecha, self.sucursal, self.tipo, self.estado = (
+                Package.fecha_recepcion, Package.sucursal, Package.tipo_documento, Package.estado
+            )
+            self.cantidad = func.count(Package.id)
+            self.aplicar = filtros.apply
+
+async def _conteo_por(db: AsyncSession, columna, cantidad, aplicar, limite: Optional[int] = None) -> list:
+    """[[valor, cantidad], ...] ordenado de mayor a menor cantidad."""
+    query = aplicar(select(columna, cantidad)).group_by(columna).order_by(cantidad.desc(), columna)
+    if limite:
+        query = query.limit(limite)
+    # El rollup puede conservar claves en 0 (p. ej. "Pendiente" tras retirar)
+    return [[serializar_valor(valor), int(n)] for valor, n in (await db.execute(query)).all() if n]
+
+@app.get("/stats")
+async def get_stats(filtros: PackageFilters = Depends(), db: AsyncSession = Depends(get_async_db)):
+    """
+    Agregados para la pestaña Reportes, calculados con GROUP BY en la base.
+    Acepta los mismos filtros que /packages (fecha_desde, fecha_hasta,
+    sucursal, estado, tipo_documento, destinatario).
 
-        return {"packages": packages}
+    Los conteos salen del rollup diario package_daily_stats (salvo que se
+    filtre por destinatario); los top de destinatarios/proveedores siempre
+    se calculan sobre packages.
+
+    Las series vienen como listas [valor, cantidad]; "sucursales" lista todas
+    las sucursales existentes (sin filtrar) para armar el selector.
+    """
+    try:
+        fuente = _FuenteStats(filtros)
+        por_estado = await _conteo_por(db, fuente.estado, fuente.cantidad, fuente.aplicar)
+        total = sum(n for _, n in por_estado)
+        retirados = sum(n for estado, n in por_estado if estado == "Retirado")
+
+        por_dia = (await db.execute(
+            fuente.aplicar(select(fuente.fecha, fuente.cantidad))
+            .group_by(fuente.fecha).order_by(fuente.fecha)
+        )).all()
+        sucursales = (await db.execute(
+            select(PackageDailyStat.sucursal).where(PackageDailyStat.cantidad > 0)
+            .distinct().order_by(PackageDailyStat.sucursal)
+        )).scalars().all()
+
+        conteo_packages = func.count(Package.id)
+        return {
+            "total": total,
+            "pendientes": total - retirados,
+            "retirados": retirados,
+            "por_dia": [[serializar_valor(dia), int(n)] for dia, n in por_dia if n],
+            "por_sucursal": await _conteo_por(db, fuente.sucursal, fuente.cantidad, fuente.aplicar),
+            "por_tipo": await _conteo_por(db, fuente.tipo, fuente.cantidad, fuente.aplicar),
+            "por_estado": por_estado,
+            "top_destinatarios": await _conteo_por(db, Package.destinatario_nombre, conteo_packages, filtros.apply, STATS_TOP),
+            "top_proveedores": await _conteo_por(db, Package.proveedor, conteo_packages, filtros.apply, STATS_TOP),
+            "sucursales": sucursales,
+        }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error leyendo paquetes: {e}")
+        raise HTTPException(status_code=500, detail=f"Error calculando estadísticas: {e}")
+
+@app.get("/export")
+def export_packages(
+    formato: Literal["csv", "xlsx", "parquet"] = "csv",
+    filtros: PackageFilters = Depends(),
+    campos: Optional[str] = None,
+):
+    """
+    Descarga los paquetes filtrados (mismos filtros y campos que /packages)
+    como CSV, XLSX o Parquet. Se lee con un cursor del lado del servidor y se
+    envía en streaming, así que la memoria no crece con la cantidad de filas.
+    Usa la sesión sync: el armado de XLSX/Parquet es trabajo de CPU que
+    StreamingResponse corre en el threadpool.
+    """
+    nombres = parse_package_fields(campos)
+    columnas = [PACKAGE_FIELDS[n] for n in nombres]
+    query = filtros.apply(select(*columnas)).order_by(Package.id)
+
+    try:
+        # La sesión se abre dentro del generador: la de Depends(get_db) se
+        # cerraría antes de terminar de enviar la respuesta
+        lotes = exporter.leer_en_lotes(SessionLocal, query)
+        contenido = exporter.ESCRITORES[formato](lotes, nombres, columnas, serializar_valor)
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=f"Formato {formato} no disponible: {e}")
+
+    media_type, extension = exporter.FORMATOS[formato]
+    desde = filtros.fecha_desde.isoformat() if filtros.fecha_desde else "inicio"
+    hasta = filtros.fecha_hasta.isoformat() if filtros.fecha_hasta else date.today().isoformat()
+    return StreamingResponse(
+        contenido,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="paquetes_{desde}_{hasta}.{extension}"'},
+    )
 
 @app.post("/send-reminder")
-def send_reminder(req: ReminderRequest):
+async def send_reminder(req: ReminderRequest):
     """
     Endpoint para enviar recordatorio de retiro a un usuario.
     Puede ser llamado por el chatbot cuando el usuario lo solicita.
     """
     try:
-        ok_mail = send_email_graph(
+        ok_mail = await send_email_graph_async(
             req.email,
             f"⏰ Recordatorio: Correspondencia pendiente - {req.nombre}",
             format_reminder_email_html(req.nombre),
@@ -477,12 +1393,170 @@ def send_reminder(req: ReminderRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error enviando recordatorio: {e}")
 
+# ==== Envío masivo con JSON batching de Graph ====
+
+GRAPH_BATCH_PARALLELISM = int(os.getenv("GRAPH_BATCH_PARALLELISM", "4"))
+GRAPH_BATCH_MAX_RETRIES = int(os.getenv("GRAPH_BATCH_MAX_RETRIES", "3"))
+GRAPH_BATCH_RETRY_STATUS = (429, 503, 504)
+
+def _batch_retry_after(resp: dict, intento: int) -> float:
+    """Segundos a esperar según el Retry-After de una sub-respuesta; si no viene en segundos (p. ej. una fecha HTTP), backoff exponencial."""
+    valor = str((resp.get("headers") or {}).get("Retry-After") or "")
+    if valor.isdigit():
+        return float(valor)
+    return 2 ** intento
+
+def _send_batch_chunk(chunk: list, token: str, resultados: list):
+    """
+    Envía un bloque de hasta 20 correos en un solo $batch. Las sub-requests
+    con throttling (429/503/504) se reintentan respetando su Retry-After.
+    `chunk` es una lista de (índice, email, asunto, html); los resultados se
+    escriben en `resultados[índice]`.
+    """
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    pendientes = {str(idx): (idx, email, asunto, html) for idx, email, asunto, html in chunk}
+
+    for intento in range(GRAPH_BATCH_MAX_RETRIES + 1):
+        sub_requests = [
+            {
+                "id": req_id,
+                "method": "POST",
+                "url": f"/users/{GRAPH_SENDER_UPN}/sendMail",
+                "headers": {"Content-Type": "application/json"},
+                "body": sendmail_payload(email, asunto, html),
+            }
+            for req_id, (idx, email, asunto, html) in pendientes.items()
+        ]
+        try:
+            respuestas = graph_client.batch(sub_requests, headers=headers, timeout=60)
+        except Exception as e:
+            for idx, email, _, _ in pendientes.values():
+                resultados[idx] = {"email": email, "success": False, "status": None, "error": str(e)}
+            return
+
+        reintentar = {}
+        espera = 0.0
+        for req_id, (idx, email, asunto, html) in pendientes.items():
+            resp = respuestas.get(req_id, {})
+            status = resp.get("status")
+            if status in (200, 202):
+                resultados[idx] = {"email": email, "success": True, "status": status, "error": None}
+            elif status in GRAPH_BATCH_RETRY_STATUS and intento < GRAPH_BATCH_MAX_RETRIES:
+                reintentar[req_id] = (idx, email, asunto, html)
+                espera = max(espera, _batch_retry_after(resp, intento))
+            else:
+                error = ((resp.get("body") or {}).get("error") or {}).get("message", "Sin respuesta de Graph")
+                resultados[idx] = {"email": email, "success": False, "status": status, "error": error}
+
+        if not reintentar:
+            return
+        pendientes = reintentar
+        time.sleep(espera)
+
+def send_emails_batch(mensajes: List[tuple]) -> List[dict]:
+    """
+    Envía muchos correos usando $batch (20 por request) con paralelismo acotado.
+    `mensajes` es una lista de (email, asunto, html). Retorna un resultado por
+    mensaje, en el mismo orden.
+    """
+    token = msal_acquire_token()
+    if not token:
+        return [
+            {"email": email, "success": False, "status": None, "error": "No se pudo obtener token de Microsoft Graph"}
+            for email, _, _ in mensajes
+        ]
+
+    indexados = [(i, email, asunto, html) for i, (email, asunto, html) in enumerate(mensajes)]
+    chunks = [
+        indexados[i:i + graph_client.GRAPH_BATCH_LIMIT]
+        for i in range(0, len(indexados), graph_client.GRAPH_BATCH_LIMIT)
+    ]
+    resultados: List[Optional[dict]] = [None] * len(mensajes)
+
+    def enviar_chunk(chunk):
+        # Un error inesperado en un bloque no debe cortar el envío de los
+        # demás: sus correos sin resultado quedan como fallidos
+        try:
+            _send_batch_chunk(chunk, token, resultados)
+        except Exception as e:
+            print(f"❌ Error enviando bloque de correos: {e}")
+            for idx, email, _, _ in chunk:
+                if resultados[idx] is None:
+                    resultados[idx] = {"email": email, "success": False, "status": None, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(GRAPH_BATCH_PARALLELISM, len(chunks)))) as pool:
+        list(pool.map(enviar_chunk, chunks))
+    return resultados
+
+class BulkReminderRequest(BaseModel):
+    recipientes: List[ReminderRequest] = Field(..., min_length=1)
+
+@app.post("/send-reminders/bulk")
+def send_reminders_bulk(req: BulkReminderRequest):
+    """
+    Envía recordatorios de retiro a muchos destinatarios en pocas llamadas a
+    Graph ($batch de 20 correos). Retorna el estado por destinatario.
+    """
+    # Un solo correo por dirección, aunque venga repetida
+    unicos = {}
+    for r in req.recipientes:
+        unicos.setdefault(r.email.lower(), r)
+
+    mensajes = [
+        (r.email, f"⏰ Recordatorio: Correspondencia pendiente - {r.nombre}", format_reminder_email_html(r.nombre))
+        for r in unicos.values()
+    ]
+    try:
+        resultados = send_emails_batch(mensajes)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error enviando recordatorios: {e}")
+
+    for resultado, r in zip(resultados, unicos.values()):
+        resultado["nombre"] = r.nombre
+    enviados = sum(1 for r in resultados if r["success"])
+    return {
+        "success": enviados == len(resultados),
+        "enviados": enviados,
+        "fallidos": len(resultados) - enviados,
+        "resultados": resultados,
+    }
+
+# ==== Recordatorios automáticos ====
+# Ver reminders.py: recordatorio diario a quienes tienen paquetes sin retirar
+# hace más de REMINDER_MIN_DAYS días, dentro del horario de retiro.
+
+reminder_scheduler = reminders.ReminderScheduler(
+    SessionLocal, send_emails_batch, tz=reminders.zona_horaria(reminders.REMINDER_TZ)
+)
+
+@app.on_event("startup")
+def start_reminder_scheduler():
+    if TENANT_ID and CLIENT_ID and CLIENT_SECRET:
+        reminder_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_reminder_scheduler():
+    reminder_scheduler.stop()
+
+@app.get("/reminders")
+def reminders_status(db: Session = Depends(get_db)):
+    """
+    Estado del scheduler de recordatorios y paquetes vencidos (sin retirar
+    hace más de REMINDER_MIN_DAYS días), para las alertas del Dashboard.
+    """
+    return {**reminder_scheduler.stats(), "vencidos": reminder_scheduler.vencidos(db)}
+
+@app.post("/reminders/run")
+def reminders_run():
+    """Ejecuta ahora los recordatorios automáticos (respeta el horario de retiro y las repeticiones)."""
+    return reminder_scheduler.ejecutar()
+
 class WithdrawRequest(BaseModel):
     codigo_retiro: str
     entregado_a: str
 
 @app.post("/withdraw")
-def withdraw_package(req: WithdrawRequest, db: Session = Depends(get_db)):
+async def withdraw_package(req: WithdrawRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Endpoint para marcar un paquete como retirado.
     Actualiza el estado a "Retirado" y registra quién lo retiró y cuándo.
@@ -491,7 +1565,9 @@ def withdraw_package(req: WithdrawRequest, db: Session = Depends(get_db)):
 
     try:
         # Buscar el paquete por código de retiro
-        package = db.query(Package).filter(Package.codigo_retiro == req.codigo_retiro).first()
+        package = (await db.execute(
+            select(Package).where(codigo_retiro_igual(req.codigo_retiro))
+        )).scalar_one_or_none()
 
         if not package:
             raise HTTPException(status_code=404, detail=f"Paquete con código {req.codigo_retiro} no encontrado")
@@ -500,16 +1576,15 @@ def withdraw_package(req: WithdrawRequest, db: Session = Depends(get_db)):
         if package.estado == "Retirado":
             return {
                 "success": False,
-                "message": f"El paquete ya fue retirado el {package.fecha_retiro} por {package.entregado_a}"
+                "message": f"El paquete ya fue retirado el {serializar_valor(package.fecha_retiro)} por {package.entregado_a}"
             }
 
         # Actualizar el paquete
         package.estado = "Retirado"
-        package.fecha_retiro = dt.now().strftime("%Y-%m-%d %H:%M:%S")
+        package.fecha_retiro = dt.now().replace(microsecond=0)
         package.entregado_a = req.entregado_a
 
-        db.commit()
-        db.refresh(package)
+        await db.commit()
 
         print(f"✅ Package withdrawn: Code={req.codigo_retiro}, By={req.entregado_a}")
 
@@ -519,7 +1594,7 @@ def withdraw_package(req: WithdrawRequest, db: Session = Depends(get_db)):
             "package": {
                 "codigo": package.codigo_retiro,
                 "destinatario": package.destinatario_nombre,
-                "fecha_retiro": package.fecha_retiro,
+                "fecha_retiro": serializar_valor(package.fecha_retiro),
                 "entregado_a": package.entregado_a,
                 "estado": package.estado
             }
@@ -528,14 +1603,16 @@ def withdraw_package(req: WithdrawRequest, db: Session = Depends(get_db)):
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         print(f"❌ Error withdrawing package: {e}")
         raise HTTPException(status_code=500, detail=f"Error marcando paquete como retirado: {e}")
 
 @app.get("/search-users")
-def search_users(query: str):
+async def search_users(query: str):
     """
-    Busca usuarios y grupos de distribución en Azure AD / Microsoft 365 usando Microsoft Graph API.
+    Busca usuarios y grupos de distribución en Azure AD / Microsoft 365.
+    Responde desde el índice local del directorio (sincronizado en segundo
+    plano con consultas delta de Graph), sin llamar a Graph en cada tecla.
     Retorna una lista de usuarios/grupos con displayName y email.
 
     Args:
@@ -544,131 +1621,18 @@ def search_users(query: str):
     Returns:
         Lista de usuarios/grupos: [{"displayName": "Juan Pérez", "email": "jperez@empresa.cl", "type": "user"},
                                     {"displayName": "Cobranzas", "email": "cobranzas@empresa.cl", "type": "group"}, ...]
+        y "completo": true si no se recortó ninguna coincidencia (el
+        autocompletado del Dashboard filtra localmente las búsquedas más largas).
     """
     if not query or len(query) < 2:
-        return {"users": []}
+        return {"users": [], "completo": False}
 
     try:
-        token = msal_acquire_token()
-        if not token:
-            raise HTTPException(status_code=500, detail="No se pudo obtener token de Microsoft Graph")
-
-        # Buscar usuarios con Graph API
-        # Obtener TODOS los usuarios y filtrar localmente (más flexible que startswith)
-        url = "https://graph.microsoft.com/v1.0/users"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "ConsistencyLevel": "eventual"
-        }
-
-        # Obtener todos los usuarios (o usar $top para limitar)
-        params = {
-            "$select": "displayName,mail,userPrincipalName",
-            "$top": "999"  # Obtener hasta 999 usuarios
-        }
-
-        # Buscar usuarios
-        response_users = requests.get(url, headers=headers, params=params, timeout=10)
-
-        results = []
-        query_lower = query.lower()
-
-        # Procesar usuarios con filtrado local
-        if response_users.status_code == 200:
-            data = response_users.json()
-
-            for user in data.get("value", []):
-                display_name = user.get("displayName", "")
-                email = user.get("mail") or user.get("userPrincipalName", "")
-
-                # Filtrar localmente: buscar query en displayName o email (case-insensitive, contains)
-                if email and display_name:
-                    if (query_lower in display_name.lower() or
-                        query_lower in email.lower()):
-                        results.append({
-                            "displayName": display_name,
-                            "email": email,
-                            "type": "user"
-                        })
-
-        # Buscar grupos de distribución
-        # Obtenemos TODOS los grupos con email y filtramos localmente
-        groups_url = "https://graph.microsoft.com/v1.0/groups"
-        groups_params = {
-            "$filter": "mailEnabled eq true",
-            "$select": "displayName,mail,mailEnabled,securityEnabled",
-            "$top": "999"
-        }
-
-        try:
-            response_groups = requests.get(groups_url, headers=headers, params=groups_params, timeout=10)
-
-            # Procesar grupos
-            if response_groups.status_code == 200:
-                groups_data = response_groups.json()
-                query_lower = query.lower()
-
-                for group in groups_data.get("value", []):
-                    display_name = group.get("displayName", "")
-                    email = group.get("mail", "")
-                    mail_enabled = group.get("mailEnabled", False)
-
-                    # Filtrar localmente: buscar query en el nombre o email (case-insensitive y con contains)
-                    if email and display_name and mail_enabled:
-                        if query_lower in display_name.lower() or query_lower in email.lower():
-                            results.append({
-                                "displayName": f"📧 {display_name} (Grupo)",
-                                "email": email,
-                                "type": "group"
-                            })
-            else:
-                # Si falla la búsqueda de grupos, registrar error pero continuar
-                print(f"Error al buscar grupos: {response_groups.status_code} - {response_groups.text}")
-        except Exception as e:
-            # Si hay error en búsqueda de grupos, solo registrar pero no fallar
-            print(f"Excepción al buscar grupos: {str(e)}")
-
-        # Limitar resultados a máximo 15 (10 usuarios + 5 grupos máximo)
-        if results:
-            # Separar usuarios y grupos
-            usuarios = [r for r in results if r.get("type") == "user"]
-            grupos = [r for r in results if r.get("type") == "group"]
-
-            # Limitar a 10 usuarios y 5 grupos
-            resultados_finales = usuarios[:10] + grupos[:5]
-
-            return {"users": resultados_finales}
-        else:
-            # Si $filter falla, intentar con $search (requiere permisos adicionales)
-            params_search = {
-                "$search": f'"displayName:{query}" OR "mail:{query}"',
-                "$select": "displayName,mail,userPrincipalName",
-                "$top": "10"
-            }
-
-            response_search = requests.get(url, headers=headers, params=params_search, timeout=10)
-
-            if response_search.status_code == 200:
-                data = response_search.json()
-                users = []
-
-                for user in data.get("value", []):
-                    display_name = user.get("displayName", "")
-                    email = user.get("mail") or user.get("userPrincipalName", "")
-
-                    if email and display_name:
-                        users.append({
-                            "displayName": display_name,
-                            "email": email
-                        })
-
-                return {"users": users}
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Error de Microsoft Graph: {response.text}"
-                )
-
+        if not directory_index.ready:
+            # Primera búsqueda antes de que termine la sincronización inicial
+            await run_in_threadpool(directory_index.sync)
+        usuarios, completo = directory_index.search_results(query)
+        return {"users": usuarios, "completo": completo}
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
@@ -697,7 +1661,7 @@ def debug_groups():
             "$filter": "mailEnabled eq true"
         }
 
-        response = requests.get(url, headers=headers, params=params, timeout=10)
+        response = graph_client.get(url, headers=headers, params=params, timeout=10)
 
         if response.status_code == 200:
             data = response.json()
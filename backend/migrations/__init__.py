@@ -0,0 +1,102 @@
+"""
+Migraciones versionadas del esquema (estilo Alembic, sin dependencias extra).
+
+Cada módulo mNNNN_*.py de este paquete define:
+    revision       -> identificador de la migración
+    down_revision  -> revisión anterior (None para la primera)
+    upgrade(conn)  -> aplica el cambio usando una conexión en transacción
+
+La revisión aplicada se guarda en la tabla schema_version. Una base nueva se
+crea directamente con el esquema actual (create_all) y se marca en la última
+revisión; una base creada antes de este sistema se trata como revisión None y
+recibe todas las migraciones en orden.
+
+Uso manual (desde backend/):
+    python -m migrations            # aplica las migraciones pendientes
+    python -m migrations current    # muestra la revisión actual
+"""
+import importlib
+import pkgutil
+from typing import List, Optional
+
+from sqlalchemy import Column, MetaData, String, Table, inspect, select, text
+
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    _metadata,
+    Column("revision", String, primary_key=True),
+)
+
+# Clave arbitraria para pg_advisory_lock: evita que dos workers migren a la vez
+_PG_LOCK_KEY = 74210301
+
+def load_migrations() -> List:
+    """Retorna los módulos de migración ordenados según down_revision."""
+    modulos = {}
+    for info in pkgutil.iter_modules(__path__):
+        if info.name.startswith("m") and info.name[1:5].isdigit():
+            modulo = importlib.import_module(f"{__name__}.{info.name}")
+            modulos[modulo.revision] = modulo
+
+    ordenadas = []
+    anterior = None
+    siguientes = {m.down_revision: m for m in modulos.values()}
+    while anterior in siguientes:
+        modulo = siguientes[anterior]
+        ordenadas.append(modulo)
+        anterior = modulo.revision
+    if len(ordenadas) != len(modulos):
+        raise RuntimeError("Cadena de migraciones inconsistente (revisiones huérfanas o duplicadas)")
+    return ordenadas
+
+def head_revision() -> Optional[str]:
+    migraciones = load_migrations()
+    return migraciones[-1].revision if migraciones else None
+
+def current_revision(conn) -> Optional[str]:
+    if not inspect(conn).has_table("schema_version"):
+        return None
+    return conn.execute(select(schema_version.c.revision)).scalar()
+
+def _stamp(conn, revision: str):
+    conn.execute(schema_version.delete())
+    conn.execute(schema_version.insert().values(revision=revision))
+
+def upgrade(engine, metadata):
+    """
+    Deja la base en la última revisión.
+    `metadata` es el MetaData de los modelos (para crear tablas nuevas).
+    """
+    with engine.connect() as lock_conn:
+        if engine.dialect.name == "postgresql":
+            lock_conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _PG_LOCK_KEY})
+        try:
+            _upgrade(engine, metadata)
+        finally:
+            if engine.dialect.name == "postgresql":
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _PG_LOCK_KEY})
+
+def _upgrade(engine, metadata):
+    migraciones = load_migrations()
+    with engine.begin() as conn:
+        base_existente = inspect(conn).has_table("packages")
+        # Crea solo las tablas que faltan; nunca altera tablas existentes
+        metadata.create_all(bind=conn)
+        _metadata.create_all(bind=conn)
+        actual = current_revision(conn)
+        if not base_existente and actual is None and migraciones:
+            _stamp(conn, migraciones[-1].revision)
+            print(f"🗄️  Base de datos nueva creada en la revisión {migraciones[-1].revision}")
+            return
+
+    revisiones = [m.revision for m in migraciones]
+    inicio = revisiones.index(actual) + 1 if actual in revisiones else 0
+    if actual is not None and actual not in revisiones:
+        raise RuntimeError(f"La base está en una revisión desconocida: {actual}")
+
+    for modulo in migraciones[inicio:]:
+        print(f"🗄️  Aplicando migración {modulo.revision}: {(modulo.__doc__ or '').strip().splitlines()[0]}")
+        with engine.begin() as conn:
+            modulo.upgrade(conn)
+            _stamp(conn, modulo.revision)
@@ -0,0 +1,20 @@
+import os
+import sys
+
+os.environ["AUTO_MIGRATE"] = "0"  # la migración la ejecuta este comando
+
+from database import Base, engine, ensure_sync_counter
+from migrations import current_revision, head_revision, upgrade
+
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if comando == "current":
+        with engine.connect() as conn:
+            print(f"Revisión actual: {current_revision(conn)} (última: {head_revision()})")
+    elif comando == "upgrade":
+        upgrade(engine, Base.metadata)
+        ensure_sync_counter()
+        print(f"✅ Base de datos en la revisión {head_revision()}")
+    else:
+        print("Uso: python -m migrations [upgrade|current]")
+        sys.exit(1)
@@ -0,0 +1,139 @@
+"""
+Conversión de las columnas de fecha/hora/monto guardadas como texto a tipos
+reales (usado por la migración 0002).
+
+Antes de migrar producción se puede revisar qué valores no se podrán convertir
+(quedarían en NULL) con:
+    python -m migrations.backfill --dry-run
+"""
+import os
+import re
+import sys
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
+from sqlalchemy import Date, DateTime, Numeric, Time, bindparam, column, table, text
+
+BATCH_SIZE = 1000
+
+def parse_fecha(valor: Optional[str]) -> Optional[date]:
+    """'2025-12-01', '2025-12-01 10:00:00' o '01/12/2025' -> date."""
+    if not valor or not str(valor).strip():
+        return None
+    valor = str(valor).strip()
+    for formato, largo in (("%Y-%m-%d", 10), ("%d/%m/%Y", 10), ("%d-%m-%Y", 10)):
+        try:
+            return datetime.strptime(valor[:largo], formato).date()
+        except ValueError:
+            continue
+    return None
+
+def parse_hora(valor: Optional[str]) -> Optional[time]:
+    if not valor or not str(valor).strip():
+        return None
+    valor = str(valor).strip()
+    for formato in ("%H:%M:%S", "%H:%M"):
+        try:
+            return datetime.strptime(valor.split(".")[0], formato).time()
+        except ValueError:
+            continue
+    return None
+
+def parse_fecha_hora(valor: Optional[str]) -> Optional[datetime]:
+    if not valor or not str(valor).strip():
+        return None
+    valor = str(valor).strip().replace("T", " ").split(".")[0]
+    for formato in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(valor, formato)
+        except ValueError:
+            continue
+    return None
+
+def parse_monto(valor: Optional[str]) -> Optional[Decimal]:
+    """
+    Interpreta montos escritos a mano: '$500.000', '1.234.567', '1.500,50',
+    '500000', 'CLP 1,500,000'. El punto se asume separador de miles (formato
+    chileno) salvo que sea el último separador seguido de 1-2 dígitos.
+    """
+    if valor is None:
+        return None
+    limpio = re.sub(r"[^\d.,-]", "", str(valor))
+    if not re.search(r"\d", limpio):
+        return None
+
+    ultimo_sep = max(limpio.rfind("."), limpio.rfind(","))
+    if ultimo_sep >= 0:
+        decimales = limpio[ultimo_sep + 1:]
+        if 1 <= len(decimales) <= 2 and decimales.isdigit():
+            entero = re.sub(r"[.,]", "", limpio[:ultimo_sep])
+            limpio = f"{entero}.{decimales}"
+        else:
+            limpio = re.sub(r"[.,]", "", limpio)
+    try:
+        return Decimal(limpio).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+
+# columna -> (tipo SQLAlchemy, parser)
+TYPED_COLUMNS = {
+    "fecha_recepcion": (Date(), parse_fecha),
+    "hora_recepcion": (Time(), parse_hora),
+    "fecha_notificacion": (DateTime(), parse_fecha_hora),
+    "fecha_retiro": (DateTime(), parse_fecha_hora),
+    "fecha_vencimiento_cheque": (Date(), parse_fecha),
+    "monto_cheque": (Numeric(14, 2), parse_monto),
+}
+
+def backfill_column(conn, origen: str, destino: str, tipo, parser) -> int:
+    """
+    Copia `origen` (texto) a `destino` (tipado) en lotes por id.
+    Retorna la cantidad de valores no vacíos que no se pudieron convertir.
+    """
+    destino_t = table("packages", column("id"), column(destino, tipo))
+    update = (
+        destino_t.update()
+        .where(destino_t.c.id == bindparam("_id"))
+        .values({destino: bindparam("_valor", type_=tipo)})
+    )
+    fallidos = 0
+    ultimo_id = 0
+    while True:
+        filas = conn.execute(
+            text(f"SELECT id, {origen} FROM packages WHERE id > :ultimo ORDER BY id LIMIT :lote"),
+            {"ultimo": ultimo_id, "lote": BATCH_SIZE},
+        ).all()
+        if not filas:
+            break
+        valores = []
+        for id_, crudo in filas:
+            convertido = parser(crudo)
+            if convertido is None and crudo not in (None, ""):
+                fallidos += 1
+                print(f"⚠️  packages.id={id_}: no se pudo convertir {origen}={crudo!r}, queda NULL")
+            valores.append({"_id": id_, "_valor": convertido})
+        conn.execute(update, valores)
+        ultimo_id = filas[-1][0]
+    return fallidos
+
+def report(conn) -> int:
+    """Cuenta los valores que la migración no podría convertir (sin modificar nada)."""
+    total = 0
+    for nombre, (_, parser) in TYPED_COLUMNS.items():
+        for id_, crudo in conn.execute(text(f"SELECT id, {nombre} FROM packages ORDER BY id")):
+            if crudo not in (None, "") and isinstance(crudo, str) and parser(crudo) is None:
+                total += 1
+                print(f"packages.id={id_}: {nombre}={crudo!r} no es convertible")
+    return total
+
+if __name__ == "__main__":
+    if "--dry-run" not in sys.argv:
+        print("La conversión se ejecuta con las migraciones (python -m migrations).")
+        print("Use --dry-run para listar los valores que no se podrán convertir.")
+        sys.exit(1)
+    os.environ["AUTO_MIGRATE"] = "0"  # solo lectura: no migrar al importar database
+    from database import engine
+    with engine.connect() as conn:
+        n = report(conn)
+    print(f"{n} valor(es) no convertibles")
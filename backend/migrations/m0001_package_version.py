@@ -0,0 +1,27 @@
+"""Columnas version/actualizado_en para la sincronización incremental.
+
+Las bases creadas antes del versionado no las tienen (create_all no altera
+tablas existentes). Las filas antiguas se numeran por id para que
+/packages/changes las entregue en la carga inicial.
+"""
+from sqlalchemy import inspect, text
+
+revision = "0001"
+down_revision = None
+
+def upgrade(conn):
+    columnas = {c["name"] for c in inspect(conn).get_columns("packages")}
+    if "version" not in columnas:
+        conn.execute(text("ALTER TABLE packages ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text("UPDATE packages SET version = id"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_packages_version ON packages (version)"))
+    if "actualizado_en" not in columnas:
+        conn.execute(text("ALTER TABLE packages ADD COLUMN actualizado_en TIMESTAMP"))
+
+    existe = conn.execute(text("SELECT valor FROM sync_counters WHERE nombre = 'packages'")).first()
+    if existe is None:
+        maximo = conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM packages")).scalar()
+        conn.execute(
+            text("INSERT INTO sync_counters (nombre, valor) VALUES ('packages', :valor)"),
+            {"valor": maximo},
+        )
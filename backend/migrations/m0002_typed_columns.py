@@ -0,0 +1,36 @@
+"""Fechas, horas y montos de packages pasan de texto a Date/Time/DateTime/Numeric.
+
+Cada columna se copia a una columna nueva del tipo correcto (convertida en
+lotes con migrations.backfill), se elimina la original y se renombra la nueva.
+Los valores que no se pueden interpretar quedan en NULL y se informan por
+consola; use `python -m migrations.backfill --dry-run` para revisarlos antes.
+"""
+from sqlalchemy import String, inspect, text
+
+from migrations.backfill import TYPED_COLUMNS, backfill_column
+
+revision = "0002"
+down_revision = "0001"
+
+# Columnas que el modelo declara NOT NULL (solo se aplica en PostgreSQL;
+# SQLite no permite cambiar la nulabilidad con ALTER TABLE)
+NOT_NULL = ("fecha_recepcion", "hora_recepcion")
+
+def upgrade(conn):
+    columnas = {c["name"]: c for c in inspect(conn).get_columns("packages")}
+    for nombre, (tipo, parser) in TYPED_COLUMNS.items():
+        if not isinstance(columnas[nombre]["type"], String):
+            continue  # ya convertida
+        ddl = tipo.compile(dialect=conn.dialect)
+        temporal = f"{nombre}_tipado"
+        if temporal not in columnas:
+            conn.execute(text(f"ALTER TABLE packages ADD COLUMN {temporal} {ddl}"))
+        fallidos = backfill_column(conn, nombre, temporal, tipo, parser)
+        conn.execute(text(f"ALTER TABLE packages DROP COLUMN {nombre}"))
+        conn.execute(text(f"ALTER TABLE packages RENAME COLUMN {temporal} TO {nombre}"))
+        print(f"   {nombre} -> {ddl}" + (f" ({fallidos} valor(es) en NULL)" if fallidos else ""))
+
+        if nombre in NOT_NULL and conn.dialect.name == "postgresql":
+            nulos = conn.execute(text(f"SELECT COUNT(*) FROM packages WHERE {nombre} IS NULL")).scalar()
+            if nulos == 0:
+                conn.execute(text(f"ALTER TABLE packages ALTER COLUMN {nombre} SET NOT NULL"))
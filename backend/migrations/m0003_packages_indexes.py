@@ -0,0 +1,22 @@
+"""Índices para reportes, alertas de urgencia y búsquedas por destinatario/documento.
+
+Deben coincidir con Package.__table_args__ (las bases nuevas los reciben
+directamente desde create_all).
+"""
+from sqlalchemy import text
+
+revision = "0003"
+down_revision = "0002"
+
+INDICES = {
+    "ix_packages_estado_fecha": "estado, fecha_recepcion",
+    "ix_packages_sucursal_fecha": "sucursal, fecha_recepcion",
+    "ix_packages_destinatario_email": "destinatario_email",
+    "ix_packages_numero_documento": "numero_documento",
+}
+
+def upgrade(conn):
+    for nombre, columnas in INDICES.items():
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nombre} ON packages ({columnas})"))
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ANALYZE packages"))
@@ -0,0 +1,22 @@
+"""Carga inicial del rollup diario package_daily_stats.
+
+La tabla la crea create_all antes de correr las migraciones; aquí solo se
+llena a partir de packages (misma consulta que `python rollups.py rebuild`).
+"""
+from sqlalchemy import text
+
+revision = "0004"
+down_revision = "0003"
+
+COUNT_SQL = """
+    SELECT fecha_recepcion, sucursal, tipo_documento, estado, COUNT(*)
+    FROM packages
+    WHERE fecha_recepcion IS NOT NULL
+    GROUP BY fecha_recepcion, sucursal, tipo_documento, estado
+"""
+
+REBUILD_SQL = "INSERT INTO package_daily_stats (fecha, sucursal, tipo_documento, estado, cantidad)" + COUNT_SQL
+
+def upgrade(conn):
+    conn.execute(text("DELETE FROM package_daily_stats"))
+    conn.execute(text(REBUILD_SQL))
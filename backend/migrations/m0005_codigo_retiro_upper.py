@@ -0,0 +1,23 @@
+"""Índice único sobre upper(codigo_retiro) para buscar códigos sin distinguir mayúsculas.
+
+Debe coincidir con Package.__table_args__. Si ya existen códigos que solo se
+diferencian en mayúsculas/minúsculas la migración se detiene y los lista para
+corregirlos a mano (el índice único no se podría crear).
+"""
+from sqlalchemy import text
+
+revision = "0005"
+down_revision = "0004"
+
+def upgrade(conn):
+    duplicados = conn.execute(text(
+        "SELECT upper(codigo_retiro) FROM packages GROUP BY upper(codigo_retiro) HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if duplicados:
+        raise RuntimeError(f"Códigos de retiro repetidos sin distinguir mayúsculas: {', '.join(duplicados[:20])}")
+
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_packages_codigo_retiro_upper ON packages (upper(codigo_retiro))"
+    ))
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ANALYZE packages"))
@@ -0,0 +1,12 @@
+"""Índices de búsqueda de texto completo sobre packages (pg_trgm/tsvector o FTS5).
+
+Las bases nuevas los reciben al crear la tabla packages; ver search.py.
+"""
+import search
+
+revision = "0006"
+down_revision = "0005"
+
+def upgrade(conn):
+    if search.crear_indices(conn):
+        search.reconstruir(conn)
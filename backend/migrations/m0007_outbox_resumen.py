@@ -0,0 +1,17 @@
+"""Columna resumen_de en notification_outbox (modo resumen, NOTIFICATION_DIGEST_SECONDS).
+
+Debe coincidir con NotificationOutbox.resumen_de. Las filas existentes quedan
+en NULL: son notificaciones normales.
+"""
+from sqlalchemy import inspect, text
+
+revision = "0007"
+down_revision = "0006"
+
+def upgrade(conn):
+    columnas = {c["name"] for c in inspect(conn).get_columns("notification_outbox")}
+    if "resumen_de" not in columnas:
+        conn.execute(text("ALTER TABLE notification_outbox ADD COLUMN resumen_de VARCHAR"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_notification_outbox_resumen_de ON notification_outbox (resumen_de)"
+    ))
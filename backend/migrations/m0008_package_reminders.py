@@ -0,0 +1,16 @@
+"""Columnas ultimo_recordatorio/recordatorios_enviados para los recordatorios automáticos.
+
+Deben coincidir con Package. La consulta de paquetes vencidos usa el índice
+ix_packages_estado_fecha (migración 0003).
+"""
+from sqlalchemy import inspect, text
+
+revision = "0008"
+down_revision = "0007"
+
+def upgrade(conn):
+    columnas = {c["name"] for c in inspect(conn).get_columns("packages")}
+    if "ultimo_recordatorio" not in columnas:
+        conn.execute(text("ALTER TABLE packages ADD COLUMN ultimo_recordatorio TIMESTAMP"))
+    if "recordatorios_enviados" not in columnas:
+        conn.execute(text("ALTER TABLE packages ADD COLUMN recordatorios_enviados INTEGER NOT NULL DEFAULT 0"))
@@ -0,0 +1,258 @@
+"""
+Recordatorios automáticos de paquetes sin retirar.
+
+Un hilo en segundo plano despierta en los horarios de REMINDER_TIMES (hora
+local de REMINDER_TZ) y, si a esa hora todavía se puede retirar en Recepción
+(HORARIO_RETIRO de email_templates), envía un correo por destinatario con
+sus paquetes pendientes hace más de REMINDER_MIN_DAYS días. Los correos
+salen en $batch de Graph (send_emails_batch de main.py).
+
+Cada paquete guarda ultimo_recordatorio y recordatorios_enviados. Antes de
+enviar, los paquetes se reservan con un UPDATE condicional: con varios
+workers de uvicorn cada paquete recibe un solo recordatorio cada
+REMINDER_REPEAT_DAYS días. Si el envío a un destinatario falla, su reserva
+se deshace y lo intenta la siguiente ejecución.
+
+El reloj y la función de envío se reciben en el constructor, así que el
+scheduler se puede probar con un reloj fijo, sin esperar ni llamar a Graph:
+
+    scheduler = ReminderScheduler(SessionLocal, enviar_falso, reloj=lambda: datetime(2025, 12, 1, 9, 30))
+    scheduler.ejecutar()
+"""
+import os
+import threading
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from typing import Callable, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import func, or_, select, update
+
+from database import Package
+from email_templates import cierre_retiro, renderizar
+
+REMINDER_TIMES = os.getenv("REMINDER_TIMES", "09:30")  # vacío: sin recordatorios automáticos
+REMINDER_MIN_DAYS = int(os.getenv("REMINDER_MIN_DAYS", "3"))
+REMINDER_REPEAT_DAYS = max(int(os.getenv("REMINDER_REPEAT_DAYS", "1")), 1)
+REMINDER_TZ = os.getenv("REMINDER_TZ", "America/Santiago")
+
+# Estados que todavía esperan retiro (usa el índice ix_packages_estado_fecha)
+ESTADOS_PENDIENTES = ("Pendiente", "Notificado")
+
+# Máximo de IDs por UPDATE ... IN (...)
+_LOTE_IDS = 500
+
+def parse_horarios(texto: str) -> List[dtime]:
+    """"09:30, 15:00" -> [time(9, 30), time(15, 0)] ordenados y sin repetir."""
+    horarios = set()
+    for parte in (texto or "").split(","):
+        if parte.strip():
+            horas, _, minutos = parte.strip().partition(":")
+            horarios.add(dtime(int(horas), int(minutos or 0)))
+    return sorted(horarios)
+
+def zona_horaria(nombre: str) -> Optional[ZoneInfo]:
+    """ZoneInfo de `nombre`; None (hora local del servidor) si no existe o no hay base tz."""
+    if not nombre:
+        return None
+    try:
+        return ZoneInfo(nombre)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"⚠️  Zona horaria {nombre} no disponible; los recordatorios usan la hora del servidor")
+        return None
+
+class ReminderScheduler:
+    """
+    `enviar` recibe [(email, asunto, html)] y retorna un dict por mensaje con
+    la clave "success" (la firma de send_emails_batch). `reloj` retorna la
+    hora local actual sin zona horaria.
+    """
+
+    def __init__(self, session_factory: Callable, enviar: Callable[[List[tuple]], List[dict]],
+                 horarios: Optional[List[dtime]] = None, reloj: Optional[Callable[[], datetime]] = None,
+                 tz: Optional[ZoneInfo] = None, dias_vencido: int = REMINDER_MIN_DAYS,
+                 dias_repeticion: int = REMINDER_REPEAT_DAYS):
+        self._session_factory = session_factory
+        self._enviar = enviar
+        self.horarios = parse_horarios(REMINDER_TIMES) if horarios is None else sorted(horarios)
+        self._tz = tz
+        self._reloj = reloj or (lambda: datetime.now(tz).replace(tzinfo=None) if tz else datetime.now())
+        self.dias_vencido = dias_vencido
+        self.dias_repeticion = dias_repeticion
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.proxima: Optional[datetime] = None
+        self.ultima_ejecucion: Optional[datetime] = None
+        self.ultimo_resultado: Optional[dict] = None
+
+    def _a_utc(self, local: datetime) -> datetime:
+        """Hora local sin zona -> UTC sin zona (como el resto de columnas DateTime)."""
+        con_zona = local.replace(tzinfo=self._tz) if self._tz else local.astimezone()
+        return con_zona.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def proxima_ejecucion(self, desde: datetime) -> Optional[datetime]:
+        """
+        Primer horario configurado posterior a `desde` en que todavía se puede
+        retirar (día con atención y antes de la hora límite). None si ningún
+        horario cae dentro del horario de retiro.
+        """
+        for dias in range(8):
+            dia = desde.date() + timedelta(days=dias)
+            cierre = cierre_retiro(dia)
+            if cierre is None:
+                continue
+            for hora in self.horarios:
+                momento = datetime.combine(dia, hora)
+                if momento > desde and hora < cierre:
+                    return momento
+        return None
+
+    def _condicion_vencidos(self, hoy: date):
+        """Paquetes sin retirar hace más de dias_vencido días y sin recordatorio reciente."""
+        desde_repeticion = self._a_utc(datetime.combine(hoy - timedelta(days=self.dias_repeticion - 1), dtime.min))
+        return (
+            Package.estado.in_(ESTADOS_PENDIENTES),
+            Package.fecha_recepcion < hoy - timedelta(days=self.dias_vencido),
+            or_(Package.ultimo_recordatorio.is_(None), Package.ultimo_recordatorio < desde_repeticion),
+        )
+
+    def vencidos(self, db, limite: int = 5) -> dict:
+        """
+        Cantidad de paquetes vencidos (con o sin recordatorio) y los
+        destinatarios con los más antiguos, como [nombre, cantidad].
+        """
+        hoy = self._reloj().date()
+        condicion = (
+            Package.estado.in_(ESTADOS_PENDIENTES),
+            Package.fecha_recepcion < hoy - timedelta(days=self.dias_vencido),
+        )
+        total = db.execute(select(func.count(Package.id)).where(*condicion)).scalar()
+        destinatarios = db.execute(
+            select(Package.destinatario_nombre, func.count(Package.id)).where(*condicion)
+            .group_by(Package.destinatario_nombre)
+            .order_by(func.min(Package.fecha_recepcion), Package.destinatario_nombre).limit(limite)
+        ).all()
+        return {"dias": self.dias_vencido, "total": total, "destinatarios": [[n, c] for n, c in destinatarios]}
+
+    def ejecutar(self, ahora: Optional[datetime] = None) -> dict:
+        """Envía los recordatorios que correspondan a `ahora` (hora local). Retorna un resumen."""
+        ahora = ahora or self._reloj()
+        resultado = {"ejecutado_en": ahora.isoformat(timespec="seconds"), "paquetes": 0, "enviados": 0, "fallidos": 0}
+        cierre = cierre_retiro(ahora.date())
+        if cierre is None or ahora.time() >= cierre:
+            resultado["omitido"] = "Fuera del horario de retiro"
+            return self._registrar(ahora, resultado)
+
+        marca = self._a_utc(ahora)
+        condicion = self._condicion_vencidos(ahora.date())
+        with self._session_factory() as db:
+            candidatos = db.execute(
+                select(Package.id, Package.ultimo_recordatorio).where(*condicion)
+                .order_by(Package.fecha_recepcion, Package.id)
+            ).all()
+            previos = dict(candidatos)
+            # Reserva: otro worker pudo tomarlos entre el SELECT y el UPDATE
+            reservados = []
+            ids = list(previos)
+            for i in range(0, len(ids), _LOTE_IDS):
+                reservados.extend(db.execute(
+                    update(Package)
+                    .where(Package.id.in_(ids[i:i + _LOTE_IDS]), *condicion)
+                    .values(ultimo_recordatorio=marca, recordatorios_enviados=Package.recordatorios_enviados + 1)
+                    .returning(Package.id, Package.destinatario_email, Package.destinatario_nombre,
+                               Package.codigo_retiro, Package.fecha_recepcion)
+                    .execution_options(synchronize_session=False)
+                ).all())
+            db.commit()
+
+        if not reservados:
+            return self._registrar(ahora, resultado)
+
+        grupos = {}
+        for package_id, email, nombre, codigo, fecha in sorted(reservados, key=lambda r: (r.fecha_recepcion, r.id)):
+            grupo = grupos.setdefault(email.lower(), {"email": email, "nombre": nombre, "ids": [], "paquetes": []})
+            grupo["ids"].append(package_id)
+            grupo["paquetes"].append({"codigo": codigo, "fecha": fecha.isoformat(), "dias": (ahora.date() - fecha).days})
+        grupos = list(grupos.values())
+        mensajes = [
+            (g["email"], f"⏰ Recordatorio: Correspondencia pendiente - {g['nombre']}",
+             renderizar("recordatorio.html", nombre=g["nombre"], paquetes=g["paquetes"]))
+            for g in grupos
+        ]
+        try:
+            envios = self._enviar(mensajes)
+        except Exception as e:
+            print(f"❌ Recordatorios: error enviando: {e}")
+            envios = [{"success": False}] * len(mensajes)
+
+        fallidos = [package_id for g, envio in zip(grupos, envios) if not envio.get("success") for package_id in g["ids"]]
+        if fallidos:
+            self._liberar(fallidos, previos, marca)
+        resultado.update(
+            paquetes=len(reservados) - len(fallidos),
+            enviados=sum(1 for envio in envios if envio.get("success")),
+            fallidos=sum(1 for envio in envios if not envio.get("success")),
+        )
+        return self._registrar(ahora, resultado)
+
+    def _liberar(self, ids: List[int], previos: dict, marca: datetime):
+        """Deshace la reserva de paquetes cuyo recordatorio no se pudo enviar."""
+        por_previo = {}
+        for package_id in ids:
+            por_previo.setdefault(previos.get(package_id), []).append(package_id)
+        with self._session_factory() as db:
+            for previo, grupo in por_previo.items():
+                for i in range(0, len(grupo), _LOTE_IDS):
+                    db.execute(
+                        update(Package)
+                        .where(Package.id.in_(grupo[i:i + _LOTE_IDS]), Package.ultimo_recordatorio == marca)
+                        .values(ultimo_recordatorio=previo, recordatorios_enviados=Package.recordatorios_enviados - 1)
+                        .execution_options(synchronize_session=False)
+                    )
+            db.commit()
+
+    def _registrar(self, ahora: datetime, resultado: dict) -> dict:
+        self.ultima_ejecucion = ahora
+        self.ultimo_resultado = resultado
+        if resultado["paquetes"] or resultado["fallidos"]:
+            print(f"⏰ Recordatorios: {resultado['enviados']} enviados, {resultado['fallidos']} fallidos "
+                  f"({resultado['paquetes']} paquetes)")
+        return resultado
+
+    def _loop(self):
+        print(f"⏰ Recordatorios automáticos: {', '.join(h.strftime('%H:%M') for h in self.horarios)}")
+        self.proxima = self.proxima_ejecucion(self._reloj())
+        while not self._stop.is_set():
+            if self.proxima is None:
+                print("⚠️  Ningún horario de REMINDER_TIMES cae dentro del horario de retiro; recordatorios detenidos")
+                return
+            espera = (self.proxima - self._reloj()).total_seconds()
+            if espera > 0:
+                # Tramos de 5 minutos: un cambio de hora del sistema no desfasa más que eso
+                self._stop.wait(min(espera, 300))
+                continue
+            try:
+                self.ejecutar()
+            except Exception as e:
+                print(f"❌ Recordatorios: error en la ejecución: {e}")
+            self.proxima = self.proxima_ejecucion(self.proxima)
+
+    def start(self):
+        if not self.horarios or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="reminder-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        return {
+            "horarios": [h.strftime("%H:%M") for h in self.horarios],
+            "activo": bool(self._thread and self._thread.is_alive()),
+            "proxima_ejecucion": self.proxima.isoformat(timespec="minutes") if self.proxima else None,
+            "ultima_ejecucion": self.ultima_ejecucion.isoformat(timespec="seconds") if self.ultima_ejecucion else None,
+            "ultimo_resultado": self.ultimo_resultado,
+        }
@@ -0,0 +1,56 @@
+"""
+Mantenimiento del rollup diario package_daily_stats.
+
+    python rollups.py check      # compara el rollup con la tabla packages
+    python rollups.py rebuild    # lo reconstruye desde cero
+
+check termina con código 1 si encuentra diferencias, para usarlo en un cron.
+"""
+import sys
+
+from sqlalchemy import text
+
+from database import engine
+from migrations.m0004_package_daily_stats import COUNT_SQL, REBUILD_SQL
+
+def rebuild(conn) -> int:
+    conn.execute(text("DELETE FROM package_daily_stats"))
+    conn.execute(text(REBUILD_SQL))
+    return conn.execute(text("SELECT COUNT(*) FROM package_daily_stats")).scalar()
+
+def check(conn) -> list:
+    """
+    Retorna [(fecha, sucursal, tipo_documento, estado, esperado, rollup), ...]
+    para cada clave donde el rollup no coincide con un COUNT(*) sobre packages.
+    """
+    esperado = {
+        tuple(fila[:4]): fila[4]
+        for fila in conn.execute(text(COUNT_SQL))
+    }
+    actual = {
+        tuple(fila[:4]): fila[4]
+        for fila in conn.execute(text(
+            "SELECT fecha, sucursal, tipo_documento, estado, cantidad FROM package_daily_stats"
+        ))
+    }
+    diferencias = []
+    for clave in sorted(set(esperado) | set(actual), key=str):
+        if esperado.get(clave, 0) != actual.get(clave, 0):
+            diferencias.append((*clave, esperado.get(clave, 0), actual.get(clave, 0)))
+    return diferencias
+
+if __name__ == "__main__":
+    comando = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if comando == "rebuild":
+        with engine.begin() as conn:
+            print(f"✅ Rollup reconstruido: {rebuild(conn)} filas")
+    elif comando == "check":
+        with engine.connect() as conn:
+            diferencias = check(conn)
+        for fecha, sucursal, tipo, estado, esperado, rollup in diferencias:
+            print(f"❌ {fecha} {sucursal} / {tipo} / {estado}: packages={esperado} rollup={rollup}")
+        print("✅ Rollup consistente" if not diferencias else f"{len(diferencias)} diferencia(s)")
+        sys.exit(1 if diferencias else 0)
+    else:
+        print("Uso: python rollups.py [check|rebuild]")
+        sys.exit(1)
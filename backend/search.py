@@ -0,0 +1,152 @@
+"""
+Búsqueda de texto completo sobre packages (código de retiro, destinatario,
+número de documento, proveedor y observaciones), sin distinguir mayúsculas
+ni tildes y ordenada por relevancia.
+
+- PostgreSQL: índices GIN sobre el texto normalizado con f_unaccent(lower(...)):
+  uno de trigramas (pg_trgm, coincidencias parciales dentro de una palabra)
+  y uno tsvector 'spanish' (palabras completas o prefijos, con ts_rank).
+  f_unaccent es un envoltorio IMMUTABLE de unaccent(), que por sí sola no se
+  puede usar en un índice.
+- SQLite: tabla virtual FTS5 packages_fts (tokenizer unicode61 con
+  remove_diacritics 2) sincronizada con triggers y ordenada con bm25.
+
+Si la extensión o FTS5 no están disponibles se usa un LIKE sobre las mismas
+columnas (correcto, pero recorre la tabla).
+
+Los índices se crean con crear_indices(): desde la migración 0006 en bases
+existentes y al crear la tabla packages en bases nuevas (ver database.py).
+"""
+import re
+from typing import Optional, Tuple
+
+from sqlalchemy import text
+
+CAMPOS = ("codigo_retiro", "destinatario_nombre", "numero_documento", "proveedor", "observaciones")
+
+# Peso de cada campo en bm25 (SQLite), mismo orden que CAMPOS
+PESOS_BM25 = (10.0, 5.0, 5.0, 2.0, 1.0)
+
+# Texto indexado en PostgreSQL. Debe ser idéntico en los índices y en las
+# consultas; se usa || y coalesce porque concat_ws no es IMMUTABLE
+DOCUMENTO_PG = "f_unaccent(lower(" + " || ' ' || ".join(f"coalesce({c}, '')" for c in CAMPOS) + "))"
+
+_PALABRA = re.compile(r"\w+", re.UNICODE)
+
+def _sqlite_ddl():
+    columnas = ", ".join(CAMPOS)
+    nuevas = ", ".join(f"new.{c}" for c in CAMPOS)
+    viejas = ", ".join(f"old.{c}" for c in CAMPOS)
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS packages_fts USING fts5(
+            {columnas}, content='packages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2')""",
+        f"""CREATE TRIGGER IF NOT EXISTS packages_fts_ai AFTER INSERT ON packages BEGIN
+            INSERT INTO packages_fts(rowid, {columnas}) VALUES (new.id, {nuevas});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS packages_fts_ad AFTER DELETE ON packages BEGIN
+            INSERT INTO packages_fts(packages_fts, rowid, {columnas}) VALUES ('delete', old.id, {viejas});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS packages_fts_au AFTER UPDATE OF {columnas} ON packages BEGIN
+            INSERT INTO packages_fts(packages_fts, rowid, {columnas}) VALUES ('delete', old.id, {viejas});
+            INSERT INTO packages_fts(rowid, {columnas}) VALUES (new.id, {nuevas});
+        END""",
+    ]
+
+_PG_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    """CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS
+        $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$""",
+    f"CREATE INDEX IF NOT EXISTS ix_packages_busqueda_trgm ON packages USING gin (({DOCUMENTO_PG}) gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS ix_packages_busqueda_tsv ON packages USING gin (to_tsvector('spanish'::regconfig, {DOCUMENTO_PG}))",
+]
+
+def crear_indices(conn) -> bool:
+    """
+    Crea (si faltan) los índices de búsqueda del dialecto de `conn`.
+    Retorna False si el motor no los soporta; la búsqueda queda con LIKE.
+    """
+    ddl = {"postgresql": _PG_DDL, "sqlite": _sqlite_ddl()}.get(conn.dialect.name)
+    if ddl is None:
+        return False
+    try:
+        if conn.dialect.name == "postgresql":
+            # Savepoint: un error (p. ej. sin permiso para crear la extensión)
+            # dejaría abortada la transacción de la migración
+            with conn.begin_nested():
+                for sentencia in ddl:
+                    conn.execute(text(sentencia))
+        else:
+            for sentencia in ddl:
+                conn.execute(text(sentencia))
+        return True
+    except Exception as e:
+        print(f"⚠️  Búsqueda de texto completo no disponible ({e.__class__.__name__}: {e}); se usará LIKE")
+        return False
+
+def reconstruir(conn):
+    """Vuelve a indexar todos los paquetes (solo FTS5; en PostgreSQL los índices son de expresión)."""
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("INSERT INTO packages_fts(packages_fts) VALUES ('rebuild')"))
+
+# Consulta que indica si los índices de búsqueda existen (ver crear_indices)
+DETECTAR_SQL = {
+    "postgresql": "SELECT to_regclass('ix_packages_busqueda_tsv') IS NOT NULL",
+    "sqlite": "SELECT COUNT(*) > 0 FROM sqlite_master WHERE name = 'packages_fts'",
+}
+
+def _escapar_like(texto: str) -> str:
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def palabras(texto: str) -> list:
+    return _PALABRA.findall(texto or "")
+
+def consulta(dialecto: str, indexado: bool, texto: str) -> Optional[Tuple[str, dict]]:
+    """
+    SQL (id, relevancia) de los paquetes que coinciden con `texto`, mayor
+    relevancia primero. Cada trozo separado por espacios debe aparecer; las
+    palabras de un mismo trozo ("PK-251128-AB") se buscan como frase seguida
+    y la última como prefijo. Retorna None si el texto no tiene palabras.
+    """
+    trozos = [p for p in (palabras(t) for t in texto.split()) if p]
+    if not trozos:
+        return None
+    terminos = [t for trozo in trozos for t in trozo]
+
+    if indexado and dialecto == "sqlite":
+        # Frase en vez de palabras sueltas: "pk"* coincide con todos los
+        # códigos y cruzarlo con el resto sería tan caro como recorrer la tabla
+        match = " ".join('"' + " ".join(trozo).replace('"', '""') + '"*' for trozo in trozos)
+        pesos = ", ".join(str(p) for p in PESOS_BM25)
+        return (
+            f"SELECT rowid AS id, -bm25(packages_fts, {pesos}) AS relevancia "
+            f"FROM packages_fts WHERE packages_fts MATCH :match",
+            {"match": match},
+        )
+
+    if indexado and dialecto == "postgresql":
+        fragmento = texto.strip()
+        tsquery = " & ".join(" <-> ".join(trozo[:-1] + [f"{trozo[-1]}:*"]) for trozo in trozos)
+        # El LIKE (índice de trigramas) encuentra el texto tal cual dentro de
+        # una palabra, p. ej. parte de un código; con menos de 3 letras no hay
+        # trigramas y solo se usa el tsvector
+        condicion = f"to_tsvector('spanish'::regconfig, {DOCUMENTO_PG}) @@ q.consulta"
+        if len(fragmento) >= 3:
+            condicion += f" OR {DOCUMENTO_PG} LIKE f_unaccent(lower(:patron)) ESCAPE '\\'"
+        return (
+            f"SELECT id, ts_rank(to_tsvector('spanish'::regconfig, {DOCUMENTO_PG}), q.consulta) "
+            f"+ similarity({DOCUMENTO_PG}, f_unaccent(lower(:texto))) AS relevancia "
+            f"FROM packages, to_tsquery('spanish'::regconfig, f_unaccent(lower(:tsquery))) AS q(consulta) "
+            f"WHERE {condicion}",
+            {"texto": fragmento, "patron": f"%{_escapar_like(fragmento)}%", "tsquery": tsquery},
+        )
+
+    # Sin índice: todas las palabras deben aparecer en alguno de los campos
+    documento = "lower(" + " || ' ' || ".join(f"coalesce({c}, '')" for c in CAMPOS) + ")"
+    condiciones = " AND ".join(f"{documento} LIKE :t{i} ESCAPE '\\'" for i in range(len(terminos)))
+    return (
+        f"SELECT id, 0 AS relevancia FROM packages WHERE {condiciones}",
+        {f"t{i}": f"%{_escapar_like(t.lower())}%" for i, t in enumerate(terminos)},
+    )
@@ -6,9 +6,11 @@ Usa Groq API (gratis) con modelo Llama 3.1
 import os
 import requests
 import re
-from typing import List, Dict, Optional, Tuple
+from typing import Dict, Optional, Sequence, Tuple
 from groq import Groq
 
+from package_record import PackageRecord, mostrar
+
 # Configurar cliente Groq
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
@@ -17,36 +19,17 @@ if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY environment variable is required")
 
 
-def get_field(pkg: Dict, field_name: str, default='') -> str:
-    """
-    Obtiene un campo del paquete con compatibilidad entre formato Excel y Frontend.
-    Excel usa PascalCase (CodigoRetiro), Frontend usa camelCase (codigoRetiro).
-    """
-    # Mapeo de campos camelCase a PascalCase
-    field_map = {
-        'codigoRetiro': 'CodigoRetiro',
-        'destinatarioNombre': 'DestinatarioNombre',
-        'destinatarioEmail': 'DestinatarioEmail',
-        'sucursal': 'Sucursal',
-        'proveedor': 'Proveedor',
-        'tipoDocumento': 'TipoDocumento',
-        'numeroDocumento': 'NumeroDocumento',
-        'fechaRecepcion': 'FechaRecepcion',
-        'horaRecepcion': 'HoraRecepcion',
-        'medioNotificacion': 'MedioNotificacion',
-        'recepcionista': 'Recepcionista',
-        'observaciones': 'Observaciones'
-    }
-
-    # Intentar primero con PascalCase (Excel)
-    pascal_case = field_map.get(field_name, field_name)
-    value = pkg.get(pascal_case)
+def normalizar_codigo(codigo: str) -> str:
+    """Forma canónica de un código de retiro (sin espacios, en mayúsculas)."""
+    return (codigo or '').strip().upper()
 
-    # Si no existe, intentar con camelCase (Frontend)
-    if value is None:
-        value = pkg.get(field_name)
 
-    return value if value is not None else default
+def construir_indice_codigos(historial: Sequence[PackageRecord]) -> Dict[str, int]:
+    """
+    Índice código de retiro normalizado -> posición en el historial.
+    Recorre el historial una vez; las búsquedas posteriores son O(1).
+    """
+    return {normalizar_codigo(pkg.codigo_retiro): i for i, pkg in enumerate(historial)}
 
 
 def enviar_recordatorio(email: str, nombre: str) -> Tuple[bool, str]:
@@ -72,33 +55,37 @@ def enviar_recordatorio(email: str, nombre: str) -> Tuple[bool, str]:
         return False, f"❌ Error al enviar recordatorio: {str(e)}"
 
 
-def generar_dashboard(historial: List[Dict]) -> str:
+def generar_dashboard(historial: Sequence[PackageRecord]) -> str:
     """
     Genera un dashboard con estadísticas de los paquetes.
+    Los conteos vienen de /stats (rollup diario del backend); si el backend
+    no responde se calculan localmente sobre el historial.
     """
-    if not historial:
+    try:
+        r = requests.get(f"{BACKEND_URL}/stats", timeout=10)
+        r.raise_for_status()
+        stats = r.json()
+    except Exception:
+        stats = None
+
+    if stats is not None:
+        total = stats["total"]
+        tipos = [tuple(par) for par in stats["por_tipo"]]
+        sucursales = [tuple(par) for par in stats["por_sucursal"]]
+        top_destinatarios = [tuple(par) for par in stats["top_destinatarios"]]
+        top_proveedores = [tuple(par) for par in stats["top_proveedores"]]
+    else:
+        from collections import Counter
+
+        total = len(historial)
+        tipos = Counter(pkg.tipo_documento for pkg in historial).most_common()
+        sucursales = Counter(pkg.sucursal for pkg in historial).most_common()
+        top_destinatarios = Counter(pkg.destinatario_nombre for pkg in historial).most_common(5)
+        top_proveedores = Counter(pkg.proveedor for pkg in historial).most_common(5)
+
+    if not total:
         return "📭 No hay datos para generar el dashboard."
 
-    from collections import Counter
-    from datetime import datetime
-
-    # Estadísticas generales
-    total = len(historial)
-
-    # Contar por tipo de documento
-    tipos = Counter(get_field(pkg, 'tipoDocumento') for pkg in historial)
-
-    # Contar por sucursal
-    sucursales = Counter(get_field(pkg, 'sucursal') for pkg in historial)
-
-    # Contar por destinatario (top 5)
-    destinatarios = Counter(get_field(pkg, 'destinatarioNombre') for pkg in historial)
-    top_destinatarios = destinatarios.most_common(5)
-
-    # Contar por proveedor (top 5)
-    proveedores = Counter(get_field(pkg, 'proveedor') for pkg in historial)
-    top_proveedores = proveedores.most_common(5)
-
     # Generar dashboard
     dashboard = f"""📊 **DASHBOARD DE PAQUETES**
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -107,12 +94,12 @@ def generar_dashboard(historial: List[Dict]) -> str:
 
 **📄 Por Tipo de Documento:**
 """
-    for tipo, count in tipos.most_common():
+    for tipo, count in tipos:
         barra = "█" * min(count, 20)
         dashboard += f"  {tipo}: {barra} ({count})\n"
 
     dashboard += f"\n**📍 Por Sucursal:**\n"
-    for sucursal, count in sucursales.most_common():
+    for sucursal, count in sucursales:
         barra = "█" * min(count, 20)
         dashboard += f"  {sucursal}: {barra} ({count})\n"
 
@@ -127,7 +114,7 @@ def generar_dashboard(historial: List[Dict]) -> str:
     return dashboard
 
 
-def enviar_alertas_masivas(historial: List[Dict]) -> str:
+def enviar_alertas_masivas(historial: Sequence[PackageRecord]) -> str:
     """
     Envía recordatorios a todos los usuarios con paquetes pendientes.
     """
@@ -137,25 +124,32 @@ def enviar_alertas_masivas(historial: List[Dict]) -> str:
     # Agrupar por email
     emails_unicos = {}
     for pkg in historial:
-        email = get_field(pkg, 'destinatarioEmail')
-        nombre = get_field(pkg, 'destinatarioNombre')
+        email = pkg.destinatario_email
+        nombre = pkg.destinatario_nombre
         if email and email not in emails_unicos:
             emails_unicos[email] = nombre
 
-    # Enviar recordatorios
-    exitosos = 0
-    fallidos = 0
+    # Enviar recordatorios en una sola llamada (el backend agrupa en $batch de Graph)
+    try:
+        r = requests.post(
+            f"{BACKEND_URL}/send-reminders/bulk",
+            json={"recipientes": [{"email": email, "nombre": nombre} for email, nombre in emails_unicos.items()]},
+            timeout=120
+        )
+        if r.status_code != 200:
+            return f"❌ Error del servidor al enviar alertas: {r.status_code}"
+        data = r.json()
+    except Exception as e:
+        return f"❌ Error al enviar alertas: {str(e)}"
+
+    exitosos = data.get("enviados", 0)
+    fallidos = data.get("fallidos", 0)
 
     resultado = f"📧 **Enviando alertas a {len(emails_unicos)} destinatario(s)...**\n\n"
 
-    for email, nombre in emails_unicos.items():
-        exito, _ = enviar_recordatorio(email, nombre)
-        if exito:
-            exitosos += 1
-            resultado += f"✅ {nombre} ({email})\n"
-        else:
-            fallidos += 1
-            resultado += f"❌ {nombre} ({email})\n"
+    for envio in data.get("resultados", []):
+        emoji = "✅" if envio.get("success") else "❌"
+        resultado += f"{emoji} {envio.get('nombre', '')} ({envio.get('email', '')})\n"
 
     resultado += f"\n**Resumen:**\n"
     resultado += f"✅ Exitosos: {exitosos}\n"
@@ -164,10 +158,12 @@ def enviar_alertas_masivas(historial: List[Dict]) -> str:
     return resultado
 
 
-def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
+def chatbot_reglas(pregunta: str, historial: Sequence[PackageRecord], indice_codigos: Optional[Dict[str, int]] = None) -> Optional[str]:
     """
     Chatbot basado en reglas para consultas simples y rápidas.
     Retorna None si no puede responder con reglas.
+    `indice_codigos` (ver construir_indice_codigos) evita recorrer el historial
+    en las consultas por código; si no se entrega se construye en el momento.
     """
     pregunta_lower = pregunta.lower()
 
@@ -224,18 +220,19 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
 
         if fecha_encontrada:
             # Buscar paquetes de esa fecha
-            paquetes_fecha = [
-                p for p in historial
-                if (get_field(p, 'fechaRecepcion') or '').startswith(fecha_encontrada)
-            ]
+            try:
+                fecha_buscada = datetime.strptime(fecha_encontrada, "%Y-%m-%d").date()
+            except ValueError:
+                fecha_buscada = None  # p. ej. 31 de febrero
+            paquetes_fecha = [p for p in historial if p.fecha_recepcion == fecha_buscada] if fecha_buscada else []
 
             if paquetes_fecha:
                 resultado = f"📦 **Paquetes registrados el {fecha_encontrada}:**\n\n"
                 for i, pkg in enumerate(paquetes_fecha, 1):
-                    codigo = get_field(pkg, 'codigoRetiro')
-                    destinatario = get_field(pkg, 'destinatarioNombre')
-                    tipo = get_field(pkg, 'tipoDocumento')
-                    hora = get_field(pkg, 'horaRecepcion')
+                    codigo = pkg.codigo_retiro
+                    destinatario = pkg.destinatario_nombre
+                    tipo = pkg.tipo_documento
+                    hora = mostrar(pkg.hora_recepcion, '')
                     resultado += f"{i}. **{codigo}**\n"
                     resultado += f"   - Destinatario: {destinatario}\n"
                     resultado += f"   - Tipo: {tipo}\n"
@@ -261,16 +258,16 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
             # Buscar paquetes de esa sucursal
             paquetes_sucursal = [
                 p for p in historial
-                if sucursal_buscada in get_field(p, 'sucursal').lower()
+                if sucursal_buscada in p.sucursal.lower()
             ]
 
             if paquetes_sucursal:
                 resultado = f"📍 **Paquetes en sucursal '{sucursal_buscada.title()}':** {len(paquetes_sucursal)}\n\n"
                 for i, pkg in enumerate(paquetes_sucursal[-10:], 1):  # Últimos 10
-                    codigo = get_field(pkg, 'codigoRetiro')
-                    destinatario = get_field(pkg, 'destinatarioNombre')
-                    tipo = get_field(pkg, 'tipoDocumento')
-                    fecha = get_field(pkg, 'fechaRecepcion')
+                    codigo = pkg.codigo_retiro
+                    destinatario = pkg.destinatario_nombre
+                    tipo = pkg.tipo_documento
+                    fecha = mostrar(pkg.fecha_recepcion, '')
                     resultado += f"{i}. **{codigo}** - {destinatario}\n"
                     resultado += f"   Tipo: {tipo} | Fecha: {fecha}\n\n"
 
@@ -283,7 +280,7 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
             # Listar todas las sucursales
             sucursales = {}
             for pkg in historial:
-                suc = get_field(pkg, 'sucursal')
+                suc = pkg.sucursal
                 sucursales[suc] = sucursales.get(suc, 0) + 1
 
             if sucursales:
@@ -322,16 +319,16 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
             # Buscar paquetes de ese tipo
             paquetes_tipo = [
                 p for p in historial
-                if get_field(p, 'tipoDocumento').lower() == tipo_buscado.lower()
+                if p.tipo_documento.lower() == tipo_buscado.lower()
             ]
 
             if paquetes_tipo:
                 resultado = f"📄 **{tipo_buscado}s registrados:** {len(paquetes_tipo)}\n\n"
                 for i, pkg in enumerate(paquetes_tipo[-10:], 1):  # Últimos 10
-                    codigo = get_field(pkg, 'codigoRetiro')
-                    destinatario = get_field(pkg, 'destinatarioNombre')
-                    sucursal = get_field(pkg, 'sucursal')
-                    fecha = get_field(pkg, 'fechaRecepcion')
+                    codigo = pkg.codigo_retiro
+                    destinatario = pkg.destinatario_nombre
+                    sucursal = pkg.sucursal
+                    fecha = mostrar(pkg.fecha_recepcion, '')
                     resultado += f"{i}. **{codigo}** - {destinatario}\n"
                     resultado += f"   Sucursal: {sucursal} | Fecha: {fecha}\n\n"
 
@@ -344,7 +341,7 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
             # Listar todos los tipos
             tipos = {}
             for pkg in historial:
-                tipo = get_field(pkg, 'tipoDocumento')
+                tipo = pkg.tipo_documento
                 tipos[tipo] = tipos.get(tipo, 0) + 1
 
             if tipos:
@@ -369,7 +366,7 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
             for palabra in palabras:
                 if len(palabra) >= 3:  # Mínimo 3 caracteres
                     for pkg in historial:
-                        nombre = get_field(pkg, 'destinatarioNombre').lower()
+                        nombre = pkg.destinatario_nombre.lower()
                         if palabra in nombre:
                             destinatarios_encontrados.append(pkg)
 
@@ -377,7 +374,7 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
                 # Agrupar por destinatario único
                 dest_unicos = {}
                 for pkg in destinatarios_encontrados:
-                    nombre = get_field(pkg, 'destinatarioNombre')
+                    nombre = pkg.destinatario_nombre
                     if nombre not in dest_unicos:
                         dest_unicos[nombre] = []
                     dest_unicos[nombre].append(pkg)
@@ -386,9 +383,9 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
                 for nombre, paquetes in list(dest_unicos.items())[:5]:  # Máximo 5 destinatarios
                     resultado += f"**{nombre}** ({len(paquetes)} paquete(s))\n"
                     for i, pkg in enumerate(paquetes[:3], 1):  # Máximo 3 paquetes por destinatario
-                        codigo = get_field(pkg, 'codigoRetiro')
-                        tipo = get_field(pkg, 'tipoDocumento')
-                        fecha = get_field(pkg, 'fechaRecepcion')
+                        codigo = pkg.codigo_retiro
+                        tipo = pkg.tipo_documento
+                        fecha = mostrar(pkg.fecha_recepcion, '')
                         resultado += f"  {i}. {codigo} - {tipo} ({fecha})\n"
                     if len(paquetes) > 3:
                         resultado += f"  _(y {len(paquetes) - 3} más)_\n"
@@ -418,8 +415,8 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
             # Intentar extraer el nombre del historial
             nombre = "Usuario"
             for pkg in historial:
-                if get_field(pkg, 'destinatarioEmail').lower() == email.lower():
-                    nombre = get_field(pkg, 'destinatarioNombre')
+                if pkg.destinatario_email.lower() == email.lower():
+                    nombre = pkg.destinatario_nombre
                     break
 
             # Enviar recordatorio
@@ -435,8 +432,8 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
             # Buscar coincidencias en el historial
             destinatarios_encontrados = []
             for pkg in historial:
-                nombre_pkg = get_field(pkg, 'destinatarioNombre').lower()
-                email_pkg = get_field(pkg, 'destinatarioEmail')
+                nombre_pkg = pkg.destinatario_nombre.lower()
+                email_pkg = pkg.destinatario_email
 
                 # Buscar si alguna palabra de la pregunta está en el nombre del destinatario
                 for palabra in palabras:
@@ -444,10 +441,10 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
                         # Evitar duplicados
                         if email_pkg not in [d['email'] for d in destinatarios_encontrados]:
                             destinatarios_encontrados.append({
-                                'nombre': get_field(pkg, 'destinatarioNombre'),
+                                'nombre': pkg.destinatario_nombre,
                                 'email': email_pkg,
-                                'codigo': get_field(pkg, 'codigoRetiro'),
-                                'sucursal': get_field(pkg, 'sucursal')
+                                'codigo': pkg.codigo_retiro,
+                                'sucursal': pkg.sucursal
                             })
                         break
 
@@ -490,17 +487,20 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
             codigo_parte = partes[1].split()[0] if partes[1].split() else partes[1][:10]
             codigo = f"PK-{codigo_parte.upper()}"
 
-            # Buscar en historial
-            for pkg in historial:
-                if get_field(pkg, 'codigoRetiro').upper() == codigo.upper():
-                    return f"""✅ **Paquete encontrado:**
-- **Código:** {get_field(pkg, 'codigoRetiro')}
-- **Destinatario:** {get_field(pkg, 'destinatarioNombre')}
-- **Email:** {get_field(pkg, 'destinatarioEmail')}
-- **Sucursal:** {get_field(pkg, 'sucursal')}
-- **Proveedor:** {get_field(pkg, 'proveedor')}
-- **Documento:** {get_field(pkg, 'tipoDocumento')} - {get_field(pkg, 'numeroDocumento')}
-- **Fecha:** {get_field(pkg, 'fechaRecepcion')} {get_field(pkg, 'horaRecepcion')}
+            # Buscar en historial por índice
+            if indice_codigos is None:
+                indice_codigos = construir_indice_codigos(historial)
+            pos = indice_codigos.get(normalizar_codigo(codigo))
+            if pos is not None:
+                pkg = historial[pos]
+                return f"""✅ **Paquete encontrado:**
+- **Código:** {pkg.codigo_retiro}
+- **Destinatario:** {pkg.destinatario_nombre}
+- **Email:** {pkg.destinatario_email}
+- **Sucursal:** {pkg.sucursal}
+- **Proveedor:** {pkg.proveedor}
+- **Documento:** {pkg.tipo_documento} - {pkg.numero_documento}
+- **Fecha:** {mostrar(pkg.fecha_recepcion, '')} {mostrar(pkg.hora_recepcion, '')}
 """
             return f"❌ No encontré el código {codigo} en el historial actual."
 
@@ -520,10 +520,10 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
         if historial:
             ultimo = historial[-1]
             return f"""📦 **Último paquete registrado:**
-- **Código:** {get_field(ultimo, 'codigoRetiro')}
-- **Destinatario:** {get_field(ultimo, 'destinatarioNombre')}
-- **Sucursal:** {get_field(ultimo, 'sucursal')}
-- **Fecha:** {get_field(ultimo, 'fechaRecepcion')} {get_field(ultimo, 'horaRecepcion')}
+- **Código:** {ultimo.codigo_retiro}
+- **Destinatario:** {ultimo.destinatario_nombre}
+- **Sucursal:** {ultimo.sucursal}
+- **Fecha:** {mostrar(ultimo.fecha_recepcion, '')} {mostrar(ultimo.hora_recepcion, '')}
 """
         return "📭 No hay paquetes registrados todavía."
 
@@ -534,7 +534,7 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
 
         resultado = f"📋 **Lista de {len(historial)} paquete(s):**\n\n"
         for i, pkg in enumerate(historial[-10:], 1):  # Últimos 10
-            resultado += f"{i}. {get_field(pkg, 'codigoRetiro')} - {get_field(pkg, 'destinatarioNombre')} ({get_field(pkg, 'sucursal')})\n"
+            resultado += f"{i}. {pkg.codigo_retiro} - {pkg.destinatario_nombre} ({pkg.sucursal})\n"
 
         if len(historial) > 10:
             resultado += f"\n_(Mostrando los últimos 10 de {len(historial)} total)_"
@@ -548,19 +548,19 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
         for i, palabra in enumerate(palabras):
             if palabra.lower() in ["destinatario", "nombre", "para", "de"] and i + 1 < len(palabras):
                 nombre_buscar = palabras[i + 1].lower()
-                encontrados = [pkg for pkg in historial if nombre_buscar in get_field(pkg, 'destinatarioNombre').lower()]
+                encontrados = [pkg for pkg in historial if nombre_buscar in pkg.destinatario_nombre.lower()]
 
                 if encontrados:
                     resultado = f"🔍 Encontré **{len(encontrados)} paquete(s)** con '{nombre_buscar}':\n\n"
                     for pkg in encontrados:
-                        resultado += f"- {get_field(pkg, 'codigoRetiro')}: {get_field(pkg, 'destinatarioNombre')} ({get_field(pkg, 'sucursal')})\n"
+                        resultado += f"- {pkg.codigo_retiro}: {pkg.destinatario_nombre} ({pkg.sucursal})\n"
                     return resultado
 
     # Buscar por sucursal
     sucursales = ["SANTIAGO", "VIÑA DEL MAR", "CONCEPCIÓN", "LA SERENA"]
     for sucursal in sucursales:
         if sucursal.lower() in pregunta_lower or sucursal.replace(" ", "").lower() in pregunta_lower:
-            encontrados = [pkg for pkg in historial if get_field(pkg, 'sucursal').upper() == sucursal.upper()]
+            encontrados = [pkg for pkg in historial if pkg.sucursal.upper() == sucursal.upper()]
             if encontrados:
                 return f"📍 Hay **{len(encontrados)} paquete(s)** en {sucursal}."
             return f"📍 No hay paquetes registrados en {sucursal}."
@@ -576,19 +576,19 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
 
     for tipo, variantes in tipos_doc.items():
         if any(var in pregunta_lower for var in variantes):
-            encontrados = [pkg for pkg in historial if get_field(pkg, 'tipoDocumento').lower() == tipo.lower()]
+            encontrados = [pkg for pkg in historial if pkg.tipo_documento.lower() == tipo.lower()]
 
             if encontrados:
                 resultado = f"💰 Encontré **{len(encontrados)} paquete(s)** con tipo de documento '{tipo.upper()}':\n\n"
                 for pkg in encontrados:
-                    resultado += f"- **{get_field(pkg, 'codigoRetiro')}**: {get_field(pkg, 'destinatarioNombre')}\n"
-                    resultado += f"  📄 Documento: {get_field(pkg, 'numeroDocumento')}\n"
-                    resultado += f"  🚚 Proveedor: {get_field(pkg, 'proveedor')}\n"
+                    resultado += f"- **{pkg.codigo_retiro}**: {pkg.destinatario_nombre}\n"
+                    resultado += f"  📄 Documento: {pkg.numero_documento}\n"
+                    resultado += f"  🚚 Proveedor: {pkg.proveedor}\n"
 
                     # Si es cheque, mostrar monto y fecha de vencimiento si existen
                     if tipo.lower() == "cheque":
-                        monto = get_field(pkg, 'montoCheque')
-                        fecha_venc = get_field(pkg, 'fechaVencimientoCheque')
+                        monto = pkg.monto_cheque
+                        fecha_venc = pkg.fecha_vencimiento_cheque
                         if monto:
                             resultado += f"  💵 Monto: {monto}\n"
                         if fecha_venc:
@@ -604,7 +604,7 @@ def chatbot_reglas(pregunta: str, historial: List[Dict]) -> Optional[str]:
     return None
 
 
-def chatbot_groq(pregunta: str, historial: List[Dict]) -> str:
+def chatbot_groq(pregunta: str, historial: Sequence[PackageRecord]) -> str:
     """
     Chatbot con IA usando Groq (gratis y rápido).
     Se usa cuando las reglas no pueden responder.
@@ -620,11 +620,11 @@ def chatbot_groq(pregunta: str, historial: List[Dict]) -> str:
             limite = min(len(historial), 50)
             contexto += f"\nTODOS los registros (mostrando {limite} más recientes):\n"
             for i, pkg in enumerate(historial[-limite:], 1):
-                contexto += f"{i}. Código: {get_field(pkg, 'codigoRetiro')}, "
-                contexto += f"Destinatario: {get_field(pkg, 'destinatarioNombre')}, "
-                contexto += f"Sucursal: {get_field(pkg, 'sucursal')}, "
-                contexto += f"Tipo: {get_field(pkg, 'tipoDocumento')}, "
-                contexto += f"Fecha: {get_field(pkg, 'fechaRecepcion')} {get_field(pkg, 'horaRecepcion')}\n"
+                contexto += f"{i}. Código: {pkg.codigo_retiro}, "
+                contexto += f"Destinatario: {pkg.destinatario_nombre}, "
+                contexto += f"Sucursal: {pkg.sucursal}, "
+                contexto += f"Tipo: {pkg.tipo_documento}, "
+                contexto += f"Fecha: {mostrar(pkg.fecha_recepcion, '')} {mostrar(pkg.hora_recepcion, '')}\n"
 
             if len(historial) > 50:
                 contexto += f"\n(Hay {len(historial) - 50} paquetes más antiguos no mostrados aquí)\n"
@@ -663,7 +663,7 @@ Instrucciones:
         return f"❌ Error al procesar con IA: {str(e)}\n\nPuedes intentar reformular tu pregunta o usar las pestañas de Consultar e Historial."
 
 
-def chatbot_inteligente(pregunta: str, historial: List[Dict]) -> Tuple[str, str]:
+def chatbot_inteligente(pregunta: str, historial: Sequence[PackageRecord], indice_codigos: Optional[Dict[str, int]] = None) -> Tuple[str, str]:
     """
     Función principal del chatbot híbrido.
     Intenta primero con reglas (rápido) y luego con IA (más inteligente).
@@ -672,7 +672,7 @@ def chatbot_inteligente(pregunta: str, historial: List[Dict]) -> Tuple[str, str]
         Tuple[str, str]: (respuesta, tipo_de_respuesta)
     """
     # Primero intenta con reglas (instantáneo y gratis)
-    respuesta_reglas = chatbot_reglas(pregunta, historial)
+    respuesta_reglas = chatbot_reglas(pregunta, historial, indice_codigos)
 
     if respuesta_reglas:
         return respuesta_reglas, "🎯 Respuesta directa"
@@ -0,0 +1 @@
+"""Componentes de Streamlit propios del Dashboard (HTML/JS sin build)."""
@@ -0,0 +1,41 @@
+"""
+Autocompletado de destinatarios (componente de Streamlit sin build).
+
+La búsqueda ocurre en el navegador: index.html consulta /search-users del
+backend directamente, con debounce y un cache TTL/LRU de consulta ->
+resultados. Si la respuesta de una consulta vino completa (sin recortar),
+las consultas más largas que la contienen ("vic" -> "vict") se filtran
+localmente sin volver al backend. Escribir no ejecuta el script de la
+página: solo al elegir un resultado el componente envía a Python
+{"displayName", "email", "type", "seleccion"} y Streamlit hace un rerun.
+
+`seleccion` cambia en cada elección (marca de tiempo del navegador), así
+se distingue una elección nueva del valor que el componente conserva entre
+reruns.
+"""
+import os
+from pathlib import Path
+
+import streamlit.components.v1 as components
+
+# URL del backend vista desde el navegador (BACKEND_URL es la que usa el
+# servidor de Streamlit; difieren si el backend no se publica en la misma
+# dirección, p. ej. detrás de un proxy)
+BACKEND_PUBLIC_URL = os.getenv("BACKEND_PUBLIC_URL") or os.getenv("BACKEND_URL", "http://localhost:8000")
+USER_SEARCH_DEBOUNCE_MS = int(os.getenv("USER_SEARCH_DEBOUNCE_MS", "250"))
+USER_SEARCH_CACHE_TTL = int(os.getenv("USER_SEARCH_CACHE_TTL", "300"))  # segundos
+USER_SEARCH_CACHE_SIZE = int(os.getenv("USER_SEARCH_CACHE_SIZE", "100"))  # consultas
+
+_componente = components.declare_component("buscador_destinatario", path=str(Path(__file__).parent))
+
+def buscador_destinatario(placeholder: str = "", key: str = None):
+    """Muestra el buscador; retorna el último destinatario elegido o None."""
+    return _componente(
+        backend_url=BACKEND_PUBLIC_URL.rstrip("/"),
+        placeholder=placeholder,
+        debounce_ms=USER_SEARCH_DEBOUNCE_MS,
+        ttl_ms=USER_SEARCH_CACHE_TTL * 1000,
+        max_consultas=USER_SEARCH_CACHE_SIZE,
+        key=key,
+        default=None,
+    )
@@ -0,0 +1,214 @@
+// Autocompletado de destinatarios (ver __init__.py).
+// Habla con Streamlit con el protocolo de componentes (postMessage con la
+// página padre), sin la librería de npm, así no hay paso de build.
+
+const entrada = document.getElementById("consulta");
+const estado = document.getElementById("estado");
+const lista = document.getElementById("resultados");
+
+let config = null;      // args de Python (backend_url, debounce_ms, ttl_ms, max_consultas)
+let cache = null;
+let temporizador = null;
+let pendiente = null;   // AbortController de la consulta en curso
+let resultados = [];
+let activo = -1;
+
+function enviar(tipo, datos) {
+  window.parent.postMessage(Object.assign({ isStreamlitMessage: true, type: tipo }, datos), "*");
+}
+
+function ajustarAltura() {
+  enviar("streamlit:setFrameHeight", { height: document.body.scrollHeight + 4 });
+}
+
+// Igual que normalize() de directory_index.py: minúsculas y sin tildes
+function normalizar(texto) {
+  return (texto || "").normalize("NFKD").replace(/[\u0300-\u036f]/g, "").toLowerCase();
+}
+
+// Nombre sin la decoración que el backend agrega a los grupos ("📧 Cobranzas (Grupo)")
+function nombreBase(usuario) {
+  return usuario.type === "group"
+    ? usuario.displayName.replace(/^📧 /, "").replace(/ \(Grupo\)$/, "")
+    : usuario.displayName;
+}
+
+// Cache TTL/LRU consulta normalizada -> {usuarios, completo}. El orden de
+// inserción del Map es el orden de uso: se reinserta al leer y se descarta
+// la primera clave al pasar del máximo.
+class CacheConsultas {
+  constructor(ttl, maximo) {
+    this.ttl = ttl;
+    this.maximo = maximo;
+    this.mapa = new Map();
+  }
+
+  vigente(entrada) {
+    return Date.now() - entrada.guardado <= this.ttl;
+  }
+
+  obtener(consulta) {
+    const entrada = this.mapa.get(consulta);
+    if (!entrada) return null;
+    this.mapa.delete(consulta);
+    if (!this.vigente(entrada)) return null;
+    this.mapa.set(consulta, entrada);
+    return entrada;
+  }
+
+  guardar(consulta, usuarios, completo) {
+    this.mapa.delete(consulta);
+    this.mapa.set(consulta, { usuarios, completo, guardado: Date.now() });
+    while (this.mapa.size > this.maximo) this.mapa.delete(this.mapa.keys().next().value);
+  }
+
+  // Resultado completo más específico de una consulta contenida en `consulta`:
+  // sus usuarios incluyen todas las coincidencias de `consulta`
+  superconjunto(consulta) {
+    let mejor = null;
+    for (const [clave, entrada] of this.mapa) {
+      if (entrada.completo && consulta.includes(clave) && this.vigente(entrada)
+          && (!mejor || clave.length > mejor.clave.length)) {
+        mejor = { clave, entrada };
+      }
+    }
+    return mejor && this.obtener(mejor.clave);
+  }
+}
+
+// Mismo criterio que DirectoryIndex.search: subcadena de "nombre email",
+// primero los que empiezan con la consulta y luego por nombre
+function filtrarLocal(usuarios, consulta) {
+  const rango = (u) => {
+    const texto = `${normalizar(nombreBase(u))} ${normalizar(u.email)}`;
+    const empieza = texto.startsWith(consulta) || texto.split(/\s+/).some((p) => p.startsWith(consulta));
+    return { u, texto, rango: empieza ? 0 : 1 };
+  };
+  const porTipo = (tipo) => usuarios
+    .filter((u) => u.type === tipo)
+    .map(rango)
+    .filter((r) => r.texto.includes(consulta))
+    .sort((a, b) => a.rango - b.rango || nombreBase(a.u).localeCompare(nombreBase(b.u)))
+    .map((r) => r.u);
+  return porTipo("user").concat(porTipo("group"));
+}
+
+function mostrar(usuarios, mensaje) {
+  resultados = usuarios;
+  activo = usuarios.length ? 0 : -1;
+  estado.textContent = mensaje !== undefined ? mensaje
+    : usuarios.length ? "" : "No se encontraron usuarios o grupos";
+  lista.replaceChildren(...usuarios.map((u, i) => {
+    const li = document.createElement("li");
+    li.textContent = u.displayName;
+    const email = document.createElement("span");
+    email.className = "email";
+    email.textContent = `(${u.email})`;
+    li.appendChild(email);
+    li.classList.toggle("activo", i === activo);
+    li.addEventListener("mousedown", (evento) => {
+      evento.preventDefault();
+      elegir(i);
+    });
+    return li;
+  }));
+  ajustarAltura();
+}
+
+function marcarActivo(indice) {
+  activo = indice;
+  [...lista.children].forEach((li, i) => li.classList.toggle("activo", i === activo));
+}
+
+function elegir(indice) {
+  const usuario = resultados[indice];
+  if (!usuario) return;
+  entrada.value = usuario.displayName;
+  mostrar([], "");
+  enviar("streamlit:setComponentValue", {
+    value: { displayName: usuario.displayName, email: usuario.email, type: usuario.type, seleccion: Date.now() },
+    dataType: "json",
+  });
+}
+
+async function consultarBackend(consulta, texto) {
+  if (pendiente) pendiente.abort();
+  pendiente = new AbortController();
+  try {
+    const url = `${config.backend_url}/search-users?query=${encodeURIComponent(texto)}`;
+    const respuesta = await fetch(url, { signal: pendiente.signal });
+    if (!respuesta.ok) throw new Error(`Error ${respuesta.status}`);
+    const datos = await respuesta.json();
+    cache.guardar(consulta, datos.users || [], Boolean(datos.completo));
+    // Solo se muestra si el texto no cambió mientras se esperaba
+    if (normalizar(entrada.value).trim() === consulta) mostrar(datos.users || []);
+  } catch (error) {
+    if (error.name !== "AbortError") mostrar([], `❌ Error al buscar usuarios: ${error.message}`);
+  }
+}
+
+function buscar() {
+  clearTimeout(temporizador);
+  const texto = entrada.value.trim();
+  const consulta = normalizar(texto);
+  if (consulta.length < 2) {
+    if (pendiente) pendiente.abort();
+    mostrar([], "");
+    return;
+  }
+
+  const guardado = cache.obtener(consulta);
+  if (guardado) {
+    mostrar(guardado.usuarios);
+    return;
+  }
+  const superconjunto = cache.superconjunto(consulta);
+  if (superconjunto) {
+    const usuarios = filtrarLocal(superconjunto.usuarios, consulta);
+    cache.guardar(consulta, usuarios, true);
+    mostrar(usuarios);
+    return;
+  }
+
+  estado.textContent = "🔍 Buscando...";
+  temporizador = setTimeout(() => consultarBackend(consulta, texto), config.debounce_ms);
+}
+
+entrada.addEventListener("input", buscar);
+entrada.addEventListener("keydown", (evento) => {
+  if (!resultados.length) return;
+  if (evento.key === "ArrowDown") {
+    marcarActivo((activo + 1) % resultados.length);
+  } else if (evento.key === "ArrowUp") {
+    marcarActivo((activo - 1 + resultados.length) % resultados.length);
+  } else if (evento.key === "Enter") {
+    elegir(activo);
+  } else if (evento.key === "Escape") {
+    mostrar([], "");
+  } else {
+    return;
+  }
+  evento.preventDefault();
+});
+
+function aplicarTema(tema) {
+  if (!tema) return;
+  const raiz = document.documentElement.style;
+  raiz.setProperty("--primario", tema.primaryColor);
+  raiz.setProperty("--texto", tema.textColor);
+  raiz.setProperty("--fondo", tema.secondaryBackgroundColor);
+}
+
+window.addEventListener("message", (evento) => {
+  if (evento.data.type !== "streamlit:render") return;
+  const args = evento.data.args;
+  aplicarTema(evento.data.theme);
+  if (!config) {
+    cache = new CacheConsultas(args.ttl_ms, args.max_consultas);
+    entrada.placeholder = args.placeholder || "";
+  }
+  config = args;
+  ajustarAltura();
+});
+
+enviar("streamlit:componentReady", { apiVersion: 1 });
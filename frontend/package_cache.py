@@ -0,0 +1,143 @@
+"""
+Cache de paquetes compartido por todas las sesiones del Dashboard.
+
+Antes cada pestaña del navegador descargaba el historial completo a su
+propio st.session_state: con N sesiones abiertas el proceso de Streamlit
+guardaba N copias. Ahora hay un único PackageStore por proceso
+(st.cache_resource) y las sesiones solo leen su Snapshot.
+
+- Un Snapshot es inmutable: paquetes (tupla de PackageRecord, ver
+  package_record.py), posiciones por Id, índice de códigos de retiro y el cursor de /packages/changes con que se armó.
+- Sincronizar arma un Snapshot nuevo y lo publica con una sola asignación
+  (copy-on-write). Las lecturas no toman lock: una sesión que está
+  dibujando con el Snapshot anterior no se bloquea ni ve un estado a medias.
+- Los Snapshots comparten los registros de los paquetes que no cambiaron; la
+  tupla y los índices se copian al publicar (O(n) punteros por cambio, no
+  por sesión). Las sesiones no deben modificar los paquetes.
+- Solo un hilo sincroniza a la vez; las demás sesiones siguen con el
+  Snapshot vigente en vez de esperar. La consulta al backend (versión por
+  cursor) se hace como máximo cada PACKAGE_CACHE_SYNC_SECONDS segundos,
+  salvo que se fuerce después de registrar o retirar.
+- columnas() entrega la vista NumPy del Snapshot (package_columns.py) para
+  los filtros por fecha y estado; se arma una vez por Snapshot.
+"""
+import os
+import threading
+import time
+from typing import Dict, NamedTuple, Tuple
+
+import requests
+import streamlit as st
+
+from chatbot_helper import normalizar_codigo
+from package_columns import ColumnasPaquetes
+from package_record import PackageRecord
+
+PACKAGE_CACHE_SYNC_SECONDS = float(os.getenv("PACKAGE_CACHE_SYNC_SECONDS", "5"))
+
+class Snapshot(NamedTuple):
+    paquetes: Tuple[PackageRecord, ...]
+    posiciones: Dict[int, int]        # Id -> posición en paquetes
+    indice_codigos: Dict[str, int]    # código de retiro normalizado -> posición
+    cursor: int
+
+SNAPSHOT_VACIO = Snapshot((), {}, {}, 0)
+
+class PackageStore:
+    def __init__(self, backend_url: str, intervalo: float = PACKAGE_CACHE_SYNC_SECONDS):
+        self.backend_url = backend_url
+        self.intervalo = intervalo
+        self._snapshot = SNAPSHOT_VACIO
+        self._lock = threading.Lock()  # solo lo toma quien sincroniza
+        self._ultima_consulta = float('-inf')
+        self._columnas = (None, None)  # (Snapshot, ColumnasPaquetes)
+
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    def columnas(self, snapshot: Snapshot) -> ColumnasPaquetes:
+        """Vista columnar de `snapshot`; la del Snapshot vigente se comparte entre sesiones."""
+        base, columnas = self._columnas
+        if base is not snapshot:
+            columnas = ColumnasPaquetes(snapshot.paquetes)
+            if snapshot is self._snapshot:
+                self._columnas = (snapshot, columnas)
+        return columnas
+
+    def sincronizar(self, forzar: bool = False) -> Snapshot:
+        """
+        Trae los cambios desde el cursor del Snapshot vigente y publica uno
+        nuevo si hubo. Sin `forzar`, no consulta si la última consulta fue
+        hace menos de `intervalo` segundos ni espera a otra sincronización
+        en curso (salvo la primera carga del proceso, cuando todavía no hay
+        paquetes que mostrar). Retorna el Snapshot vigente.
+        """
+        if not forzar and self._reciente():
+            return self._snapshot
+        if not self._lock.acquire(blocking=forzar or not self._snapshot.paquetes):
+            return self._snapshot
+        try:
+            # Quien esperaba la primera carga no vuelve a consultar
+            if forzar or not self._reciente():
+                self._snapshot = self._traer_cambios(self._snapshot)
+        except Exception as e:
+            print(f"⚠️  No se pudo sincronizar el historial: {e}")
+        finally:
+            self._ultima_consulta = time.monotonic()
+            self._lock.release()
+        return self._snapshot
+
+    def _reciente(self) -> bool:
+        return time.monotonic() - self._ultima_consulta < self.intervalo
+
+    def _traer_cambios(self, base: Snapshot) -> Snapshot:
+        cambios = {}
+        cursor = base.cursor
+        while True:
+            response = requests.get(
+                f"{self.backend_url}/packages/changes",
+                params={"since": cursor},
+                timeout=10
+            )
+            if response.status_code != 200:
+                break
+            data = response.json()
+
+            if data.get('reset'):
+                # La base del backend fue recreada: empezar de cero
+                base, cambios, cursor = SNAPSHOT_VACIO, {}, 0
+                continue
+
+            for pkg in data.get('packages', []):
+                cambios[pkg['Id']] = pkg
+            cursor = data.get('cursor', cursor)
+            if not data.get('has_more'):
+                break
+
+        if not cambios:
+            return base if cursor == base.cursor else base._replace(cursor=cursor)
+        return _aplicar(base, cambios, cursor)
+
+def _aplicar(base: Snapshot, cambios: Dict[int, dict], cursor: int) -> Snapshot:
+    """Snapshot nuevo con `cambios` (Id -> paquete) mezclados sobre `base`, sin tocar `base`."""
+    paquetes = list(base.paquetes)
+    posiciones = dict(base.posiciones)
+    indice = dict(base.indice_codigos)
+    for package_id, pkg in cambios.items():
+        registro = PackageRecord.desde_api(pkg)
+        pos = posiciones.get(package_id)
+        if pos is None:
+            pos = posiciones[package_id] = len(paquetes)
+            paquetes.append(registro)
+        else:
+            anterior = normalizar_codigo(paquetes[pos].codigo_retiro)
+            if indice.get(anterior) == pos:
+                del indice[anterior]
+            paquetes[pos] = registro
+        indice[normalizar_codigo(registro.codigo_retiro)] = pos
+    return Snapshot(tuple(paquetes), posiciones, indice, cursor)
+
+@st.cache_resource(show_spinner=False)
+def obtener_store(backend_url: str) -> PackageStore:
+    """El PackageStore del proceso (uno por backend), compartido por todas las sesiones."""
+    return PackageStore(backend_url)
@@ -0,0 +1,87 @@
+"""
+Vista columnar (NumPy) del historial para filtrar por fecha y estado.
+
+Filtrar los paquetes de hoy, de ayer o de los últimos días recorría la
+tupla de PackageRecord con una comprensión de lista por filtro y por rerun.
+ColumnasPaquetes guarda los campos que se filtran como arreglos:
+
+- fecha: datetime64[D] (NaT si el paquete no tiene fecha)
+- estado, sucursal, tipo: códigos enteros de categoría (int32) más la
+  lista de categorías
+
+y conjuntos(hoy) calcula todos los filtros del día con máscaras
+vectorizadas a partir de una sola resta de fechas. Retorna posiciones en
+la tupla del Snapshot, en orden ascendente (el orden de llegada).
+
+Las columnas se arman una vez por Snapshot (PackageStore.columnas) y los
+conjuntos una vez por día, así que todas las sesiones reusan el mismo
+cálculo hasta que llegan cambios del backend.
+"""
+from datetime import date
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from package_record import PackageRecord
+
+_EPOCA = date(1970, 1, 1).toordinal()
+_NAT = np.iinfo(np.int64).min  # representación entera de NaT
+
+# Días sin retirar desde los que un paquete se marca como urgente
+DIAS_URGENTE = 3
+
+def _categorias(valores) -> Tuple[np.ndarray, List[str]]:
+    """Códigos int32 por valor y la lista de categorías (código = posición)."""
+    mapa: Dict[str, int] = {}
+    codigos = np.fromiter((mapa.setdefault(v, len(mapa)) for v in valores), dtype=np.int32)
+    return codigos, list(mapa)
+
+class ColumnasPaquetes:
+    def __init__(self, paquetes: Sequence[PackageRecord]):
+        self.n = len(paquetes)
+        # Días desde 1970-01-01 vistos como datetime64[D]; np.array() con objetos date es ~15x más lento
+        self.fecha = np.fromiter(
+            (p.fecha_recepcion.toordinal() - _EPOCA if p.fecha_recepcion else _NAT for p in paquetes),
+            dtype=np.int64, count=self.n,
+        ).view("datetime64[D]")
+        self.estado, self.estados = _categorias(p.estado for p in paquetes)
+        self.sucursal, self.sucursales = _categorias(p.sucursal for p in paquetes)
+        self.tipo, self.tipos = _categorias(p.tipo_documento for p in paquetes)
+        self._conjuntos: Dict[date, Dict[str, np.ndarray]] = {}
+
+    def mascara(self, columna: str, valor: str) -> np.ndarray:
+        """Máscara booleana de `columna` (estado, sucursal o tipo) igual a `valor`."""
+        categorias = {"estado": self.estados, "sucursal": self.sucursales, "tipo": self.tipos}[columna]
+        if valor not in categorias:
+            return np.zeros(self.n, dtype=bool)
+        return getattr(self, columna) == categorias.index(valor)
+
+    def conjuntos(self, hoy: date) -> Dict[str, np.ndarray]:
+        """
+        Posiciones de los paquetes de hoy, pendientes y retirados de hoy,
+        de ayer, de los últimos 7 y 30 días y urgentes (sin retirar hace
+        más de DIAS_URGENTE días). Se calcula una vez por día.
+        """
+        conjuntos = self._conjuntos.get(hoy)
+        if conjuntos is not None:
+            return conjuntos
+
+        # Días desde la recepción; NaT queda fuera de todas las comparaciones
+        dias = np.datetime64(hoy, "D") - self.fecha
+        con_fecha = ~np.isnat(dias)
+        dias = np.where(con_fecha, dias.astype(np.int64), -1)
+        retirado = self.mascara("estado", "Retirado")
+
+        de_hoy = dias == 0
+        conjuntos = {
+            "hoy": de_hoy,
+            "pendientes_hoy": de_hoy & ~retirado,
+            "retirados_hoy": de_hoy & retirado,
+            "ayer": dias == 1,
+            "ultimos_7": con_fecha & (dias <= 7),
+            "ultimos_30": con_fecha & (dias <= 30),
+            "urgentes": ~retirado & (dias > DIAS_URGENTE),
+        }
+        conjuntos = {nombre: np.flatnonzero(m) for nombre, m in conjuntos.items()}
+        self._conjuntos = {hoy: conjuntos}  # solo el día vigente
+        return conjuntos
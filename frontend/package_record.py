@@ -0,0 +1,109 @@
+"""
+Registro de paquete normalizado del frontend.
+
+La API entrega los paquetes como dicts con claves PascalCase (CodigoRetiro)
+y el formato antiguo del frontend usaba camelCase (codigoRetiro); leer cada
+campo probando ambas claves costaba varias búsquedas por campo y por
+paquete en cada rerun. PackageRecord se arma una sola vez al recibir el
+paquete (package_cache.py, búsquedas en el backend) y después los campos se
+leen como atributos:
+
+    registro = PackageRecord.desde_api(pkg)
+    registro.codigo_retiro, registro.fecha_recepcion  # 'PK-251128-0001', date(2025, 11, 28)
+
+- Usa __slots__: sin __dict__ por instancia, menos memoria con el historial
+  completo en el cache compartido.
+- Los textos vacíos o ausentes quedan como ""; las fechas y horas vacías o
+  con formato inválido quedan como None.
+- Es de solo lectura por convención: los registros se comparten entre
+  sesiones.
+"""
+from datetime import date, datetime, time as dtime
+from typing import Any, Dict, Optional
+
+def _fecha(valor) -> Optional[date]:
+    try:
+        return date.fromisoformat(valor[:10]) if valor else None
+    except (TypeError, ValueError):
+        return None
+
+def _hora(valor) -> Optional[dtime]:
+    try:
+        return dtime.fromisoformat(valor) if valor else None
+    except (TypeError, ValueError):
+        return None
+
+def _fecha_hora(valor) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(valor) if valor else None
+    except (TypeError, ValueError):
+        return None
+
+def _texto(valor) -> str:
+    return "" if valor is None else str(valor)
+
+# atributo -> (clave de la API, conversión)
+_CAMPOS: Dict[str, tuple] = {
+    "id": ("Id", lambda v: v),
+    "codigo_retiro": ("CodigoRetiro", _texto),
+    "fecha_recepcion": ("FechaRecepcion", _fecha),
+    "hora_recepcion": ("HoraRecepcion", _hora),
+    "sucursal": ("Sucursal", _texto),
+    "recepcionista": ("Recepcionista", _texto),
+    "proveedor": ("Proveedor", _texto),
+    "tipo_documento": ("TipoDocumento", _texto),
+    "numero_documento": ("NumeroDocumento", _texto),
+    "destinatario_nombre": ("DestinatarioNombre", _texto),
+    "destinatario_email": ("DestinatarioEmail", _texto),
+    "medio_notificacion": ("MedioNotificacion", _texto),
+    "estado": ("Estado", lambda v: v or "Pendiente"),
+    "fecha_notificacion": ("FechaNotificacion", _fecha_hora),
+    "destinatario_confirmo": ("DestinatarioConfirmo", _texto),
+    "fecha_retiro": ("FechaRetiro", _fecha_hora),
+    "entregado_a": ("EntregadoA", _texto),
+    "observaciones": ("Observaciones", _texto),
+    "adjunto_url": ("AdjuntoUrl", _texto),
+    "monto_cheque": ("MontoCheque", _texto),
+    "fecha_vencimiento_cheque": ("FechaVencimientoCheque", _fecha),
+    "imagen_path": ("ImagenPath", _texto),
+}
+
+# Claves camelCase del formato antiguo (CodigoRetiro -> codigoRetiro)
+_CLAVES = tuple(
+    (atributo, clave, clave[0].lower() + clave[1:], convertir)
+    for atributo, (clave, convertir) in _CAMPOS.items()
+)
+
+class PackageRecord:
+    __slots__ = tuple(_CAMPOS)
+
+    @classmethod
+    def desde_api(cls, pkg: Dict[str, Any]) -> "PackageRecord":
+        """Normaliza un paquete de la API (PascalCase) o del formato camelCase."""
+        registro = cls.__new__(cls)
+        for atributo, clave, clave_camel, convertir in _CLAVES:
+            valor = pkg.get(clave)
+            if valor is None or valor == "":
+                valor = pkg.get(clave_camel)
+            setattr(registro, atributo, convertir(valor))
+        return registro
+
+    def __getstate__(self):
+        return tuple(getattr(self, atributo) for atributo in self.__slots__)
+
+    def __setstate__(self, estado):
+        for atributo, valor in zip(self.__slots__, estado):
+            setattr(self, atributo, valor)
+
+    def __repr__(self):
+        return f"PackageRecord({self.id!r}, {self.codigo_retiro!r}, {self.estado!r})"
+
+def mostrar(valor, vacio: str = "N/A") -> str:
+    """Texto para mostrar un campo: fechas 'YYYY-MM-DD', horas 'HH:MM:SS' y `vacio` si no hay valor."""
+    if valor is None or valor == "":
+        return vacio
+    if isinstance(valor, datetime):
+        return valor.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(valor, dtime):
+        return valor.strftime("%H:%M:%S")
+    return str(valor)
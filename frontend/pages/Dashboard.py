@@ -2,9 +2,11 @@ import os
 import requests
 import streamlit as st
 from datetime import datetime, timedelta
-import random
-import string
-from chatbot_helper import chatbot_inteligente
+from urllib.parse import quote
+from chatbot_helper import chatbot_inteligente, normalizar_codigo
+from package_cache import obtener_store
+from package_record import PackageRecord, mostrar
+from components.buscador_destinatario import buscador_destinatario
 import locale
 from auth import is_authenticated, get_current_user, logout
 
@@ -42,21 +44,143 @@ def get_chile_time():
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
-# Función para cargar paquetes del backend
-def cargar_paquetes_desde_backend():
+# Historial de paquetes: un único cache por proceso, compartido por todas las
+# sesiones (package_cache.py). Cada sesión guarda solo el cursor.
+def sincronizar_paquetes(forzar=False):
+    """
+    Trae del backend los paquetes creados o modificados desde el último
+    cursor (/packages/changes) al cache compartido. Sin `forzar` consulta
+    como máximo cada PACKAGE_CACHE_SYNC_SECONDS; después de registrar o
+    retirar se fuerza para ver el cambio de inmediato.
+    """
+    snapshot = obtener_store(BACKEND_URL).sincronizar(forzar)
+    st.session_state['historial_cursor'] = snapshot.cursor
+    return snapshot
+
+def conjuntos_del_dia(hoy):
+    """
+    Paquetes del Snapshot vigente y las posiciones de los de hoy, ayer,
+    últimos 7/30 días, etc. (ver package_columns.py), calculadas con NumPy
+    una vez por Snapshot y día para todas las sesiones.
+    """
+    store = obtener_store(BACKEND_URL)
+    snapshot = store.snapshot()
+    return snapshot.paquetes, store.columnas(snapshot).conjuntos(hoy)
+
+def buscar_paquete_por_codigo(codigo):
+    """
+    Busca un paquete por código en el historial compartido (O(1) vía el
+    índice de códigos del Snapshot) y, si no está, en el backend
+    (/packages/{codigo}). Retorna None si no existe.
+    """
+    snapshot = obtener_store(BACKEND_URL).snapshot()
+    pos = snapshot.indice_codigos.get(normalizar_codigo(codigo))
+    if pos is not None:
+        return snapshot.paquetes[pos]
+    try:
+        response = requests.get(f"{BACKEND_URL}/packages/{quote(normalizar_codigo(codigo), safe='')}", timeout=10)
+        if response.status_code == 200:
+            return PackageRecord.desde_api(response.json())
+    except requests.RequestException:
+        pass
+    return None
+
+@st.cache_data(ttl=60, show_spinner=False)
+def obtener_estadisticas(fecha_desde, fecha_hasta, sucursales, cursor_datos):
+    """
+    Agregados de la pestaña Reportes calculados por el backend (/stats).
+    `cursor_datos` (el cursor de sincronización) solo forma parte de la clave
+    de cache: cambia tras registrar o retirar y fuerza a recalcular.
+    Retorna None si el backend no responde.
+    """
+    params = {"fecha_desde": fecha_desde.isoformat(), "fecha_hasta": fecha_hasta.isoformat()}
+    if sucursales:
+        params["sucursal"] = list(sucursales)
+    try:
+        response = requests.get(f"{BACKEND_URL}/stats", params=params, timeout=10)
+        if response.status_code == 200:
+            return response.json()
+    except requests.RequestException:
+        pass
+    return None
+
+@st.cache_data(ttl=60, show_spinner=False)
+def obtener_vencidos(cursor_datos):
+    """
+    Paquetes sin retirar hace más de REMINDER_MIN_DAYS días según el backend
+    (/reminders), con el estado de los recordatorios automáticos. Igual que
+    obtener_estadisticas, `cursor_datos` solo forma parte de la clave de cache.
+    Retorna None si el backend no responde.
+    """
+    try:
+        response = requests.get(f"{BACKEND_URL}/reminders", timeout=10)
+        if response.status_code == 200:
+            return response.json()
+    except requests.RequestException:
+        pass
+    return None
+
+# Plantilla CSV del registro masivo (mismos campos que /register; codigoRetiro lo asigna el backend)
+PLANTILLA_REGISTRO_MASIVO = (
+    "sucursal,recepcionista,proveedor,tipoDocumento,numeroDocumento,destinatarioNombre,"
+    "destinatarioEmail,medioNotificacion,observaciones,montoCheque,fechaVencimientoCheque\n"
+    "Santiago,Rudth Nuñez,Chilexpress,Factura,12345,Victor Arriagada,varriagada@multiaceros.cl,Correo,,,\n"
+)
+
+# Máximo de resultados de búsqueda que se listan en Historial
+HISTORIAL_LIMITE_BUSQUEDA = 200
+# Filas por página de la tabla de Historial
+HISTORIAL_POR_PAGINA = 25
+
+@st.cache_data(ttl=30, show_spinner=False)
+def buscar_paquetes(texto, fecha_desde, limite, cursor_datos):
+    """
+    Búsqueda de texto completo en el backend (/search): código, destinatario,
+    documento, proveedor u observaciones, sin distinguir tildes y ordenada por
+    relevancia. `cursor_datos` solo forma parte de la clave de cache.
+    Retorna {"packages": [PackageRecord, ...], "total": n} o None si el backend no responde.
+    """
+    params = {"q": texto, "limit": limite}
+    if fecha_desde:
+        params["fecha_desde"] = fecha_desde
     try:
-        response = requests.get(f"{BACKEND_URL}/packages", timeout=5)
+        response = requests.get(f"{BACKEND_URL}/search", params=params, timeout=10)
         if response.status_code == 200:
             data = response.json()
-            return data.get('packages', [])
-    except:
+            data['packages'] = [PackageRecord.desde_api(p) for p in data['packages']]
+            return data
+    except requests.RequestException:
+        pass
+    return None
+
+# formato de /export -> (etiqueta, MIME)
+FORMATOS_EXPORTACION = {
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "text/csv"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+}
+
+def descargar_exportacion(formato, fecha_desde, fecha_hasta, sucursales):
+    """
+    Descarga el archivo generado por el backend (/export) con los filtros de
+    Reportes. Solo se llama al presionar el botón. Retorna None si falla.
+    """
+    params = {"formato": formato, "fecha_desde": fecha_desde.isoformat(), "fecha_hasta": fecha_hasta.isoformat()}
+    if sucursales:
+        params["sucursal"] = list(sucursales)
+    try:
+        with requests.get(f"{BACKEND_URL}/export", params=params, stream=True, timeout=300) as response:
+            if response.status_code == 200:
+                return b"".join(response.iter_content(chunk_size=64 * 1024))
+    except requests.RequestException:
         pass
-    return []
+    return None
+
+# Traer los cambios al cache compartido (la primera sesión del proceso
+# descarga el historial completo; luego solo se piden los cambios)
+sincronizar_paquetes()
 
 # Inicializar session_state
-if 'historial' not in st.session_state:
-    # Cargar datos del Excel al iniciar
-    st.session_state['historial'] = cargar_paquetes_desde_backend()
 if 'ultimo_registro' not in st.session_state:
     st.session_state['ultimo_registro'] = None
 if 'chat_history' not in st.session_state:
@@ -535,25 +659,20 @@ with st.sidebar:
 
     st.markdown("---")
 
-    # Filtrar paquetes del día actual
-    from collections import Counter
-    hoy = get_chile_time().strftime("%Y-%m-%d")
-    paquetes_hoy = [
-        p for p in st.session_state['historial']
-        if (p.get('FechaRecepcion') or p.get('fechaRecepcion', '')).startswith(hoy)
-    ]
-
-    # Métricas principales
-    pendientes_hoy = [p for p in paquetes_hoy if (p.get('Estado') or p.get('estado', 'Pendiente')) != "Retirado"]
-    retirados_hoy = [p for p in paquetes_hoy if (p.get('Estado') or p.get('estado', 'Pendiente')) == "Retirado"]
+    # Métricas del día desde el rollup diario del backend (/stats)
+    hoy_fecha = get_chile_time().date()
+    stats_hoy = obtener_estadisticas(hoy_fecha, hoy_fecha, (), st.session_state.get('historial_cursor', 0)) or {}
+    total_hoy = stats_hoy.get('total', 0)
+    pendientes_hoy = stats_hoy.get('pendientes', 0)
+    retirados_hoy = stats_hoy.get('retirados', 0)
 
     col_met1, col_met2, col_met3 = st.columns(3)
     with col_met1:
-        st.metric("📦 Total Hoy", len(paquetes_hoy))
+        st.metric("📦 Total Hoy", total_hoy)
     with col_met2:
-        st.metric("⏳ Pendientes", len(pendientes_hoy), delta=None, delta_color="off")
+        st.metric("⏳ Pendientes", pendientes_hoy, delta=None, delta_color="off")
     with col_met3:
-        st.metric("✅ Retirados", len(retirados_hoy), delta=None, delta_color="normal")
+        st.metric("✅ Retirados", retirados_hoy, delta=None, delta_color="normal")
 
     # Búsqueda rápida global
     st.markdown("---")
@@ -566,29 +685,20 @@ with st.sidebar:
     )
 
     if busqueda_global and len(busqueda_global) >= 2:
-        busqueda_lower = busqueda_global.lower()
-        resultados = []
-
-        for p in st.session_state['historial']:
-            codigo = (p.get('CodigoRetiro') or p.get('codigoRetiro', '')).lower()
-            destinatario = (p.get('DestinatarioNombre') or p.get('destinatarioNombre', '')).lower()
-            numero_doc = (p.get('NumeroDocumento') or p.get('numeroDocumento', '')).lower()
-
-            if (busqueda_lower in codigo or
-                busqueda_lower in destinatario or
-                busqueda_lower in numero_doc):
-                resultados.append(p)
-
-        if resultados:
-            st.success(f"✅ {len(resultados)} resultado(s)")
-            for r in resultados[:3]:  # Mostrar máximo 3
-                codigo = r.get('CodigoRetiro') or r.get('codigoRetiro', 'N/A')
-                dest = r.get('DestinatarioNombre') or r.get('destinatarioNombre', 'N/A')
-                estado = r.get('Estado') or r.get('estado', 'Pendiente')
+        busqueda = buscar_paquetes(busqueda_global, None, 3, st.session_state.get('historial_cursor', 0))
+
+        if busqueda is None:
+            st.error("❌ No se pudo realizar la búsqueda")
+        elif busqueda['total']:
+            st.success(f"✅ {busqueda['total']} resultado(s)")
+            for r in busqueda['packages']:  # Los 3 más relevantes
+                codigo = r.codigo_retiro or 'N/A'
+                dest = r.destinatario_nombre or 'N/A'
+                estado = r.estado
                 emoji = "✅" if estado == "Retirado" else "📦"
                 st.caption(f"{emoji} **{codigo}**\n{dest[:25]}...")
-            if len(resultados) > 3:
-                st.caption(f"_+{len(resultados)-3} más_")
+            if busqueda['total'] > 3:
+                st.caption(f"_+{busqueda['total']-3} más_")
         else:
             st.warning("No se encontraron resultados")
 
@@ -596,75 +706,63 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### ⚠️ Alertas")
 
-    # Calcular paquetes urgentes (más de 3 días sin retirar)
-    from datetime import datetime, timedelta
-    hoy_dt = get_chile_time()
-    hace_3_dias = (hoy_dt - timedelta(days=3)).strftime("%Y-%m-%d")
-
-    paquetes_urgentes = []
-    paquetes_ayer = []
-
-    for p in st.session_state['historial']:
-        estado = p.get('Estado') or p.get('estado', 'Pendiente')
-        fecha_rec = p.get('FechaRecepcion') or p.get('fechaRecepcion', '')
-
-        if estado != "Retirado":
-            if fecha_rec < hace_3_dias:
-                paquetes_urgentes.append(p)
-            elif fecha_rec.startswith((hoy_dt - timedelta(days=1)).strftime("%Y-%m-%d")):
-                paquetes_ayer.append(p)
+    # Paquetes vencidos (consulta indexada en el backend) y pendientes de ayer (rollup diario)
+    cursor_datos = st.session_state.get('historial_cursor', 0)
+    vencidos_info = obtener_vencidos(cursor_datos) or {}
+    vencidos = vencidos_info.get('vencidos', {})
+    urgentes = vencidos.get('total', 0)
+    ayer_fecha = hoy_fecha - timedelta(days=1)
+    pendientes_ayer = (obtener_estadisticas(ayer_fecha, ayer_fecha, (), cursor_datos) or {}).get('pendientes', 0)
 
     # Mostrar alertas
-    if paquetes_urgentes:
-        st.error(f"🚨 **{len(paquetes_urgentes)}** paquete(s) urgente(s)")
-        st.caption("Sin retirar hace más de 3 días")
-        for p in paquetes_urgentes[:2]:
-            dest = (p.get('DestinatarioNombre') or p.get('destinatarioNombre', 'N/A'))[:20]
-            st.caption(f"• {dest}...")
-
-    if paquetes_ayer:
-        st.warning(f"⏰ **{len(paquetes_ayer)}** de ayer sin retirar")
-
-    if not paquetes_urgentes and not paquetes_ayer and pendientes_hoy == 0:
+    if urgentes:
+        st.error(f"🚨 **{urgentes}** paquete(s) urgente(s)")
+        st.caption(f"Sin retirar hace más de {vencidos.get('dias', 3)} días")
+        for nombre, cantidad in vencidos.get('destinatarios', [])[:2]:
+            st.caption(f"• {nombre[:20]}... ({cantidad})")
+        if vencidos_info.get('proxima_ejecucion'):
+            st.caption(f"⏰ Próximo recordatorio automático: {vencidos_info['proxima_ejecucion'].replace('T', ' ')}")
+
+    if pendientes_ayer:
+        st.warning(f"⏰ **{pendientes_ayer}** de ayer sin retirar")
+
+    if not urgentes and not pendientes_ayer and pendientes_hoy == 0:
         st.success("✅ Sin alertas")
-    elif not paquetes_urgentes and not paquetes_ayer:
+    elif not urgentes and not pendientes_ayer:
         st.info("📋 Todo al día")
 
-    if paquetes_hoy:
+    if total_hoy:
         st.markdown("---")
 
         # Estadísticas por tipo de documento
         st.markdown("**📄 Por Tipo:**")
-        tipos = [p.get('TipoDocumento') or p.get('tipoDocumento', 'Otro') for p in paquetes_hoy]
-        tipo_contador = Counter(tipos)
-
-        for tipo, count in tipo_contador.most_common(3):  # Top 3 tipos
-            porcentaje = (count / len(paquetes_hoy)) * 100
+        for tipo, count in stats_hoy.get('por_tipo', [])[:3]:  # Top 3 tipos
+            porcentaje = (count / total_hoy) * 100
             st.markdown(f"• **{tipo}**: {count} ({porcentaje:.0f}%)")
 
         st.markdown("---")
 
         # Estadísticas por sucursal
         st.markdown("**📍 Por Sucursal:**")
-        sucursales = [p.get('Sucursal') or p.get('sucursal', 'N/A') for p in paquetes_hoy]
-        sucursal_contador = Counter(sucursales)
-
-        for sucursal, count in sucursal_contador.most_common(3):  # Top 3 sucursales
-            porcentaje = (count / len(paquetes_hoy)) * 100
+        for sucursal, count in stats_hoy.get('por_sucursal', [])[:3]:  # Top 3 sucursales
+            porcentaje = (count / total_hoy) * 100
             st.markdown(f"• **{sucursal}**: {count} ({porcentaje:.0f}%)")
 
         st.markdown("---")
 
-        # Última recepción
-        ultimo = paquetes_hoy[-1]
-        hora_ultima = ultimo.get('HoraRecepcion') or ultimo.get('horaRecepcion', 'N/A')
-        dest_ultimo = ultimo.get('DestinatarioNombre') or ultimo.get('destinatarioNombre', 'N/A')
+    # Última recepción: las posiciones de conjuntos['hoy'] vienen en el orden
+    # del Snapshot compartido (orden de llegada), así que la última es la más reciente
+    historial, conjuntos = conjuntos_del_dia(hoy_fecha)
+    ultimo = historial[conjuntos['hoy'][-1]] if len(conjuntos['hoy']) else None
+    if ultimo:
+        hora_ultima = ultimo.hora_recepcion
+        dest_ultimo = ultimo.destinatario_nombre or 'N/A'
 
         # Calcular tiempo desde última recepción
         try:
             from datetime import datetime, timedelta
             hora_actual = get_chile_time()
-            hora_recepcion = datetime.strptime(f"{hoy} {hora_ultima}", "%Y-%m-%d %H:%M:%S")
+            hora_recepcion = datetime.combine(hoy_fecha, hora_ultima)
             diferencia = hora_actual - hora_recepcion
             minutos = int(diferencia.total_seconds() / 60)
 
@@ -674,7 +772,7 @@ with st.sidebar:
                 horas = minutos // 60
                 tiempo_texto = f"Hace {horas}h {minutos % 60}min"
         except:
-            tiempo_texto = hora_ultima
+            tiempo_texto = mostrar(hora_ultima)
 
         st.markdown(f"**⏰ Última recepción:**")
         st.markdown(f"{tiempo_texto}")
@@ -692,91 +790,24 @@ with tab1:
     # Buscador de usuarios FUERA del formulario
     st.markdown("### 🔍 Buscar Destinatario")
 
-    col_search, col_clear = st.columns([4, 1])
-    with col_search:
-        busqueda_usuario = st.text_input(
-            "Buscar por nombre o email",
-            placeholder="Ej: Victor, Cobranzas, varriagada@multiaceros.cl",
-            key="busqueda_usuario_pre",
-            help="Busca usuarios y grupos en tu organización de Microsoft 365",
-            label_visibility="collapsed"
-        )
-
-    # Si hay texto de búsqueda, realizar la consulta
-    if busqueda_usuario and len(busqueda_usuario) >= 2:
-        # Detectar si el texto de búsqueda cambió → limpiar autocompletado anterior y buscar
-        if st.session_state.get('busqueda_anterior') != busqueda_usuario:
-            st.session_state['nombre_autocompletado'] = ""
-            st.session_state['email_autocompletado'] = ""
-            st.session_state['busqueda_anterior'] = busqueda_usuario
-            st.session_state['necesita_buscar'] = True  # Marcar que necesita buscar
-
-        # Solo buscar si es necesario (no después de seleccionar usuario)
-        if st.session_state.get('necesita_buscar', True):
-            with st.spinner("🔍 Buscando..."):
-                try:
-                    response = requests.get(
-                        f"{BACKEND_URL}/search-users",
-                        params={"query": busqueda_usuario},
-                        timeout=4  # Balance entre velocidad y confiabilidad
-                    )
-                    if response.status_code == 200:
-                        data = response.json()
-                        usuarios_encontrados = data.get("users", [])
-
-                        # Guardar en session_state para que esté disponible en callback
-                        st.session_state['usuarios_busqueda'] = usuarios_encontrados
-
-                        if not usuarios_encontrados:
-                            st.session_state['usuarios_busqueda'] = []
-                    else:
-                        st.error(f"❌ Error al buscar usuarios: {response.status_code}")
-                        st.session_state['usuarios_busqueda'] = []
-                except Exception as e:
-                    st.error(f"❌ Error de conexión: {str(e)}")
-                    st.session_state['usuarios_busqueda'] = []
+    # La búsqueda corre en el navegador (components/buscador_destinatario):
+    # escribir no ejecuta el script; solo al elegir un resultado hay rerun
+    st.caption("Busca usuarios y grupos en tu organización de Microsoft 365")
+    seleccionado = buscador_destinatario(
+        placeholder="Ej: Victor, Cobranzas, varriagada@multiaceros.cl",
+        key="buscador_destinatario"
+    )
 
-            # Marcar que ya se buscó
-            st.session_state['necesita_buscar'] = False
-    else:
-        # Si no hay búsqueda, limpiar resultados
-        st.session_state['usuarios_busqueda'] = []
-        st.session_state['busqueda_anterior'] = ""
-        st.session_state['necesita_buscar'] = True
-
-    # Mostrar resultados y permitir selección
-    usuarios_encontrados = st.session_state.get('usuarios_busqueda', [])
-    if usuarios_encontrados:
-        # Crear opciones para el selectbox
-        opciones_display = ["-- Seleccionar usuario --"] + [f"{u['displayName']} ({u['email']})" for u in usuarios_encontrados]
-
-        # Callback para autocompletar
-        def autocompletar_campos():
-            sel_idx = st.session_state.get('user_select_dropdown_idx', 0)
-            usuarios = st.session_state.get('usuarios_busqueda', [])
-            if sel_idx > 0 and usuarios:
-                selected = usuarios[sel_idx - 1]
-                st.session_state['nombre_autocompletado'] = selected['displayName']
-                st.session_state['email_autocompletado'] = selected['email']
-
-        # Selectbox con índices
-        seleccion_idx = st.selectbox(
-            "Selecciona un usuario para autocompletar",
-            range(len(opciones_display)),
-            format_func=lambda x: opciones_display[x],
-            key="user_select_dropdown_idx",
-            on_change=autocompletar_campos
-        )
+    # El componente conserva su último valor entre reruns: solo una elección
+    # nueva (otra marca `seleccion`) autocompleta los campos del formulario,
+    # antes de crearlos
+    if seleccionado and seleccionado.get('seleccion') != st.session_state.get('seleccion_destinatario'):
+        st.session_state['seleccion_destinatario'] = seleccionado['seleccion']
+        st.session_state['destinatario_nombre_input'] = seleccionado['displayName']
+        st.session_state['destinatario_email_input'] = seleccionado['email']
 
     st.divider()
 
-    # ACTUALIZAR valores de autocompletado ANTES del formulario
-    # Esto asegura que los campos se llenen cuando se selecciona un usuario
-    if st.session_state.get('nombre_autocompletado'):
-        st.session_state['destinatario_nombre_input'] = st.session_state['nombre_autocompletado']
-    if st.session_state.get('email_autocompletado'):
-        st.session_state['destinatario_email_input'] = st.session_state['email_autocompletado']
-
     with st.form("form_paquete", clear_on_submit=False):
         # Sección de Información General
         st.markdown("### 🏢 Información General")
@@ -845,20 +876,54 @@ with tab1:
         with col2:
             submitted = st.form_submit_button("✅ Registrar y Notificar", use_container_width=True, type="primary")
 
+with tab1:
+    # Registro masivo: para entregas grandes, un CSV con una fila por paquete
+    with st.expander("📥 Registro masivo (CSV)"):
+        st.caption(
+            "Una fila por paquete con las columnas de la plantilla. Los códigos de retiro "
+            "los genera el sistema y cada destinatario recibe un solo aviso con todos sus paquetes."
+        )
+        st.download_button(
+            "📄 Descargar plantilla",
+            data=PLANTILLA_REGISTRO_MASIVO.encode("utf-8-sig"),
+            file_name="plantilla_registro_masivo.csv",
+            mime="text/csv",
+        )
+        archivo_masivo = st.file_uploader("Archivo CSV", type=["csv"], key="archivo_registro_masivo")
+
+        if archivo_masivo is not None and st.button("✅ Registrar y Notificar todos", type="primary", key="registrar_masivo"):
+            with st.spinner('⏳ Procesando registro masivo...'):
+                try:
+                    r = requests.post(
+                        f"{BACKEND_URL}/register/bulk",
+                        data=archivo_masivo.getvalue(),
+                        headers={"Content-Type": "text/csv"},
+                        timeout=120
+                    )
+                    if r.status_code == 200:
+                        data = r.json()
+                        sincronizar_paquetes(forzar=True)
+                        st.success(f"✅ {data['registrados']} paquetes registrados · {data['notificaciones']} notificaciones encoladas")
+                        st.dataframe(
+                            [{"Código": p['codigo']} for p in data['paquetes']],
+                            use_container_width=True, hide_index=True
+                        )
+                    elif r.status_code == 422:
+                        st.error("❌ El archivo tiene filas inválidas; no se registró ningún paquete:")
+                        for error in r.json().get('detail', []):
+                            st.caption(f"• {error}")
+                    else:
+                        st.error(f"❌ Error del backend: {r.status_code} — {r.text}")
+                except Exception as e:
+                    st.error(f"❌ No se pudo conectar al backend: {e}")
+
 if submitted:
     required = [sucursal, recepcionista, proveedor, tipoDocumento, numeroDocumento, destinatarioNombre, destinatarioEmail]
     if any(not x for x in required):
         st.error("⚠️ Complete todos los campos obligatorios.")
         st.stop()
 
-    # Generar código de retiro automáticamente
-    now = get_chile_time()
-    y = str(now.year)[-2:]
-    m = f"{now.month:02d}"
-    d = f"{now.day:02d}"
-    rand = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    codigoRetiro = f"PK-{y}{m}{d}-{rand}"
-
+    # El código de retiro lo asigna el backend (correlativo del día)
     payload = {
         "sucursal": sucursal,
         "recepcionista": recepcionista,
@@ -870,7 +935,6 @@ if submitted:
         "medioNotificacion": medioNotificacion,
         "observaciones": observaciones,
         "adjuntoUrl": adjuntoUrl,
-        "codigoRetiro": codigoRetiro,
         "fechaRecepcion": get_chile_time().strftime("%Y-%m-%d"),
         "horaRecepcion": get_chile_time().strftime("%H:%M:%S"),
         "montoCheque": montoCheque,
@@ -882,9 +946,10 @@ if submitted:
             r = requests.post(f"{BACKEND_URL}/register", json=payload, timeout=30)
             if r.status_code == 200:
                 data = r.json()
+                codigoRetiro = data['codigoRetiro']
 
-                # Recargar paquetes desde el backend
-                st.session_state['historial'] = cargar_paquetes_desde_backend()
+                # Traer del backend solo el paquete recién registrado
+                sincronizar_paquetes(forzar=True)
                 st.session_state['ultimo_registro'] = data
 
                 # Mostrar mensaje de éxito
@@ -919,15 +984,8 @@ with tab2:
 
     if st.button("🔎 Buscar", type="primary"):
         if buscar_codigo:
-            # Buscar en el historial local primero
-            codigo_normalizado = buscar_codigo.strip().upper()
-            paquete_encontrado = None
-
-            for pkg in st.session_state['historial']:
-                codigo_pkg = pkg.get('CodigoRetiro') or pkg.get('codigoRetiro', '')
-                if codigo_pkg.upper() == codigo_normalizado:
-                    paquete_encontrado = pkg
-                    break
+            codigo_normalizado = normalizar_codigo(buscar_codigo)
+            paquete_encontrado = buscar_paquete_por_codigo(codigo_normalizado)
 
             if paquete_encontrado:
                 # Mostrar información del paquete en tarjeta
@@ -939,19 +997,19 @@ with tab2:
 
                 with col1:
                     st.markdown("### 📦 Información del Paquete")
-                    st.markdown(f"**🔖 Código:** {paquete_encontrado.get('CodigoRetiro') or paquete_encontrado.get('codigoRetiro', 'N/A')}")
-                    st.markdown(f"**📅 Fecha Recepción:** {paquete_encontrado.get('FechaRecepcion') or paquete_encontrado.get('fechaRecepcion', 'N/A')}")
-                    st.markdown(f"**🕐 Hora:** {paquete_encontrado.get('HoraRecepcion') or paquete_encontrado.get('horaRecepcion', 'N/A')}")
-                    st.markdown(f"**📍 Sucursal:** {paquete_encontrado.get('Sucursal') or paquete_encontrado.get('sucursal', 'N/A')}")
-                    st.markdown(f"**👤 Recepcionista:** {paquete_encontrado.get('Recepcionista') or paquete_encontrado.get('recepcionista', 'N/A')}")
+                    st.markdown(f"**🔖 Código:** {paquete_encontrado.codigo_retiro or 'N/A'}")
+                    st.markdown(f"**📅 Fecha Recepción:** {mostrar(paquete_encontrado.fecha_recepcion)}")
+                    st.markdown(f"**🕐 Hora:** {mostrar(paquete_encontrado.hora_recepcion)}")
+                    st.markdown(f"**📍 Sucursal:** {paquete_encontrado.sucursal or 'N/A'}")
+                    st.markdown(f"**👤 Recepcionista:** {paquete_encontrado.recepcionista or 'N/A'}")
 
                 with col2:
                     st.markdown("### 👥 Información del Destinatario")
-                    nombre_dest = paquete_encontrado.get('DestinatarioNombre') or paquete_encontrado.get('destinatarioNombre', 'N/A')
-                    email_dest = paquete_encontrado.get('DestinatarioEmail') or paquete_encontrado.get('destinatarioEmail', 'N/A')
+                    nombre_dest = paquete_encontrado.destinatario_nombre or 'N/A'
+                    email_dest = paquete_encontrado.destinatario_email or 'N/A'
                     st.markdown(f"**👤 Nombre:** {nombre_dest}")
                     st.markdown(f"**📧 Email:** {email_dest}")
-                    st.markdown(f"**🔔 Notificación:** {paquete_encontrado.get('MedioNotificacion') or paquete_encontrado.get('medioNotificacion', 'N/A')}")
+                    st.markdown(f"**🔔 Notificación:** {paquete_encontrado.medio_notificacion or 'N/A'}")
 
                 st.markdown("---")
 
@@ -960,23 +1018,23 @@ with tab2:
                 col3, col4 = st.columns(2)
 
                 with col3:
-                    st.markdown(f"**📋 Tipo:** {paquete_encontrado.get('TipoDocumento') or paquete_encontrado.get('tipoDocumento', 'N/A')}")
-                    st.markdown(f"**🔢 Número:** {paquete_encontrado.get('NumeroDocumento') or paquete_encontrado.get('numeroDocumento', 'N/A')}")
-                    st.markdown(f"**🚚 Proveedor:** {paquete_encontrado.get('Proveedor') or paquete_encontrado.get('proveedor', 'N/A')}")
+                    st.markdown(f"**📋 Tipo:** {paquete_encontrado.tipo_documento or 'N/A'}")
+                    st.markdown(f"**🔢 Número:** {paquete_encontrado.numero_documento or 'N/A'}")
+                    st.markdown(f"**🚚 Proveedor:** {paquete_encontrado.proveedor or 'N/A'}")
 
                 with col4:
                     # Información específica de cheques
-                    tipo_doc = paquete_encontrado.get('TipoDocumento') or paquete_encontrado.get('tipoDocumento', '')
+                    tipo_doc = paquete_encontrado.tipo_documento
                     if tipo_doc.lower() == 'cheque':
-                        monto = paquete_encontrado.get('MontoCheque') or paquete_encontrado.get('montoCheque', '')
-                        fecha_venc = paquete_encontrado.get('FechaVencimientoCheque') or paquete_encontrado.get('fechaVencimientoCheque', '')
+                        monto = paquete_encontrado.monto_cheque
+                        fecha_venc = mostrar(paquete_encontrado.fecha_vencimiento_cheque, '')
                         if monto:
                             st.markdown(f"**💵 Monto:** {monto}")
                         if fecha_venc:
                             st.markdown(f"**📆 Vencimiento:** {fecha_venc}")
 
                 # Observaciones
-                obs = paquete_encontrado.get('Observaciones') or paquete_encontrado.get('observaciones', '')
+                obs = paquete_encontrado.observaciones
                 if obs:
                     st.markdown("### 📝 Observaciones")
                     st.markdown(f"> {obs}")
@@ -1014,7 +1072,7 @@ with tab2:
 
                 with col7:
                     # Ver imagen adjunta (si existe)
-                    imagen_path = paquete_encontrado.get('ImagenPath') or paquete_encontrado.get('imagenPath', '')
+                    imagen_path = paquete_encontrado.imagen_path
                     if imagen_path:
                         if st.button("🖼️ Ver Imagen", use_container_width=True):
                             try:
@@ -1054,154 +1112,175 @@ with tab3:
     # Aplicar filtros
     from datetime import datetime, timedelta
     hoy = get_chile_time().strftime("%Y-%m-%d")
+    hoy_fecha = get_chile_time().date()
 
-    # Filtrar por fecha según selección
-    if filtro_dia == "Solo hoy":
-        registros_filtrados = [
-            r for r in st.session_state['historial']
-            if (r.get('FechaRecepcion') or r.get('fechaRecepcion', '')).startswith(hoy)
-        ]
-    elif filtro_dia == "Últimos 7 días":
-        hace_7_dias = (get_chile_time() - timedelta(days=7)).strftime("%Y-%m-%d")
-        registros_filtrados = [
-            r for r in st.session_state['historial']
-            if (r.get('FechaRecepcion') or r.get('fechaRecepcion', '')) >= hace_7_dias
-        ]
-    elif filtro_dia == "Últimos 30 días":
-        hace_30_dias = (get_chile_time() - timedelta(days=30)).strftime("%Y-%m-%d")
-        registros_filtrados = [
-            r for r in st.session_state['historial']
-            if (r.get('FechaRecepcion') or r.get('fechaRecepcion', '')) >= hace_30_dias
-        ]
-    else:  # Todos
-        registros_filtrados = st.session_state['historial']
+    # Filtrar por fecha según selección (posiciones precalculadas, ver conjuntos_del_dia)
+    historial, conjuntos = conjuntos_del_dia(hoy_fecha)
+    conjunto = {"Solo hoy": "hoy", "Últimos 7 días": "ultimos_7", "Últimos 30 días": "ultimos_30"}.get(filtro_dia)
 
-    # Aplicar búsqueda si hay texto
+    # Aplicar búsqueda si hay texto (en el backend, con el mismo rango de fechas)
     if busqueda_historial and len(busqueda_historial) >= 2:
-        busqueda_lower = busqueda_historial.lower()
-        registros_hoy = []
-        for r in registros_filtrados:
-            codigo = (r.get('CodigoRetiro') or r.get('codigoRetiro', '')).lower()
-            destinatario = (r.get('DestinatarioNombre') or r.get('destinatarioNombre', '')).lower()
-            numero_doc = (r.get('NumeroDocumento') or r.get('numeroDocumento', '')).lower()
-
-            if (busqueda_lower in codigo or
-                busqueda_lower in destinatario or
-                busqueda_lower in numero_doc):
-                registros_hoy.append(r)
+        fecha_minima = {
+            "Solo hoy": hoy,
+            "Últimos 7 días": (get_chile_time() - timedelta(days=7)).strftime("%Y-%m-%d"),
+            "Últimos 30 días": (get_chile_time() - timedelta(days=30)).strftime("%Y-%m-%d"),
+        }.get(filtro_dia)
+        busqueda = buscar_paquetes(busqueda_historial, fecha_minima, HISTORIAL_LIMITE_BUSQUEDA,
+                                   st.session_state.get('historial_cursor', 0))
+        if busqueda is None:
+            st.error("❌ No se pudo realizar la búsqueda en el backend.")
+        # La lista se muestra del último al primero: se invierte para que el
+        # resultado más relevante quede arriba
+        fuente = list(reversed(busqueda['packages'])) if busqueda else []
+        posiciones = range(len(fuente))
     else:
-        registros_hoy = registros_filtrados
+        fuente = historial
+        posiciones = conjuntos[conjunto] if conjunto else range(len(historial))
+    total = len(posiciones)
 
-    if registros_hoy:
+    if total:
         # Mensaje dinámico según filtros
         if busqueda_historial:
-            st.metric("📦 Resultados de búsqueda", len(registros_hoy))
+            # La búsqueda trae como máximo HISTORIAL_LIMITE_BUSQUEDA paquetes;
+            # el total real de coincidencias lo informa el backend
+            total_busqueda = busqueda.get('total', total) if busqueda else total
+            st.metric("📦 Resultados de búsqueda", total_busqueda)
+            if total_busqueda > total:
+                st.caption(f"Se muestran los {total} más relevantes de {total_busqueda}; "
+                           "afina la búsqueda para ver el resto")
         elif filtro_dia == "Solo hoy":
-            st.metric("📦 Registros de Hoy", len(registros_hoy))
+            st.metric("📦 Registros de Hoy", total)
         else:
-            st.metric(f"📦 Registros ({filtro_dia})", len(registros_hoy))
-
-        for i, registro in enumerate(reversed(registros_hoy), 1):
-            # Obtener valores con compatibilidad de nombres (Excel vs Frontend)
-            codigo = registro.get('CodigoRetiro') or registro.get('codigoRetiro', 'N/A')
-            destinatario = registro.get('DestinatarioNombre') or registro.get('destinatarioNombre', 'N/A')
-            sucursal = registro.get('Sucursal') or registro.get('sucursal', 'N/A')
-            email = registro.get('DestinatarioEmail') or registro.get('destinatarioEmail', 'N/A')
-            tipo_doc = registro.get('TipoDocumento') or registro.get('tipoDocumento', 'N/A')
-            numero_doc = registro.get('NumeroDocumento') or registro.get('numeroDocumento', 'N/A')
-            proveedor = registro.get('Proveedor') or registro.get('proveedor', 'N/A')
-            fecha = registro.get('FechaRecepcion') or registro.get('fechaRecepcion', 'N/A')
-            hora = registro.get('HoraRecepcion') or registro.get('horaRecepcion', 'N/A')
-            notif = registro.get('MedioNotificacion') or registro.get('medioNotificacion', 'N/A')
-            obs = registro.get('Observaciones') or registro.get('observaciones', '')
-
-            # Obtener estado del paquete
-            estado = registro.get('Estado') or registro.get('estado', 'Pendiente')
-            fecha_retiro = registro.get('FechaRetiro') or registro.get('fechaRetiro', '')
-            entregado_a = registro.get('EntregadoA') or registro.get('entregadoA', '')
-
-            # Color del expander según estado
-            estado_emoji = "✅" if estado == "Retirado" else "📦"
-            titulo_expander = f"{estado_emoji} #{len(registros_hoy) - i + 1} - {codigo} | {destinatario}"
-            if estado == "Retirado":
-                titulo_expander += f" (RETIRADO)"
-
-            with st.expander(titulo_expander, expanded=False):
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.markdown(f"**📍 Sucursal:** {sucursal}")
-                    st.markdown(f"**👤 Destinatario:** {destinatario}")
-                    st.markdown(f"**📧 Email:** {email}")
-                with col2:
-                    st.markdown(f"**📄 Tipo Doc:** {tipo_doc}")
-                    st.markdown(f"**🔢 Nº Doc:** {numero_doc}")
-                    st.markdown(f"**🚚 Proveedor:** {proveedor}")
-                with col3:
-                    st.markdown(f"**📅 Fecha:** {fecha}")
-                    st.markdown(f"**🕐 Hora:** {hora}")
-                    st.markdown(f"**🔔 Notif:** {notif}")
+            st.metric(f"📦 Registros ({filtro_dia})", total)
+
+        # Paginación: solo se arma la página visible, así el tiempo de
+        # render no depende del largo del historial. Al cambiar filtro o
+        # búsqueda se vuelve a la primera página.
+        paginas = (total - 1) // HISTORIAL_POR_PAGINA + 1
+        vista = (filtro_dia, busqueda_historial)
+        if st.session_state.get('historial_vista') != vista:
+            st.session_state['historial_vista'] = vista
+            st.session_state['historial_pagina'] = 1
+        st.session_state['historial_pagina'] = min(st.session_state.get('historial_pagina', 1), paginas)
+
+        col_pagina, col_rango = st.columns([1, 3])
+        with col_pagina:
+            pagina = st.number_input("Página", min_value=1, max_value=paginas, step=1, key="historial_pagina")
+        inicio = (pagina - 1) * HISTORIAL_POR_PAGINA
+        fin = min(inicio + HISTORIAL_POR_PAGINA, total)
+        with col_rango:
+            st.caption(f"Mostrando {inicio + 1}–{fin} de {total} (del más reciente al más antiguo) · página {pagina} de {paginas}")
+
+        # Del más reciente al más antiguo: la fila k es el registro #total-inicio-k
+        registros_pagina = [fuente[posiciones[total - 1 - j]] for j in range(inicio, fin)]
+        filas = [
+            {
+                "#": total - inicio - k,
+                "Estado": f"{'✅' if r.estado == 'Retirado' else '📦'} {r.estado}",
+                "Código": r.codigo_retiro,
+                "Destinatario": r.destinatario_nombre,
+                "Sucursal": r.sucursal,
+                "Tipo": r.tipo_documento,
+                "Nº Doc": r.numero_documento,
+                "Fecha": mostrar(r.fecha_recepcion, ''),
+                "Hora": mostrar(r.hora_recepcion, ''),
+            }
+            for k, r in enumerate(registros_pagina)
+        ]
+        # La clave incluye la vista y la página: al cambiarlas se limpia la selección
+        evento = st.dataframe(
+            filas,
+            key=f"tabla_historial_{hash(vista)}_{pagina}",
+            on_select="rerun",
+            selection_mode="single-row",
+            hide_index=True,
+            use_container_width=True,
+        )
+        seleccion = evento["selection"]["rows"]
 
-                if obs:
-                    st.markdown(f"**📝 Observaciones:** {obs}")
+        if not seleccion:
+            st.caption("👆 Selecciona una fila para ver el detalle o registrar el retiro")
+        else:
+            registro = registros_pagina[seleccion[0]]
+            codigo = registro.codigo_retiro or 'N/A'
+            estado = registro.estado
+
+            st.markdown(f"#### {'✅' if estado == 'Retirado' else '📦'} {codigo} | {registro.destinatario_nombre or 'N/A'}")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.markdown(f"**📍 Sucursal:** {registro.sucursal or 'N/A'}")
+                st.markdown(f"**👤 Destinatario:** {registro.destinatario_nombre or 'N/A'}")
+                st.markdown(f"**📧 Email:** {registro.destinatario_email or 'N/A'}")
+            with col2:
+                st.markdown(f"**📄 Tipo Doc:** {registro.tipo_documento or 'N/A'}")
+                st.markdown(f"**🔢 Nº Doc:** {registro.numero_documento or 'N/A'}")
+                st.markdown(f"**🚚 Proveedor:** {registro.proveedor or 'N/A'}")
+            with col3:
+                st.markdown(f"**📅 Fecha:** {mostrar(registro.fecha_recepcion)}")
+                st.markdown(f"**🕐 Hora:** {mostrar(registro.hora_recepcion)}")
+                st.markdown(f"**🔔 Notif:** {registro.medio_notificacion or 'N/A'}")
+
+            if registro.observaciones:
+                st.markdown(f"**📝 Observaciones:** {registro.observaciones}")
+
+            # Sección de retiro
+            st.markdown("---")
+            if estado == "Retirado":
+                st.success(f"✅ **Paquete Retirado**")
+                st.markdown(f"**📅 Fecha de Retiro:** {mostrar(registro.fecha_retiro, '')}")
+                st.markdown(f"**👤 Retirado por:** {registro.entregado_a}")
+            else:
+                st.info("📦 **Paquete Pendiente de Retiro**")
+
+                # Un único formulario de retiro, para la fila seleccionada
+                with st.form(key="form_retiro", clear_on_submit=True):
+                    nombre_retira = st.text_input(
+                        f"Nombre de quien retira {codigo}",
+                        placeholder="Ej: Juan Pérez",
+                        key="nombre_retira"
+                    )
 
-                # Sección de retiro
-                st.markdown("---")
-                if estado == "Retirado":
-                    st.success(f"✅ **Paquete Retirado**")
-                    st.markdown(f"**📅 Fecha de Retiro:** {fecha_retiro}")
-                    st.markdown(f"**👤 Retirado por:** {entregado_a}")
-                else:
-                    st.info("📦 **Paquete Pendiente de Retiro**")
-
-                    # Formulario para marcar como retirado
-                    with st.form(key=f"form_retiro_{codigo}"):
-                        nombre_retira = st.text_input(
-                            "Nombre de quien retira",
-                            placeholder="Ej: Juan Pérez",
-                            key=f"nombre_retira_{codigo}"
+                    col_btn1, col_btn2 = st.columns([1, 1])
+                    with col_btn1:
+                        submit_retiro = st.form_submit_button(
+                            "✅ Marcar como Retirado",
+                            type="primary",
+                            use_container_width=True
                         )
 
-                        col_btn1, col_btn2 = st.columns([1, 1])
-                        with col_btn1:
-                            submit_retiro = st.form_submit_button(
-                                "✅ Marcar como Retirado",
-                                type="primary",
-                                use_container_width=True
-                            )
-
-                        if submit_retiro:
-                            if nombre_retira and len(nombre_retira.strip()) > 0:
-                                try:
-                                    # Llamar al endpoint de retiro
-                                    response = requests.post(
-                                        f"{BACKEND_URL}/withdraw",
-                                        json={
-                                            "codigo_retiro": codigo,
-                                            "entregado_a": nombre_retira.strip()
-                                        },
-                                        timeout=5
-                                    )
-
-                                    if response.status_code == 200:
-                                        result = response.json()
-                                        if result.get('success'):
-                                            st.success(f"✅ {result.get('message')}")
-                                            # Recargar datos
-                                            st.session_state['historial'] = cargar_paquetes_desde_backend()
-                                            st.rerun()
-                                        else:
-                                            st.warning(f"⚠️ {result.get('message')}")
+                    if submit_retiro:
+                        if nombre_retira and len(nombre_retira.strip()) > 0:
+                            try:
+                                # Llamar al endpoint de retiro
+                                response = requests.post(
+                                    f"{BACKEND_URL}/withdraw",
+                                    json={
+                                        "codigo_retiro": codigo,
+                                        "entregado_a": nombre_retira.strip()
+                                    },
+                                    timeout=5
+                                )
+
+                                if response.status_code == 200:
+                                    result = response.json()
+                                    if result.get('success'):
+                                        st.success(f"✅ {result.get('message')}")
+                                        # Traer solo el paquete modificado
+                                        sincronizar_paquetes(forzar=True)
+                                        st.rerun()
                                     else:
-                                        st.error(f"❌ Error: {response.status_code}")
-                                except Exception as e:
-                                    st.error(f"❌ Error al marcar como retirado: {e}")
-                            else:
-                                st.error("⚠️ Ingrese el nombre de quien retira el paquete")
+                                        st.warning(f"⚠️ {result.get('message')}")
+                                else:
+                                    st.error(f"❌ Error: {response.status_code}")
+                            except Exception as e:
+                                st.error(f"❌ Error al marcar como retirado: {e}")
+                        else:
+                            st.error("⚠️ Ingrese el nombre de quien retira el paquete")
 
     else:
         st.markdown("📭 No hay registros del día de hoy")
-        if st.session_state['historial']:
-            st.caption(f"💡 Hay {len(st.session_state['historial'])} registros de días anteriores")
+        if historial:
+            st.caption(f"💡 Hay {len(historial)} registros de días anteriores")
 
 with tab4:
     st.subheader("📊 Dashboard de Reportes y Estadísticas")
@@ -1210,52 +1289,42 @@ with tab4:
     import plotly.express as px
     import plotly.graph_objects as go
     from datetime import datetime, timedelta
-    from collections import Counter
-    from io import BytesIO
-
-    # Crear DataFrame de todos los paquetes
-    if st.session_state['historial']:
-        df = pd.DataFrame(st.session_state['historial'])
-
-        # Normalizar nombres de columnas (compatibilidad frontend/backend)
-        if 'FechaRecepcion' in df.columns and 'fechaRecepcion' not in df.columns:
-            df['fechaRecepcion'] = df['FechaRecepcion']
-        if 'fechaRecepcion' in df.columns and 'FechaRecepcion' not in df.columns:
-            df['FechaRecepcion'] = df['fechaRecepcion']
-
-        # Convertir fechas
-        df['fecha'] = pd.to_datetime(df['fechaRecepcion'] if 'fechaRecepcion' in df.columns else df['FechaRecepcion'], errors='coerce')
-        df['estado'] = df.get('Estado', df.get('estado', 'Pendiente'))
-        df['sucursal'] = df.get('Sucursal', df.get('sucursal', 'N/A'))
-        df['tipoDoc'] = df.get('TipoDocumento', df.get('tipoDocumento', 'N/A'))
-
-        # Filtros
-        st.markdown("### 🔍 Filtros")
-        col_f1, col_f2, col_f3 = st.columns(3)
-
-        with col_f1:
-            fecha_desde = st.date_input("Desde", value=datetime.now() - timedelta(days=30))
-        with col_f2:
-            fecha_hasta = st.date_input("Hasta", value=datetime.now())
-        with col_f3:
-            sucursal_filtro = st.multiselect("Sucursal", options=df['sucursal'].unique().tolist(), default=df['sucursal'].unique().tolist())
-
-        # Aplicar filtros
-        df_filtrado = df[
-            (df['fecha'] >= pd.Timestamp(fecha_desde)) &
-            (df['fecha'] <= pd.Timestamp(fecha_hasta)) &
-            (df['sucursal'].isin(sucursal_filtro))
-        ]
 
+    # Filtros
+    st.markdown("### 🔍 Filtros")
+    col_f1, col_f2, col_f3 = st.columns(3)
+
+    with col_f1:
+        fecha_desde = st.date_input("Desde", value=datetime.now() - timedelta(days=30))
+    with col_f2:
+        fecha_hasta = st.date_input("Hasta", value=datetime.now())
+
+    # Primero sin filtro de sucursal: trae también la lista de sucursales
+    # para el selector y, si están todas seleccionadas, sirve tal cual
+    cursor_datos = st.session_state.get('historial_cursor', 0)
+    stats = obtener_estadisticas(fecha_desde, fecha_hasta, (), cursor_datos)
+    todas_sucursales = stats.get('sucursales', []) if stats else []
+
+    with col_f3:
+        sucursal_filtro = st.multiselect("Sucursal", options=todas_sucursales, default=todas_sucursales)
+
+    if stats and set(sucursal_filtro) != set(todas_sucursales):
+        stats = obtener_estadisticas(fecha_desde, fecha_hasta, tuple(sorted(sucursal_filtro)), cursor_datos) if sucursal_filtro else None
+
+    if stats is None and not sucursal_filtro and todas_sucursales:
+        st.info("Selecciona al menos una sucursal.")
+    elif stats is None:
+        st.error("❌ No se pudieron obtener las estadísticas del backend.")
+    elif todas_sucursales:
         st.markdown("---")
 
         # Métricas principales
         st.markdown("### 📈 Métricas Clave")
         col_m1, col_m2, col_m3, col_m4 = st.columns(4)
 
-        total_paquetes = len(df_filtrado)
-        pendientes = len(df_filtrado[df_filtrado['estado'] != 'Retirado'])
-        retirados = len(df_filtrado[df_filtrado['estado'] == 'Retirado'])
+        total_paquetes = stats['total']
+        pendientes = stats['pendientes']
+        retirados = stats['retirados']
         tasa_retiro = (retirados / total_paquetes * 100) if total_paquetes > 0 else 0
 
         with col_m1:
@@ -1274,9 +1343,7 @@ with tab4:
 
         with col_g1:
             st.markdown("#### 📅 Paquetes por Día")
-            # Agrupar por fecha
-            paquetes_por_dia = df_filtrado.groupby(df_filtrado['fecha'].dt.date).size().reset_index()
-            paquetes_por_dia.columns = ['Fecha', 'Cantidad']
+            paquetes_por_dia = pd.DataFrame(stats['por_dia'], columns=['Fecha', 'Cantidad'])
 
             fig_linea = px.line(paquetes_por_dia, x='Fecha', y='Cantidad',
                                markers=True,
@@ -1293,8 +1360,7 @@ with tab4:
 
         with col_g2:
             st.markdown("#### 📍 Por Sucursal")
-            sucursal_counts = df_filtrado['sucursal'].value_counts().reset_index()
-            sucursal_counts.columns = ['Sucursal', 'Cantidad']
+            sucursal_counts = pd.DataFrame(stats['por_sucursal'], columns=['Sucursal', 'Cantidad'])
 
             fig_pie = px.pie(sucursal_counts, values='Cantidad', names='Sucursal',
                             title="",
@@ -1311,8 +1377,7 @@ with tab4:
 
         with col_g3:
             st.markdown("#### 📄 Por Tipo de Documento")
-            tipo_counts = df_filtrado['tipoDoc'].value_counts().reset_index()
-            tipo_counts.columns = ['Tipo', 'Cantidad']
+            tipo_counts = pd.DataFrame(stats['por_tipo'], columns=['Tipo', 'Cantidad'])
 
             fig_bar = px.bar(tipo_counts, x='Tipo', y='Cantidad',
                            title="",
@@ -1330,8 +1395,7 @@ with tab4:
 
         with col_g4:
             st.markdown("#### 📊 Estado de Paquetes")
-            estado_counts = df_filtrado['estado'].value_counts().reset_index()
-            estado_counts.columns = ['Estado', 'Cantidad']
+            estado_counts = pd.DataFrame(stats['por_estado'], columns=['Estado', 'Cantidad'])
 
             fig_donut = px.pie(estado_counts, values='Cantidad', names='Estado',
                               title="",
@@ -1351,45 +1415,48 @@ with tab4:
 
         with col_t1:
             st.markdown("#### 🏆 Top 5 Destinatarios")
-            destinatarios = df_filtrado.get('DestinatarioNombre', df_filtrado.get('destinatarioNombre', pd.Series(dtype=str)))
-            if not destinatarios.empty:
-                top_dest = destinatarios.value_counts().head(5)
-                for i, (nombre, count) in enumerate(top_dest.items(), 1):
-                    st.markdown(f"{i}. **{nombre}**: {count} paquetes")
+            for i, (nombre, count) in enumerate(stats['top_destinatarios'], 1):
+                st.markdown(f"{i}. **{nombre}**: {count} paquetes")
 
         with col_t2:
             st.markdown("#### 📦 Top 5 Proveedores")
-            proveedores = df_filtrado.get('Proveedor', df_filtrado.get('proveedor', pd.Series(dtype=str)))
-            if not proveedores.empty:
-                top_prov = proveedores.value_counts().head(5)
-                for i, (nombre, count) in enumerate(top_prov.items(), 1):
-                    st.markdown(f"{i}. **{nombre}**: {count} paquetes")
+            for i, (nombre, count) in enumerate(stats['top_proveedores'], 1):
+                st.markdown(f"{i}. **{nombre}**: {count} paquetes")
 
         st.markdown("---")
 
-        # Exportar a Excel
+        # Exportar: el archivo lo genera el backend (/export) solo al pedirlo
         st.markdown("### 📥 Exportar Datos")
 
         col_e1, col_e2 = st.columns([3, 1])
         with col_e1:
-            st.markdown("Descarga todos los paquetes filtrados en formato Excel")
-        with col_e2:
-            # Preparar datos para exportar
-            df_export = df_filtrado[[c for c in df_filtrado.columns if c not in ['fecha', 'estado', 'sucursal', 'tipoDoc']]].copy()
-
-            # Crear Excel en memoria
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df_export.to_excel(writer, index=False, sheet_name='Paquetes')
-            output.seek(0)
-
-            st.download_button(
-                label="📥 Descargar Excel",
-                data=output.getvalue(),
-                file_name=f"paquetes_{fecha_desde}_{fecha_hasta}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
+            st.markdown("Descarga todos los paquetes filtrados. El archivo se genera al presionar **Generar archivo**.")
+            formato_export = st.radio(
+                "Formato", list(FORMATOS_EXPORTACION), horizontal=True,
+                format_func=lambda f: FORMATOS_EXPORTACION[f][0], key="formato_export"
             )
+        with col_e2:
+            sucursales_export = () if set(sucursal_filtro) == set(todas_sucursales) else tuple(sorted(sucursal_filtro))
+            clave_export = (formato_export, fecha_desde, fecha_hasta, sucursales_export, cursor_datos)
+
+            if st.button("📦 Generar archivo", use_container_width=True):
+                with st.spinner("Generando archivo..."):
+                    contenido = descargar_exportacion(formato_export, fecha_desde, fecha_hasta, sucursales_export)
+                if contenido is None:
+                    st.error("❌ No se pudo generar el archivo.")
+                st.session_state['exportacion'] = (clave_export, contenido) if contenido is not None else None
+
+            # El botón de descarga solo aparece si el archivo corresponde a los filtros actuales
+            exportacion = st.session_state.get('exportacion')
+            if exportacion and exportacion[0] == clave_export:
+                etiqueta, mime = FORMATOS_EXPORTACION[formato_export]
+                st.download_button(
+                    label=f"📥 Descargar {etiqueta}",
+                    data=exportacion[1],
+                    file_name=f"paquetes_{fecha_desde}_{fecha_hasta}.{formato_export}",
+                    mime=mime,
+                    use_container_width=True
+                )
 
     else:
         st.info("📭 No hay datos para mostrar. Registra algunos paquetes primero.")
@@ -1398,16 +1465,15 @@ with tab5:
     st.subheader("💬 Asistente Virtual Inteligente")
 
     # Generar preguntas sugeridas dinámicas basadas en los datos del día
-    def generar_preguntas_dinamicas(historial):
+    def generar_preguntas_dinamicas(historial, posiciones_hoy):
         """Genera preguntas sugeridas basadas en los datos actuales del sistema"""
         from datetime import datetime
         from collections import Counter
 
         preguntas = []
-        hoy = get_chile_time().strftime("%Y-%m-%d")
 
-        # Filtrar paquetes de hoy
-        paquetes_hoy = [p for p in historial if (p.get('FechaRecepcion') or p.get('fechaRecepcion', '')).startswith(hoy)]
+        # Paquetes de hoy
+        paquetes_hoy = [historial[i] for i in posiciones_hoy]
 
         if not historial:
             return [
@@ -1436,7 +1502,7 @@ with tab5:
 
         # 2. Tipo de documento más común de hoy
         if paquetes_hoy:
-            tipos = [p.get('TipoDocumento') or p.get('tipoDocumento', '') for p in paquetes_hoy]
+            tipos = [p.tipo_documento for p in paquetes_hoy]
             tipo_mas_comun = Counter(tipos).most_common(1)[0][0] if tipos else None
             if tipo_mas_comun and tipo_mas_comun.lower() != 'paquete':
                 preguntas.append(f"¿Cuántos {tipo_mas_comun.lower()}s hay hoy?")
@@ -1447,7 +1513,7 @@ with tab5:
 
         # 3. Sucursal con más actividad de hoy
         if paquetes_hoy:
-            sucursales = [p.get('Sucursal') or p.get('sucursal', '') for p in paquetes_hoy]
+            sucursales = [p.sucursal for p in paquetes_hoy]
             sucursal_top = Counter(sucursales).most_common(1)[0][0] if sucursales else None
             if sucursal_top:
                 preguntas.append(f"Paquetes en {sucursal_top}")
@@ -1458,7 +1524,7 @@ with tab5:
 
         # 4. Destinatario más frecuente de hoy (si hay al menos 2 del mismo)
         if paquetes_hoy:
-            destinatarios = [p.get('DestinatarioNombre') or p.get('destinatarioNombre', '') for p in paquetes_hoy]
+            destinatarios = [p.destinatario_nombre for p in paquetes_hoy]
             dest_contador = Counter(destinatarios)
             dest_top = dest_contador.most_common(1)[0] if dest_contador else (None, 0)
             if dest_top[1] >= 2:  # Si tiene 2 o más paquetes
@@ -1477,7 +1543,7 @@ with tab5:
 
         # 6. Siempre útil - enviar recordatorio al último destinatario
         if paquetes_hoy:
-            ultimo_dest = paquetes_hoy[-1].get('DestinatarioNombre') or paquetes_hoy[-1].get('destinatarioNombre', '')
+            ultimo_dest = paquetes_hoy[-1].destinatario_nombre
             if ultimo_dest:
                 nombre_corto = ultimo_dest.split()[0]
                 preguntas.append(f"Enviar recordatorio a {nombre_corto}")
@@ -1489,7 +1555,8 @@ with tab5:
         # Limitar a 6 preguntas
         return preguntas[:6]
 
-    preguntas_dinamicas = generar_preguntas_dinamicas(st.session_state['historial'])
+    historial, conjuntos = conjuntos_del_dia(get_chile_time().date())
+    preguntas_dinamicas = generar_preguntas_dinamicas(historial, conjuntos['hoy'])
 
     # Sección de preguntas sugeridas dinámicas
     st.markdown("### 💡 Preguntas sugeridas:")
@@ -1521,7 +1588,8 @@ with tab5:
         with st.spinner("🤔 Pensando..."):
             try:
                 # Usar chatbot inteligente
-                respuesta, tipo = chatbot_inteligente(pregunta_a_procesar, st.session_state['historial'])
+                snapshot = obtener_store(BACKEND_URL).snapshot()
+                respuesta, tipo = chatbot_inteligente(pregunta_a_procesar, snapshot.paquetes, snapshot.indice_codigos)
 
                 # Guardar en historial de chat
                 st.session_state['chat_history'].append({